@@ -0,0 +1,185 @@
+"""
+Index of companies by economic activity (CNAE code).
+
+`clean_cnpj_info_dataset.py` writes the activities of the companies as:
+
+    * `data/cnae.xz`: dimension table with the integer CNAE code (e.g.
+      5611201 for `56.11-2-01`), the formatted code and its description
+    * `data/company-activities.xz`: bridge table with a row per company and
+      activity: `company_id` (row of the company in `data/companies.xz`),
+      `rank` (0 for the main activity) and `cnae`
+    * `data/company-activities-index.npz`: the bridge sorted by CNAE code
+      with the offsets of each code, so finding the companies with a given
+      activity is a binary search plus a slice
+
+Use `companies_with` to get the companies of some activities and
+`reimbursements_with` to get the reimbursements paid to them.
+"""
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+import cnpj_cpf
+from dataset_store import read_dataset
+
+
+CNAE_PATH = os.path.join('data', 'cnae.xz')
+ACTIVITIES_PATH = os.path.join('data', 'company-activities.xz')
+INDEX_PATH = os.path.join('data', 'company-activities-index.npz')
+COMPANIES_PATH = os.path.join('data', 'companies.xz')
+
+
+def cnae_code(values):
+    """
+    :param values: (iterable) CNAE codes as text (e.g. `56.11-2-01`)
+    :return: (numpy.ndarray) `int32` codes (e.g. 5611201), 0 when missing or
+        invalid
+    """
+    values = pd.Series(values).astype(str).str.replace(r'\D', '', regex=True)
+    codes = pd.to_numeric(values.where(values.str.len() == 7), 'coerce')
+    return codes.fillna(0).to_numpy(dtype=np.int32)
+
+
+def format_cnae(codes):
+    """Formats `int32` CNAE codes back to text (e.g. `56.11-2-01`)."""
+    codes = np.char.zfill(np.asarray(codes).astype(str), 7)
+    return np.array(['{}.{}-{}-{}'.format(c[:2], c[2:4], c[4], c[5:])
+                     for c in codes], dtype=object)
+
+
+class SortedIndex:
+    """
+    Maps keys to row numbers keeping the rows sorted by key together with
+    the first position of each distinct key, so looking a key up is a binary
+    search followed by a slice of its rows.
+    """
+
+    def __init__(self, keys, starts, rows):
+        """
+        :param keys: (numpy.ndarray) sorted distinct keys
+        :param starts: (numpy.ndarray) position in `rows` where the rows of
+            each key start
+        :param rows: (numpy.ndarray) row numbers sorted by their key
+        """
+        self.keys = keys
+        self.starts = starts
+        self.ends = np.append(starts[1:], len(rows)).astype(starts.dtype)
+        self.rows = rows
+
+    @classmethod
+    def build(cls, keys, rows=None):
+        """
+        :param keys: (iterable) key of each row
+        :param rows: (iterable) row numbers (default: 0 to len(keys) - 1)
+        """
+        keys = np.asarray(keys)
+        rows = np.arange(len(keys)) if rows is None else np.asarray(rows)
+        order = np.argsort(keys, kind='mergesort')
+        keys, starts = np.unique(keys[order], return_index=True)
+        return cls(keys, starts, rows[order])
+
+    def positions(self, keys):
+        """Positions of `keys` in `self.keys` (-1 for missing keys)."""
+        keys = np.atleast_1d(keys)
+        if not len(self.keys):
+            return np.full(len(keys), -1)
+        positions = np.searchsorted(self.keys, keys)
+        positions = positions.clip(max=len(self.keys) - 1)
+        return np.where(self.keys[positions] == keys, positions, -1)
+
+    def lookup(self, keys):
+        """Row numbers of all the rows matching any of the given keys."""
+        positions = self.positions(np.unique(keys))
+        positions = positions[positions >= 0]
+        slices = [self.rows[self.starts[p]:self.ends[p]] for p in positions]
+        if not slices:
+            return self.rows[:0]
+        return np.concatenate(slices)
+
+    def save(self, path):
+        np.savez(path, keys=self.keys, starts=self.starts, rows=self.rows)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['keys'], data['starts'], data['rows'])
+
+
+def build_index(activities, path=INDEX_PATH):
+    """
+    Creates (and saves) the index of company rows by CNAE code from the
+    bridge table of company activities.
+    """
+    index = SortedIndex.build(activities['cnae'].values,
+                              activities['company_id'].values)
+    index.save(path)
+    return index
+
+
+def load_index(path=INDEX_PATH, activities_path=ACTIVITIES_PATH):
+    """Loads the index, rebuilding it if it is missing or outdated."""
+    if os.path.isfile(path) and (
+            not os.path.isfile(activities_path) or
+            os.path.getmtime(path) >= os.path.getmtime(activities_path)):
+        return SortedIndex.load(path)
+
+    activities = read_dataset(activities_path, columns=('company_id', 'cnae'))
+    return build_index(activities, path)
+
+
+def companies_with(codes, index=None):
+    """
+    :param codes: (iterable) CNAE codes, as text or `int32`
+    :param index: (SortedIndex) defaults to `load_index()`
+    :return: (numpy.ndarray) sorted distinct rows of the companies (in
+        `data/companies.xz`) with any of these activities
+    """
+    index = index or load_index()
+    codes = np.atleast_1d(codes)
+    if codes.dtype.kind not in 'iu':
+        codes = cnae_code(codes)
+    return np.unique(index.lookup(codes))
+
+
+def cnpj_index(reimbursements):
+    """
+    Index of the rows of `reimbursements` by CNPJ/CPF key, leaving out the
+    ones without a valid CNPJ/CPF (`cnpj_cpf.INVALID`), which would
+    otherwise match every company without a valid CNPJ.
+    """
+    keys = cnpj_cpf.keys(reimbursements['cnpj_cpf'])
+    rows = np.flatnonzero(keys != cnpj_cpf.INVALID)
+    return SortedIndex.build(keys[rows], rows)
+
+
+def reimbursements_with(codes, reimbursements, companies, index=None,
+                        by_cnpj=None):
+    """
+    :param codes: (iterable) CNAE codes, as text or `int32`
+    :param reimbursements: (pandas.DataFrame) with a `cnpj_cpf` column
+    :param companies: (pandas.DataFrame) the `data/companies.xz` dataset
+    :param index: (SortedIndex) defaults to `load_index()`
+    :param by_cnpj: (SortedIndex) `cnpj_index(reimbursements)`, pass it when
+        looking up several activities in the same reimbursements
+    :return: (pandas.DataFrame) reimbursements paid to companies with any of
+        these activities
+    """
+    rows = companies_with(codes, index)
+    cnpjs = cnpj_cpf.keys(companies['cnpj'].values[rows])
+    by_cnpj = by_cnpj or cnpj_index(reimbursements)
+    return reimbursements.iloc[np.sort(by_cnpj.lookup(cnpjs))]
+
+
+if __name__ == '__main__':
+    description = 'Lists the companies with any of the given activities.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('codes', nargs='+',
+                        help='CNAE codes (e.g. 56.11-2-01 or 5611201)')
+    args = parser.parse_args()
+
+    rows = companies_with(args.codes)
+    columns = ('cnpj', 'name', 'trade_name', 'city', 'state')
+    companies = read_dataset(COMPANIES_PATH, columns=columns)
+    print(companies.iloc[rows].to_string(index=False))
@@ -0,0 +1,285 @@
+"""
+Anomaly scores of the daily meal expenses of congresspeople, based on their
+travel features (`data/YYYY-MM-DD-travel-features.xz`, created by
+`travel_features.py`).
+
+    * `fit` trains the MODELS (IsolationForest and, with scikit-learn 0.20
+      or newer, Local Outlier Factor) on the standardized predictors of
+      every day and saves them, with their scalers, to
+      `data/anomaly-models.pkl`
+    * `score` writes `data/YYYY-MM-DD-anomaly-scores.xz` with a score (the
+      higher, the more anomalous) and an anomaly flag per model for each
+      congressperson and day
+
+Days are scored in batches split among processes. When the newest anomaly
+scores dataset exists, only days whose travel features changed (according
+to their fingerprint) or that were scored by other fitted models are scored
+again, so scoring costs as much as the new days.
+"""
+import datetime
+import os
+import pickle
+from argparse import ArgumentParser
+from inspect import signature
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.preprocessing import StandardScaler
+
+from catalog import newest_file
+from dataset_store import read_dataset, write_dataset
+from schema import cast
+from travel_features import KEYS
+
+try:
+    from sklearn.neighbors import LocalOutlierFactor
+except ImportError:  # added in scikit-learn 0.19
+    LocalOutlierFactor = None
+
+# scoring days it was not fitted with (`novelty`) needs scikit-learn 0.20
+if LocalOutlierFactor is not None and \
+        'novelty' not in signature(LocalOutlierFactor).parameters:
+    LocalOutlierFactor = None
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(BASE_DIR, 'data')
+DATE = datetime.date.today().strftime('%Y-%m-%d')
+FILE_BASE_NAME = '{}-anomaly-scores.xz'.format(DATE)
+MODELS_PATH = os.path.join(DATA_PATH, 'anomaly-models.pkl')
+
+PREDICTORS = ['expenses', 'distance_traveled']
+CONTAMINATION = .001
+BATCH_SIZE = 50000
+
+
+def isolation_forest():
+    return IsolationForest(contamination=CONTAMINATION, random_state=0)
+
+
+def local_outlier_factor():
+    return LocalOutlierFactor(contamination=CONTAMINATION, novelty=True)
+
+
+MODELS = {'isolation_forest': isolation_forest}
+if LocalOutlierFactor is not None:
+    MODELS['lof'] = local_outlier_factor
+
+
+class AnomalyModel:
+
+    def __init__(self, name, predictors=PREDICTORS):
+        """
+        :param name: (str) one of MODELS
+        :param predictors: (list) travel features used as predictors
+        """
+        self.name = name
+        self.predictors = list(predictors)
+        self.scaler = StandardScaler()
+        self.model = MODELS[name]()
+        self.version = None
+
+    def matrix(self, features):
+        values = features[self.predictors].values.astype(np.float64)
+        return np.nan_to_num(values)
+
+    def fit(self, features):
+        """
+        :param features: (pandas.DataFrame) travel features
+        :return: (AnomalyModel) itself, fitted
+        """
+        values = self.scaler.fit_transform(self.matrix(features))
+        self.model.fit(values)
+        self.version = '{}@{}'.format(
+            self.name, datetime.datetime.now().isoformat())
+        return self
+
+    def score(self, features):
+        """
+        :param features: (pandas.DataFrame) travel features
+        :return: (tuple) arrays with the score (the higher, the more
+            anomalous) and whether each row is an anomaly
+        """
+        if features.empty:
+            return np.zeros(0), np.zeros(0, dtype=bool)
+        values = self.scaler.transform(self.matrix(features))
+        scores = -self.model.decision_function(values)
+        return scores, self.model.predict(values) == -1
+
+
+def fit(features, names=None):
+    """
+    :param features: (pandas.DataFrame) travel features
+    :param names: (iterable) MODELS to fit (default: all of them)
+    :return: (dict) fitted AnomalyModel per name
+    """
+    names = names or list(MODELS)
+    return {name: AnomalyModel(name).fit(features) for name in names}
+
+
+def save_models(models, path=MODELS_PATH):
+    with open(path, 'wb') as fh:
+        pickle.dump(models, fh, pickle.HIGHEST_PROTOCOL)
+
+
+def load_models(path=MODELS_PATH):
+    if not os.path.isfile(path):
+        msg = 'Could not find {}, fit the models first.'
+        raise TypeError(msg.format(path))
+    with open(path, 'rb') as fh:
+        return pickle.load(fh)
+
+
+def score_columns(models):
+    columns = []
+    for name in models:
+        columns.extend(('{}_score'.format(name), '{}_anomaly'.format(name)))
+    return columns
+
+
+def versions(models):
+    return ','.join(sorted(model.version for model in models.values()))
+
+
+_models = None
+
+
+def _set_models(models):
+    """Keeps the models in each process so batches do not carry them."""
+    global _models
+    _models = models
+
+
+def score_batch(features):
+    """
+    :param features: (pandas.DataFrame) travel features
+    :return: (pandas.DataFrame) KEYS, score and anomaly flag per model
+    """
+    scores = features[KEYS].copy()
+    for name, model in _models.items():
+        values, anomalies = model.score(features)
+        scores['{}_score'.format(name)] = values
+        scores['{}_anomaly'.format(name)] = anomalies
+    return scores
+
+
+def score(features, models, processes=1, batch_size=BATCH_SIZE):
+    """Scores `features` in batches of `batch_size` rows, in parallel."""
+    batches = max(1, int(np.ceil(len(features) / batch_size)))
+    positions = np.array_split(np.arange(len(features)), batches)
+    batches = [features.iloc[rows] for rows in positions]
+
+    if processes < 2 or len(batches) < 2:
+        _set_models(models)
+        results = [score_batch(batch) for batch in batches]
+    else:
+        with Pool(processes, _set_models, (models,)) as pool:
+            results = pool.map(score_batch, batches)
+    return pd.concat(results, ignore_index=True)
+
+
+def update(features, models, previous=None, processes=1,
+           batch_size=BATCH_SIZE):
+    """
+    :param features: (pandas.DataFrame) travel features
+    :param models: (dict) fitted AnomalyModel per name
+    :param previous: (pandas.DataFrame) anomaly scores calculated before
+    :param processes: (int) number of processes
+    :param batch_size: (int) number of rows per batch
+    :return: (pandas.DataFrame) anomaly scores of every day in `features`,
+        reusing the ones from `previous` with the same fingerprint and
+        scored by the same models
+    """
+    features = cast(features.copy())
+    identity = KEYS + ['fingerprint']
+    version = versions(models)
+    columns = identity + ['congressperson_name'] + score_columns(models)
+
+    kept = None
+    pending = features
+    if previous is not None and set(columns) <= set(previous.columns):
+        previous = previous[previous['models'] == version]
+        previous = cast(previous.copy())
+        kept = previous[columns].merge(features[identity], on=identity)
+        seen = kept[KEYS].assign(seen=True)
+        pending = features.merge(seen, on=KEYS, how='left')
+        pending = pending[pending['seen'].isnull()].drop('seen', axis=1)
+
+    msg = '{:,} days with meals, {:,} to score'
+    print(msg.format(len(features), len(pending)))
+    scored = score(pending, models, processes, batch_size)
+    scored = pending[identity + ['congressperson_name']].reset_index(drop=True) \
+        .join(scored.drop(KEYS, axis=1))
+
+    scores = pd.concat([kept, scored], ignore_index=True) \
+        if kept is not None else scored
+    scores['models'] = version
+    return scores.sort_values(KEYS).reset_index(drop=True)
+
+
+def load_features():
+    path = newest_file('travel-features', DATA_PATH)
+    if path is None:
+        msg = 'Could not find the dataset for travel features, run {} first.'
+        raise TypeError(msg.format('src/travel_features.py'))
+    print('Loading {}…'.format(path))
+    return read_dataset(path)
+
+
+def main_fit(names=None):
+    features = load_features()
+    print('Fitting {} with {:,} days…'.format(
+        ', '.join(names or MODELS), len(features)))
+    models = fit(features, names)
+    print('Writing {}…'.format(MODELS_PATH))
+    save_models(models)
+
+
+def main_score(processes=None, batch_size=BATCH_SIZE, force=False):
+    models = load_models()
+    features = load_features()
+
+    previous = None
+    previous_path = newest_file('anomaly-scores', DATA_PATH)
+    if previous_path and not force:
+        print('Loading {}…'.format(previous_path))
+        previous = read_dataset(previous_path)
+
+    scores = update(features, models, previous, processes or cpu_count(),
+                    batch_size)
+    for name in models:
+        count = scores['{}_anomaly'.format(name)].sum()
+        print('{:,} anomalous days according to {}'.format(count, name))
+
+    path = os.path.join(DATA_PATH, FILE_BASE_NAME)
+    print('Writing {}…'.format(path))
+    write_dataset(scores, path)
+
+
+if __name__ == '__main__':
+    description = 'Fits anomaly models to and scores meal expenses per day.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('command', choices=('fit', 'score'))
+    parser.add_argument(
+        '--models', '-m', nargs='+', choices=tuple(MODELS), default=None,
+        help='Models to fit (default: all of them)'
+    )
+    parser.add_argument(
+        '--processes', '-p', type=int, default=None,
+        help='Number of processes to score (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--batch-size', '-b', type=int, default=BATCH_SIZE,
+        help='Days scored per batch (default: {})'.format(BATCH_SIZE)
+    )
+    parser.add_argument(
+        '--force', '-f', action='store_true',
+        help='Score every day again, ignoring previous scores'
+    )
+    args = parser.parse_args()
+    if args.command == 'fit':
+        main_fit(args.models)
+    else:
+        main_score(args.processes, args.batch_size, args.force)
@@ -0,0 +1,227 @@
+"""
+Catalog of the datasets in `data/` (files named `YYYY-MM-DD-name.xz`).
+
+The catalog is persisted in `data/.catalog/manifest.json` with the name,
+date, size, SHA-256 hash, number of rows and columns of each dataset, so
+finding the newest version of a dataset is a dictionary lookup. `data/` is
+only scanned again when its modification time changes (i.e. files were
+added, renamed or removed) and only new or modified datasets are indexed
+again. A file overwritten in place does not change that modification time,
+so datasets looked up are checked against their size and modification time
+as well. Scripts writing datasets through `dataset_store` register them here.
+"""
+import hashlib
+import json
+import os
+import re
+from argparse import ArgumentParser
+
+import pandas as pd
+
+from dataset_store import DTYPE, columnar_path, has_columnar, pq
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(BASE_DIR, 'data')
+REGEX = re.compile(r'^(\d{4}-\d{2}-\d{2})-(.+)\.xz$')
+
+
+def file_hash(path):
+    """Returns the SHA-256 hex digest of the contents of `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(2 ** 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def describe(path):
+    """
+    Returns a tuple with the number of rows and a dict of column names and
+    dtypes of a dataset (using its Parquet copy metadata when available).
+    """
+    if has_columnar(path):
+        parquet = pq.ParquetFile(columnar_path(path))
+        schema = parquet.schema_arrow
+        columns = {field.name: str(field.type) for field in schema}
+        return parquet.metadata.num_rows, columns
+
+    try:
+        sample = pd.read_csv(path, dtype=DTYPE, nrows=1000)
+    except (pd.errors.EmptyDataError, EOFError, ValueError):
+        return None, {}
+
+    columns = {name: str(dtype) for name, dtype in sample.dtypes.items()}
+    if len(sample) < 1000:
+        return len(sample), columns
+
+    chunks = pd.read_csv(path, usecols=[0], dtype=str, chunksize=2 ** 17)
+    return sum(len(chunk) for chunk in chunks), columns
+
+
+class Catalog:
+
+    def __init__(self, data_path=DATA_PATH):
+        self.data_path = data_path
+        self.path = os.path.join(data_path, '.catalog', 'manifest.json')
+        self.entries = {}
+        self.mtime = None
+        self.newest_files = {}
+
+        if os.path.isfile(self.path):
+            with open(self.path) as fh:
+                manifest = json.load(fh)
+            self.entries = manifest['entries']
+            self.mtime = manifest['mtime']
+        self.index_newest()
+
+    def index_newest(self):
+        """Maps each dataset name to the file name of its newest version."""
+        self.newest_files = {}
+        for filename in sorted(self.entries):
+            self.newest_files[self.entries[filename]['name']] = filename
+
+    def directory_mtime(self):
+        return os.stat(self.data_path).st_mtime_ns
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fh:
+            manifest = {'entries': self.entries, 'mtime': self.mtime}
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def index(self, filename, stat):
+        """Indexes (or re-indexes, if it has changed) a single dataset."""
+        entry = self.entries.get(filename)
+        if entry and (entry['size'], entry['mtime']) == \
+                (stat.st_size, stat.st_mtime_ns):
+            return entry
+
+        date, name = REGEX.match(filename).groups()
+        path = os.path.join(self.data_path, filename)
+        print('Indexing {}…'.format(path))
+        rows, columns = describe(path)
+        self.entries[filename] = {
+            'name': name,
+            'date': date,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': file_hash(path),
+            'rows': rows,
+            'columns': columns,
+        }
+        return self.entries[filename]
+
+    def refresh(self, force=False):
+        """
+        Scans `data/` if it changed since the last scan (or if `force` is
+        set), indexing new or modified datasets and forgetting removed ones.
+        """
+        mtime = self.directory_mtime()
+        if mtime == self.mtime and not force:
+            return
+
+        found = set()
+        for entry in os.scandir(self.data_path):
+            if REGEX.match(entry.name) and entry.is_file():
+                self.index(entry.name, entry.stat())
+                found.add(entry.name)
+
+        for filename in set(self.entries) - found:
+            del self.entries[filename]
+
+        self.mtime = mtime
+        self.index_newest()
+        self.save()
+
+    def register(self, path):
+        """Indexes a dataset that has just been written to `data/`."""
+        directory, filename = os.path.split(os.path.abspath(path))
+        if directory != os.path.abspath(self.data_path):
+            return
+        if not REGEX.match(filename) or not os.path.isfile(path):
+            return
+
+        self.refresh()
+        self.index(filename, os.stat(path))
+        self.mtime = self.directory_mtime()
+        self.index_newest()
+        self.save()
+
+    def verify(self, filename):
+        """
+        Re-indexes a dataset if it was modified in place since it was indexed
+        and returns its entry (or None if it is not in the catalog).
+        """
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+
+        path = os.path.join(self.data_path, filename)
+        if not os.path.isfile(path):
+            self.refresh(force=True)
+            return self.entries.get(filename)
+
+        updated = self.index(filename, os.stat(path))
+        if updated is not entry:
+            self.save()
+        return updated
+
+    def newest(self, name):
+        """
+        Returns the path to the newest version of the dataset `name` (e.g.
+        `reimbursements` for `data/YYYY-MM-DD-reimbursements.xz`) or None.
+        """
+        self.refresh()
+        filename = self.newest_files.get(name)
+        if filename is not None and self.verify(filename) is None:
+            filename = self.newest_files.get(name)  # it has been removed
+        if filename is None:
+            return None
+        return os.path.join(self.data_path, filename)
+
+    def entry(self, path):
+        """Returns the catalog entry of the dataset in `path` (or None)."""
+        self.refresh()
+        return self.verify(os.path.basename(path))
+
+
+CATALOGS = {}
+
+
+def get_catalog(data_path=DATA_PATH):
+    """Returns the (cached) Catalog of a given data directory."""
+    key = os.path.abspath(data_path)
+    if key not in CATALOGS:
+        CATALOGS[key] = Catalog(data_path)
+    return CATALOGS[key]
+
+
+def newest_file(name, data_path=DATA_PATH):
+    """
+    Returns the path to the newest `YYYY-MM-DD-name.xz` in `data_path` or
+    None if there is no such dataset.
+    """
+    return get_catalog(data_path).newest(name)
+
+
+def register(path):
+    """Registers a dataset written to the data directory containing it."""
+    get_catalog(os.path.dirname(os.path.abspath(path))).register(path)
+
+
+if __name__ == '__main__':
+    description = 'Indexes the datasets in data/ and lists them.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('--force', '-f', action='store_true',
+                        help='Scan data/ even if it has not changed')
+    args = parser.parse_args()
+
+    catalog = get_catalog()
+    catalog.refresh(args.force)
+    for name, filename in sorted(catalog.newest_files.items()):
+        entry = catalog.entries[filename]
+        print('{:<40} {} {:>12,} rows'.format(name, entry['date'],
+                                              entry['rows'] or 0))
@@ -0,0 +1,176 @@
+"""
+Offline geocoding of companies from the companies we already geocoded.
+
+Companies sharing a zip code (CEP), the first digits of a zip code or a
+city are close to each other, so the coordinates of the companies geocoded
+with their full address (by `geocode_addresses.py`) give us centroids to
+geocode other companies without calling any API. Each tier of centroids is
+kept as a sorted array of keys (with the coordinates in the same order) and
+looked up with binary search.
+
+The precision of a location is recorded as one of the TIERS, from the most
+to the least precise:
+
+    * `address`: geocoded by the API with the full address
+    * `zip_code`: centroid of the companies with the same zip code
+    * `zip_prefix`: centroid of the companies with the same ZIP_PREFIX first
+      digits of the zip code (roughly a district)
+    * `city`: centroid of the companies in the same city
+"""
+import numpy as np
+import pandas as pd
+
+
+TIERS = ('address', 'zip_code', 'zip_prefix', 'city')
+ZIP_CODE_LENGTH = 8
+ZIP_PREFIX_LENGTH = 5
+
+
+def zip_keys(zip_codes, length=ZIP_CODE_LENGTH):
+    """
+    :param zip_codes: (iterable) zip codes, punctuated or not
+    :param length: (int) use only the first `length` digits
+    :return: (numpy.ndarray) `int64` keys (-1 for invalid zip codes)
+    """
+    digits = pd.Series(zip_codes).astype(object).fillna('').astype(str) \
+        .str.replace(r'\D', '', regex=True)
+    valid = digits.str.len() == ZIP_CODE_LENGTH
+    keys = digits.str[:length].where(valid, '-1')
+    return keys.to_numpy(dtype=object).astype(np.int64)
+
+
+def zip_prefix_keys(zip_codes):
+    return zip_keys(zip_codes, ZIP_PREFIX_LENGTH)
+
+
+def city_keys(cities, states):
+    """
+    :return: (numpy.ndarray) `STATE CITY` keys in uppercase without accents
+        ('' if the city or the state is missing)
+    """
+    def normalize(values):
+        values = pd.Series(values).astype(object).fillna('').astype(str)
+        return values.str.normalize('NFKD') \
+            .str.encode('ascii', 'ignore').str.decode('ascii') \
+            .str.upper().str.replace(r'\s+', ' ', regex=True).str.strip()
+
+    cities, states = normalize(cities), normalize(states)
+    keys = states.str.cat(cities.values, sep=' ')
+    keys = keys.where((cities != '').values & (states != '').values, '')
+    return keys.to_numpy(dtype=str)
+
+
+def is_missing(keys):
+    if keys.dtype.kind in 'iu':
+        return keys < 0
+    return keys == ''
+
+
+def group_median(groups, values, starts, counts):
+    """(Lower) median of `values` per group, with groups sorted."""
+    order = np.lexsort((values, groups))
+    return values[order][starts + (counts - 1) // 2]
+
+
+class CentroidTable:
+
+    def __init__(self, keys, latitude, longitude, counts):
+        """
+        :param keys: (numpy.ndarray) sorted distinct keys
+        :param latitude: (numpy.ndarray) latitude of each key centroid
+        :param longitude: (numpy.ndarray) longitude of each key centroid
+        :param counts: (numpy.ndarray) companies behind each centroid
+        """
+        self.keys = keys
+        self.latitude = latitude
+        self.longitude = longitude
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, keys, latitude, longitude):
+        """
+        Centroids (median latitude and longitude) of the locations sharing
+        each key (locations with missing key or coordinates are ignored).
+        """
+        keys = np.asarray(keys)
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        valid = ~is_missing(keys) & ~np.isnan(latitude) & ~np.isnan(longitude)
+        keys, latitude, longitude = keys[valid], latitude[valid], longitude[valid]
+
+        distinct, groups, counts = np.unique(keys, return_inverse=True,
+                                             return_counts=True)
+        starts = np.cumsum(counts) - counts
+        return cls(distinct,
+                   group_median(groups, latitude, starts, counts),
+                   group_median(groups, longitude, starts, counts),
+                   counts)
+
+    def lookup(self, keys):
+        """
+        :param keys: (numpy.ndarray) keys to look up
+        :return: (tuple) arrays with latitude and longitude (NaN when the key
+            is not in the table)
+        """
+        keys = np.asarray(keys)
+        latitude = np.full(len(keys), np.nan)
+        longitude = np.full(len(keys), np.nan)
+        if not len(self):
+            return latitude, longitude
+
+        positions = np.searchsorted(self.keys, keys)
+        positions = positions.clip(max=len(self) - 1)
+        found = (self.keys[positions] == keys) & ~is_missing(keys)
+        latitude[found] = self.latitude[positions[found]]
+        longitude[found] = self.longitude[positions[found]]
+        return latitude, longitude
+
+
+def tier_keys(companies):
+    """Keys of each offline tier (all but `address`) for `companies`."""
+    return {
+        'zip_code': zip_keys(companies['zip_code']),
+        'zip_prefix': zip_prefix_keys(companies['zip_code']),
+        'city': city_keys(companies['city'], companies['state']),
+    }
+
+
+def offline_geocode(companies, reference):
+    """
+    Geocodes companies using the centroids of the companies in `reference`,
+    trying the most precise tier first.
+
+    :param companies: (pandas.DataFrame) with `zip_code`, `city` and `state`
+    :param reference: (pandas.DataFrame) companies geocoded by address, with
+        `zip_code`, `city`, `state`, `latitude` and `longitude`
+    :return: (pandas.DataFrame) `latitude`, `longitude` and
+        `geocoding_precision` (one of TIERS or NaN) with the index of
+        `companies`
+    """
+    latitude = np.full(len(companies), np.nan)
+    longitude = np.full(len(companies), np.nan)
+    precision = np.full(len(companies), np.nan, dtype=object)
+
+    reference_keys = tier_keys(reference)
+    for tier, keys in tier_keys(companies).items():
+        missing = np.isnan(latitude)
+        if not missing.any():
+            break
+
+        table = CentroidTable.build(reference_keys[tier],
+                                    reference['latitude'].values,
+                                    reference['longitude'].values)
+        found_latitude, found_longitude = table.lookup(keys[missing])
+        found = ~np.isnan(found_latitude)
+        rows = np.flatnonzero(missing)[found]
+        latitude[rows] = found_latitude[found]
+        longitude[rows] = found_longitude[found]
+        precision[rows] = tier
+
+    return pd.DataFrame({'latitude': latitude,
+                         'longitude': longitude,
+                         'geocoding_precision': precision},
+                        index=companies.index)
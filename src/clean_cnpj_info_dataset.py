@@ -2,62 +2,141 @@ import json
 import numpy as np
 import os
 import pandas as pd
+from argparse import ArgumentParser
+from itertools import chain
+
+from activity_index import (ACTIVITIES_PATH, CNAE_PATH, COMPANIES_PATH,
+                            build_index, cnae_code, format_cnae)
+from dataset_store import CATEGORIES, write_dataset
+from schema import STRING_DTYPE
+
+NOT_INFORMED = 'Não informada'
+
+
+def parse_activities(values):
+    """
+    Parses all the activity blobs (Python-like lists of dicts, as saved by
+    `fetch_cnpj_info.py`) in a single `json.loads` call.
+
+    :param values: (pandas.Series) activity blobs
+    :return: (list) a list of activities (dicts) per value
+    """
+    values = values.fillna('[]').str.replace('\'', '"', regex=False)
+    try:
+        parsed = json.loads('[{}]'.format(','.join(values)))
+    except ValueError:  # fall back to parse each value on its own
+        parsed = []
+        for value in values:
+            try:
+                parsed.append(json.loads(value))
+            except ValueError:
+                parsed.append([])
+    return [value if isinstance(value, list) else [] for value in parsed]
+
+
+def flatten_activities(activities, first_rank):
+    """
+    :param activities: (list) a list of activities (dicts) per company
+    :param first_rank: (int) rank of the first activity of each company
+    :return: (tuple) arrays with the company position, the rank, the code and
+        the text of each activity
+    """
+    counts = np.fromiter(map(len, activities), dtype=np.int64,
+                         count=len(activities))
+    flat = list(chain.from_iterable(activities))
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+
+    rows = np.repeat(np.arange(len(activities)), counts)
+    ranks = np.arange(len(flat)) - offsets + first_rank
+    codes = np.array([activity.get('code') for activity in flat], dtype=object)
+    texts = np.array([activity.get('text') for activity in flat], dtype=object)
+    return rows, ranks, codes, texts
+
+
+def decompose_activities(data):
+    """
+    Decodes `main_activity` and `secondary_activities` of every company at
+    once into a long table of activities.
+
+    :param data: (pandas.DataFrame) companies with `cnpj`, `main_activity`
+        and `secondary_activities`
+    :return: (pandas.DataFrame) with `company_id` (row of the company in
+        `data`), `cnpj`, `rank` (0 for the main activity and 1 onwards for
+        secondary activities), `code` and `text`
+    """
+    main = [activities[:1]
+            for activities in parse_activities(data['main_activity'])]
+    secondary = [[] if activities and activities[0].get('text') == NOT_INFORMED
+                 else activities
+                 for activities in parse_activities(data['secondary_activities'])]
+
+    parts = [flatten_activities(main, 0), flatten_activities(secondary, 1)]
+    rows, ranks, codes, texts = (np.concatenate(arrays)
+                                 for arrays in zip(*parts))
+    order = np.lexsort((ranks, rows))
+    return pd.DataFrame({
+        'company_id': rows[order].astype(np.int32),
+        'cnpj': data['cnpj'].values[rows[order]],
+        'rank': ranks[order].astype(np.int16),
+        'code': codes[order],
+        'text': texts[order],
+    })
+
+
+def cnae_dimension(activities):
+    """
+    :param activities: (pandas.DataFrame) long table of activities (see
+        `decompose_activities`) with an extra `cnae` (`int32` code) column
+    :return: (pandas.DataFrame) a row per CNAE code with `cnae`, `code`
+        (formatted) and `text` (its most common description)
+    """
+    known = activities[activities['cnae'] != 0]
+    counts = known.groupby(['cnae', 'text']).size().reset_index(name='count')
+    counts = counts.sort_values(['cnae', 'count'], ascending=[True, False])
+    dimension = counts.drop_duplicates('cnae')[['cnae', 'text']]
+    dimension.insert(1, 'code', format_cnae(dimension['cnae'].values))
+    return dimension.reset_index(drop=True)
+
+
+def company_activities(activities):
+    """
+    :param activities: (pandas.DataFrame) long table of activities (see
+        `decompose_activities`) with an extra `cnae` (`int32` code) column
+    :return: (pandas.DataFrame) bridge table with `company_id`, `rank` and
+        `cnae`, sorted by `cnae` and `company_id`
+    """
+    bridge = activities.loc[activities['cnae'] != 0,
+                            ['company_id', 'rank', 'cnae']]
+    bridge = bridge.sort_values(['cnae', 'company_id'], kind='mergesort')
+    return bridge.reset_index(drop=True)
+
+
+def wide_activities(activities, cnpjs):
+    """
+    Pivots the long table of activities back to a column pair per activity
+    (`main_activity_code` and `main_activity`, then `secondary_activity_N_code`
+    and `secondary_activity_N`), with a row per CNPJ in `cnpjs`.
+    """
+    wide = activities.set_index(['cnpj', 'rank'])[['code', 'text']] \
+        .unstack('rank')
+    columns = []
+    for rank in sorted(activities['rank'].unique()):
+        if rank == 0:
+            names = 'main_activity_code', 'main_activity'
+        else:
+            names = ('secondary_activity_{}_code'.format(rank),
+                     'secondary_activity_{}'.format(rank))
+        columns.append((('code', rank), names[0]))
+        columns.append((('text', rank), names[1]))
+
+    wide = wide[[column for column, _ in columns]]
+    wide.columns = [name for _, name in columns]
+    return wide.reindex(cnpjs).reset_index(drop=True)
+
+
+def load_cnpj_info():
+    return pd.read_csv(os.path.join('data', 'cnpj-info.xz'), dtype=STRING_DTYPE)
 
-def decompose_main_activity(value):
-    struct = json.loads(value.replace('\'', '"'))
-    if struct:
-        return pd.Series(struct[0]). \
-            rename_axis({'code': 'main_activity_code', 'text': 'main_activity'})
-    else:
-        return pd.Series({}, index=['main_activity_code', 'main_activity'])
-
-def decompose_secondary_activities(value):
-    struct = json.loads(value.replace('\'', '"'))
-    if struct and struct[0].get('text') != 'Não informada':
-        new_attributes = [pd.Series(activity). \
-            rename_axis({'code': 'secondary_activity_%i_code' % (index + 1),
-                         'text': 'secondary_activity_%i' % (index + 1)})
-            for index, activity in enumerate(struct)]
-        return pd.concat(new_attributes)
-    else:
-        return pd.Series()
-
-
-
-data = pd.read_csv(os.path.join('data', 'cnpj-info.xz'),
-                   dtype={'atividade_principal': np.str,
-                          'atividades_secundarias': np.str,
-                          'complemento': np.str,
-                          'efr': np.str,
-                          'email': np.str,
-                          'message': np.str,
-                          'motivo_situacao': np.str,
-                          'situacao_especial': np.str})
-data = data.drop_duplicates('cnpj')
-data.rename(columns={
-    'abertura': 'opening',
-    'atividade_principal': 'main_activity',
-    'atividades_secundarias': 'secondary_activities',
-    'bairro': 'neighborhood',
-    'cep': 'zip_code',
-    'complemento': 'additional_address_details',
-    'data_situacao_especial': 'special_situation_date',
-    'data_situacao': 'situation_date',
-    'efr': 'responsible_federative_entity',
-    'fantasia': 'trade_name',
-    'logradouro': 'address',
-    'motivo_situacao': 'situation_reason',
-    'municipio': 'city',
-    'natureza_juridica': 'legal_entity',
-    'nome': 'name',
-    'numero': 'number',
-    'situacao_especial': 'special_situation',
-    'situacao': 'situation',
-    'telefone': 'phone',
-    'tipo': 'type',
-    'uf': 'state',
-    'ultima_atualizacao': 'last_updated',
-}, inplace=True)
 
 categories = (
     'legal_entity',
@@ -69,19 +148,69 @@ categories = (
     'status',
     'type',
 )
-for key in categories:
-    data[key] = data[key].astype('category')
-
-data['main_activity'] = data['main_activity'].fillna('{}')
-data['secondary_activities'] = data['secondary_activities'].fillna('{}')
-
-data = pd.concat([
-    data.drop(['main_activity', 'secondary_activities'], axis=1),
-    data['main_activity'].apply(decompose_main_activity),
-    data['secondary_activities'].apply(decompose_secondary_activities)],
-    axis=1)
-
-data.to_csv(os.path.join('data', 'companies.xz'),
-            compression='xz',
-            encoding='utf-8',
-            index=False)
+
+
+def clean(data):
+    data = data.drop_duplicates('cnpj')
+    data.rename(columns={
+        'abertura': 'opening',
+        'atividade_principal': 'main_activity',
+        'atividades_secundarias': 'secondary_activities',
+        'bairro': 'neighborhood',
+        'cep': 'zip_code',
+        'complemento': 'additional_address_details',
+        'data_situacao_especial': 'special_situation_date',
+        'data_situacao': 'situation_date',
+        'efr': 'responsible_federative_entity',
+        'fantasia': 'trade_name',
+        'logradouro': 'address',
+        'motivo_situacao': 'situation_reason',
+        'municipio': 'city',
+        'natureza_juridica': 'legal_entity',
+        'nome': 'name',
+        'numero': 'number',
+        'situacao_especial': 'special_situation',
+        'situacao': 'situation',
+        'telefone': 'phone',
+        'tipo': 'type',
+        'uf': 'state',
+        'ultima_atualizacao': 'last_updated',
+    }, inplace=True)
+
+    for key in categories:
+        data[key] = data[key].astype('category')
+    return data.reset_index(drop=True)
+
+
+def main(wide=True):
+    """
+    :param wide: (bool) also add the activity columns (wide layout) to the
+        companies dataset
+    """
+    data = clean(load_cnpj_info())
+    activities = decompose_activities(data)
+    activities['cnae'] = cnae_code(activities['code'])
+    write_dataset(cnae_dimension(activities), CNAE_PATH)
+
+    bridge = company_activities(activities)
+    write_dataset(bridge, ACTIVITIES_PATH)
+    build_index(bridge)
+
+    data = data.drop(['main_activity', 'secondary_activities'], axis=1)
+    if wide:
+        data = pd.concat([data, wide_activities(activities, data['cnpj'])],
+                         axis=1)
+
+    write_dataset(data, COMPANIES_PATH, categories=CATEGORIES + categories)
+
+
+if __name__ == '__main__':
+    description = 'Cleans up and translates the supplier info dataset.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--no-wide', action='store_true',
+        help=('Do not add a pair of columns per activity to companies.xz '
+              '(activities are always in cnae.xz and company-activities.xz)')
+    )
+    args = parser.parse_args()
+    main(wide=not args.no_wide)
@@ -0,0 +1,188 @@
+"""
+Vectorized normalization of CNPJ (companies) and CPF (people) documents.
+
+Documents show up in our datasets with or without punctuation (e.g.
+`12.345.678/0001-90` or `12345678000190`). Scripts comparing them use the
+functions below, which work on whole columns at once:
+
+    * `digits` keeps only the digits of each value
+    * `keys` converts documents to `uint64` keys: a CNPJ (14 digits) is its
+      own number and a CPF (11 digits) is its number plus `CPF_OFFSET`, so
+      both fit in a single array without colliding; anything else is
+      `INVALID` (zero)
+    * `from_keys` converts keys back to fixed width digits-only strings
+    * `unique_keys`, `setdiff` and `isin` are set operations on sorted
+      arrays of keys (e.g. "CNPJs to fetch" minus "CNPJs already fetched")
+    * `validate` checks the check digits of each document (with CPFs padded
+      to 14 digits, both kinds have their check digits at the same
+      positions, so all documents are checked with a pair of dot products)
+"""
+import numpy as np
+import pandas as pd
+
+
+CNPJ_WIDTH = 14
+CPF_WIDTH = 11
+CPF_OFFSET = 10 ** CNPJ_WIDTH
+INVALID = np.uint64(0)
+
+# reasons returned by `validate`
+VALID = 0
+MISSING = 1
+WRONG_LENGTH = 2
+REPEATED_DIGITS = 3
+WRONG_CHECK_DIGITS = 4
+REASONS = ('valid', 'missing', 'wrong length', 'repeated digits',
+           'wrong check digits')
+
+# weights of the digits to calculate the first and the second check digits
+# (the 13th and the 14th digits, CPFs padded to 14 digits)
+CNPJ_WEIGHTS = np.array([[5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2, 0, 0],
+                         [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2, 0]])
+CPF_WEIGHTS = np.array([[0, 0, 0, 10, 9, 8, 7, 6, 5, 4, 3, 2, 0, 0],
+                        [0, 0, 0, 11, 10, 9, 8, 7, 6, 5, 4, 3, 2, 0]])
+
+
+def digits(values):
+    """
+    :param values: (iterable) documents, punctuated or not
+    :return: (pandas.Series) documents with digits only (missing values are
+        kept as NaN)
+    """
+    values = pd.Series(values)
+    cleaned = values.astype(str).str.replace(r'\D', '', regex=True)
+    return cleaned.where(values.notnull())
+
+
+def keys(values, cpf=True):
+    """
+    :param values: (iterable) documents, punctuated or not
+    :param cpf: (bool) whether CPFs are valid keys (if False, only CNPJs are)
+    :return: (numpy.ndarray) `uint64` keys (`INVALID` for values that are
+        neither a CNPJ nor a CPF)
+    """
+    values = digits(values)
+    lengths = values.str.len().to_numpy()
+    is_cnpj = lengths == CNPJ_WIDTH
+    is_cpf = (lengths == CPF_WIDTH) & cpf
+
+    numbers = values.where(is_cnpj | is_cpf, '0').to_numpy(dtype=object)
+    result = numbers.astype(np.uint64)
+    result[is_cpf] += np.uint64(CPF_OFFSET)
+    return result
+
+
+def cnpj_keys(values):
+    """Same as `keys`, but CPFs are considered invalid."""
+    return keys(values, cpf=False)
+
+
+def from_keys(keys):
+    """
+    :param keys: (numpy.ndarray) `uint64` keys
+    :return: (numpy.ndarray) digits-only documents (14 digits for CNPJ and
+        11 for CPF) or empty strings for invalid keys
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    is_cpf = keys >= CPF_OFFSET
+    numbers = np.where(is_cpf, keys - np.uint64(CPF_OFFSET), keys)
+
+    result = np.char.zfill(numbers.astype(str), CNPJ_WIDTH)
+    result[is_cpf] = np.char.zfill(numbers[is_cpf].astype(str), CPF_WIDTH)
+    result[keys == INVALID] = ''
+    return result.astype(object)
+
+
+def normalize(values, cpf=True):
+    """
+    :param values: (iterable) documents, punctuated or not
+    :return: (numpy.ndarray) fixed width digits-only documents (empty
+        strings for invalid ones)
+    """
+    return from_keys(keys(values, cpf))
+
+
+def unique_keys(keys):
+    """Sorted array of the distinct valid keys."""
+    keys = np.unique(keys)
+    return keys[keys != INVALID]
+
+
+def setdiff(keys, other):
+    """Sorted array of the distinct valid keys in `keys` not in `other`."""
+    return np.setdiff1d(unique_keys(keys), unique_keys(other),
+                        assume_unique=True)
+
+
+def isin(keys, other):
+    """
+    :param keys: (numpy.ndarray) keys to look for
+    :param other: (numpy.ndarray) keys to look into
+    :return: (numpy.ndarray) boolean mask telling which `keys` are valid and
+        present in `other` (binary search on the sorted `other`)
+    """
+    keys = np.asarray(keys, dtype=np.uint64)
+    other = unique_keys(other)
+    if not len(other):
+        return np.zeros(len(keys), dtype=bool)
+
+    positions = np.searchsorted(other, keys).clip(max=len(other) - 1)
+    return (other[positions] == keys) & (keys != INVALID)
+
+
+def digit_matrix(values):
+    """
+    :param values: (pandas.Series) digits-only documents of up to 14 digits
+    :return: (numpy.ndarray) (n, 14) `uint8` matrix with the digits of each
+        document, padded with zeros on the left
+    """
+    padded = values.str.zfill(CNPJ_WIDTH).str.cat().encode('ascii')
+    matrix = np.frombuffer(padded, dtype=np.uint8).reshape(-1, CNPJ_WIDTH)
+    return matrix - ord('0')
+
+
+def check_digits(matrix, weights):
+    """Both check digits of each row of a `digit_matrix`, as (n, 2)."""
+    remainders = matrix.astype(np.int64) @ weights.T % 11
+    return np.where(remainders < 2, 0, 11 - remainders)
+
+
+def validate(values):
+    """
+    :param values: (iterable) documents, punctuated or not
+    :return: (tuple) a boolean mask telling which documents are valid CNPJs
+        or CPFs (missing documents are not considered invalid, as receipts
+        such as flight tickets have none) and an `uint8` array with the
+        reason of each one (VALID, MISSING, WRONG_LENGTH, REPEATED_DIGITS or
+        WRONG_CHECK_DIGITS; see REASONS for their descriptions)
+    """
+    values = pd.Series(values)
+    blank = values.astype(str).str.strip() == ''
+    is_missing = (values.isnull() | blank).to_numpy()
+    values = digits(values)
+    lengths = values.str.len().fillna(0).to_numpy()
+    is_cnpj = lengths == CNPJ_WIDTH
+    is_cpf = lengths == CPF_WIDTH
+    is_numeric = values.str.fullmatch(r'[0-9]*').fillna(False).to_numpy()
+    has_length = (is_cnpj | is_cpf) & is_numeric
+
+    reasons = np.full(len(values), WRONG_LENGTH, dtype=np.uint8)
+    reasons[is_missing] = MISSING
+
+    matrix = digit_matrix(values[has_length])
+    is_cpf = is_cpf[has_length]
+    expected = np.where(is_cpf[:, np.newaxis],
+                        check_digits(matrix, CPF_WEIGHTS),
+                        check_digits(matrix, CNPJ_WEIGHTS))
+    correct = (matrix[:, -2:] == expected).all(axis=1)
+
+    starts = np.where(is_cpf, CNPJ_WIDTH - CPF_WIDTH, 0)
+    first = matrix[np.arange(len(matrix)), starts]
+    padding = np.arange(CNPJ_WIDTH) < starts[:, np.newaxis]
+    repeated = ((matrix == first[:, np.newaxis]) | padding).all(axis=1)
+
+    checked = np.full(len(matrix), WRONG_CHECK_DIGITS, dtype=np.uint8)
+    checked[correct] = VALID
+    checked[repeated] = REPEATED_DIGITS
+    reasons[has_length] = checked
+    return np.isin(reasons, (VALID, MISSING)), reasons
@@ -0,0 +1,369 @@
+"""
+Writes and reads datasets from `data/` in two formats side by side:
+
+    * `YYYY-MM-DD-name.xz`: xz compressed CSV, our archival export
+    * `YYYY-MM-DD-name.parquet`: typed and columnar copy (categoricals are
+      preserved), much faster to load and able to read only some columns
+      and to skip row groups that do not match a filter
+
+Readers get the xz path as usual and transparently use the Parquet copy
+when it is available and up to date. Parquet support requires `pyarrow`;
+without it only the xz CSV is written and read. Datasets written to `data/`
+are registered in the catalog (see `catalog.py`).
+"""
+import lzma
+import operator
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa, ds, pq = None, None, None
+
+from schema import (CATEGORIES, DATES, DTYPE, INTEGERS, MONEY, STRINGS, cast,
+                    concat, export)
+
+
+ROW_GROUP_SIZE = 2 ** 17
+
+if pa is not None:
+    ARROW_TYPES = {column: pa.from_numpy_dtype(np.dtype(kind.lower()))
+                   for column, kind in INTEGERS.items()}
+    ARROW_TYPES.update({column: pa.float64() for column in MONEY})  # R$
+    ARROW_TYPES.update({column: pa.timestamp('us') for column in DATES})
+    ARROW_TYPES.update({column: pa.string() for column in STRINGS})
+
+OPERATORS = {
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda series, values: series.isin(values),
+    'not in': lambda series, values: ~series.isin(values),
+}
+
+
+def columnar_path(filepath):
+    """Returns the path of the Parquet copy of a `.xz` dataset."""
+    return os.path.splitext(filepath)[0] + '.parquet'
+
+
+def has_columnar(filepath):
+    """
+    Returns True if there is a Parquet copy of `filepath` at least as recent
+    as the xz CSV (or if there is no xz CSV at all) and pyarrow is available.
+    """
+    parquet = columnar_path(filepath)
+    if pq is None or not os.path.isfile(parquet):
+        return False
+    if not os.path.isfile(filepath):
+        return True
+    return os.path.getmtime(parquet) >= os.path.getmtime(filepath)
+
+
+def categorize(data, categories=CATEGORIES):
+    """Casts the columns listed in `categories` (if present) to category."""
+    for column in categories:
+        if column in data.columns:
+            data[column] = data[column].astype('category')
+    return data
+
+
+def apply_filters(data, filters):
+    """
+    Filters a DataFrame in memory using the same syntax as Parquet filters:
+    a list of `(column, operator, value)` tuples combined with AND.
+    """
+    if not filters:
+        return data
+
+    mask = np.ones(len(data), dtype=bool)
+    for column, op, value in filters:
+        mask &= OPERATORS[op](data[column], value).values
+    return data[mask]
+
+
+def arrow_filter(filters):
+    """
+    Turns filters (see `apply_filters`) into a `pyarrow.dataset` expression,
+    so Parquet row groups whose statistics do not match them are skipped.
+    Missing values match `!=` and `not in`, as they do in memory.
+    """
+    expression = None
+    for column, op, value in filters:
+        field = ds.field(column)
+        if op in ('in', 'not in'):
+            condition = field.isin(list(value))
+        else:
+            condition = OPERATORS[op.replace('!=', '==')](field, value)
+        if op in ('!=', 'not in'):
+            condition = ~condition | field.is_null()
+        expression = condition if expression is None \
+            else expression & condition
+    return expression
+
+
+def usecols(columns, filters):
+    """Columns needed to read `columns` and then apply `filters`."""
+    if not columns:
+        return None
+    needed = [f[0] for f in filters or () if f[0] not in columns]
+    return list(columns) + needed
+
+
+def read_dataset(filepath, columns=None, filters=None, **kwargs):
+    """
+    Reads a dataset saved with `write_dataset` (or any xz CSV from `data/`).
+
+    :param filepath: (str) path to the `.xz` dataset
+    :param columns: (list) load only these columns (default: all)
+    :param filters: (list) `(column, operator, value)` tuples, combined with
+        AND; with Parquet, row groups not matching them are not even read
+    :param kwargs: extra arguments passed to `pd.read_csv` when reading the
+        xz CSV (`dtype` defaults to `DTYPE`); only `nrows` (the number of
+        rows matching the filters to read) is accepted along with a Parquet
+        copy, other arguments raise TypeError
+    :return: (pandas.DataFrame) with the columns in `schema.py` cast to
+        their types
+    """
+    columnar = check_kwargs(filepath, kwargs)
+    nrows = kwargs.get('nrows')
+    if nrows is not None and (columnar or filters):
+        del kwargs['nrows']
+        chunksize = max(nrows, ROW_GROUP_SIZE if filters else 1)
+        chunks = iter_dataset(filepath, chunksize, columns, filters, **kwargs)
+        return head(chunks, nrows)
+
+    if columnar:
+        dataset = ds.dataset(columnar_path(filepath), format='parquet')
+        table = dataset.to_table(columns=list(columns) if columns else None,
+                                 filter=arrow_filter(filters or ()))
+        return cast(table.to_pandas())
+
+    kwargs.setdefault('dtype', DTYPE)
+    kwargs.setdefault('low_memory', False)
+    data = pd.read_csv(filepath, usecols=usecols(columns, filters), **kwargs)
+    data = apply_filters(data, filters)
+    return cast(data[list(columns)] if columns else data)
+
+
+def check_kwargs(filepath, kwargs):
+    """
+    Returns whether `filepath` is read from its Parquet copy, raising
+    TypeError if there are `pd.read_csv` arguments it cannot honor.
+    """
+    if not has_columnar(filepath):
+        return False
+    unsupported = sorted(set(kwargs) - {'nrows'})
+    if unsupported:
+        msg = '{} cannot be used when reading the Parquet copy of {}'
+        raise TypeError(msg.format(', '.join(unsupported), filepath))
+    return True
+
+
+def head(chunks, nrows):
+    """Concatenates the first `nrows` rows of an iterable of DataFrames."""
+    frames, count = [], 0
+    for data in chunks:
+        frames.append(data.head(nrows - count))
+        count += len(frames[-1])
+        if count >= nrows:
+            break
+    return concat(frames).reset_index(drop=True)
+
+
+def iter_dataset(filepath, chunksize, columns=None, filters=None, **kwargs):
+    """
+    Generator with a dataset read in DataFrames of up to `chunksize` rows
+    (see `read_dataset` for the other arguments and the types). It always
+    yields at least one (maybe empty) DataFrame.
+    """
+    if check_kwargs(filepath, kwargs):
+        dataset = ds.dataset(columnar_path(filepath), format='parquet')
+        names = list(columns) if columns else None
+        batches = dataset.to_batches(columns=names,
+                                     filter=arrow_filter(filters or ()),
+                                     batch_size=chunksize)
+        empty = True
+        for batch in batches:
+            if batch.num_rows:
+                empty = False
+                yield cast(batch.to_pandas())
+        if empty:
+            schema = dataset.schema
+            if names:
+                schema = pa.schema([schema.field(name) for name in names],
+                                   metadata=schema.metadata)
+            yield cast(schema.empty_table().to_pandas())
+        return
+
+    kwargs.setdefault('dtype', DTYPE)
+    chunks = pd.read_csv(filepath,
+                         usecols=usecols(columns, filters),
+                         chunksize=chunksize,
+                         **kwargs)
+    empty = True
+    for data in chunks:
+        data = apply_filters(data, filters)
+        if len(data):
+            empty = False
+            yield cast(data[list(columns)] if columns else data)
+    if empty:
+        header = pd.read_csv(filepath, usecols=usecols(columns, filters),
+                             nrows=0, **kwargs)
+        yield cast(header[list(columns)] if columns else header)
+
+
+class DatasetWriter:
+    """
+    Writes a dataset in chunks to the xz CSV and to its Parquet copy, e.g.:
+
+        with DatasetWriter('data/2017-01-01-reimbursements.xz') as writer:
+            for chunk in chunks:
+                writer.write(chunk)
+    """
+
+    def __init__(self, filepath, csv=True, header=True,
+                 categories=CATEGORIES, row_group_size=ROW_GROUP_SIZE):
+        """
+        :param filepath: (str) path to the `.xz` dataset
+        :param csv: (bool) write the xz CSV archival export (default: True)
+        :param header: (bool) write the header in the xz CSV (default: True)
+        :param categories: (iterable) columns to be saved as categoricals
+        :param row_group_size: (int) max rows per Parquet row group
+        """
+        self.filepath = filepath
+        self.csv = csv
+        self.categories = categories
+        self.row_group_size = row_group_size
+        self.header = header
+        self.output = None
+        self.parquet = None
+        self.schema = None
+
+    def __enter__(self):
+        if self.csv:
+            tmp = self.filepath + '.tmp'
+            self.output = lzma.open(tmp, 'wt', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, data):
+        data = export(data)
+        if self.output is not None:
+            data.to_csv(self.output, header=self.header, index=False)
+            self.header = False
+
+        if pq is None:
+            return
+
+        data = categorize(data.copy(), self.categories)
+        if self.schema is None:
+            self.schema = self.arrow_schema(data)
+            tmp = columnar_path(self.filepath) + '.tmp'
+            self.parquet = pq.ParquetWriter(tmp, self.schema)
+        table = pa.Table.from_pandas(data, schema=self.schema,
+                                     preserve_index=False)
+        self.parquet.write_table(table, row_group_size=self.row_group_size)
+
+    def arrow_schema(self, data):
+        """
+        Arrow schema of the dataset: the types in `schema.py` for the columns
+        it knows and the types of the first chunk for the others. A column
+        with only missing values in the first chunk would otherwise get a
+        `null` type (or an empty dictionary) no later chunk fits, so such
+        columns are strings. Categoricals share the same index type, so
+        chunks with different amounts of categories share a single schema.
+        """
+        inferred = pa.Table.from_pandas(data, preserve_index=False).schema
+        fields = []
+        for field in inferred:
+            kind = ARROW_TYPES.get(field.name)
+            if pa.types.is_dictionary(field.type):
+                values = field.type.value_type
+                if not len(data[field.name].cat.categories):
+                    values = pa.string()
+                kind = pa.dictionary(pa.int32(), values)
+            elif kind is None and pa.types.is_null(field.type):
+                kind = pa.string()
+            fields.append(field.with_type(kind) if kind else field)
+        return pa.schema(fields, metadata=inferred.metadata)
+
+    def abort(self):
+        """
+        Closes and discards the files being written, leaving the dataset (and
+        the catalog) as it was before.
+        """
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+        if self.parquet is not None:
+            self.parquet.close()
+            self.parquet = None
+
+        for path in (self.filepath, columnar_path(self.filepath)):
+            if os.path.isfile(path + '.tmp'):
+                os.remove(path + '.tmp')
+
+    def close(self):
+        written = self.output is not None or self.parquet is not None
+
+        if self.output is not None:
+            self.output.close()
+            self.output = None
+            os.replace(self.filepath + '.tmp', self.filepath)
+
+        if self.parquet is not None:
+            self.parquet.close()
+            self.parquet = None
+            path = columnar_path(self.filepath)
+            os.replace(path + '.tmp', path)
+
+        if written:
+            from catalog import register  # catalog imports this module
+            register(self.filepath)
+
+
+def write_dataset(data, filepath, **kwargs):
+    """
+    Writes a DataFrame as xz CSV and as Parquet (see `DatasetWriter` for the
+    keyword arguments).
+    """
+    with DatasetWriter(filepath, **kwargs) as writer:
+        writer.write(data)
+
+
+def convert(filepath, **kwargs):
+    """Creates the Parquet copy of an existing xz CSV dataset."""
+    if pq is None:
+        raise RuntimeError('Converting datasets requires pyarrow.')
+
+    print('Converting {}…'.format(filepath))
+    header = pd.read_csv(filepath, nrows=0).columns
+    kwargs.setdefault('parse_dates', [c for c in DATES if c in header])
+    data = pd.read_csv(filepath, dtype=DTYPE, low_memory=False, **kwargs)
+    write_dataset(data, filepath, csv=False)
+
+
+if __name__ == '__main__':
+    description = 'Creates a Parquet copy of xz CSV datasets from data/.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('datasets', nargs='+', help='Path to .xz datasets')
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        convert(dataset)
@@ -0,0 +1,222 @@
+"""
+Vectorized distances (in meters) between geographic coordinates.
+
+Every function works on whole arrays of latitudes and longitudes (in
+degrees) at once, using the haversine formula (a sphere, fast) or, with
+`method='vincenty'`, Vincenty's inverse formula on the WGS-84 ellipsoid
+(accurate to millimeters, as `geopy.distance.vincenty`).
+
+Grouped data (e.g. the meals of each congressperson in each day) is passed
+as arrays sorted by group plus `offsets`: the position where each group
+starts followed by the total length (see `segment_offsets`), so distances
+for every group come from a single call:
+
+    * `pairwise`: distance between the i-th point of two arrays
+    * `matrix`: distances between every point of an array and every point
+      of another one
+    * `consecutive`: distance from each point to the previous one in its
+      group (`path_length` sums them per group)
+    * `all_pairs`: distances between every pair of points in each group
+      (`all_pairs_sum` sums them per group)
+"""
+import numpy as np
+
+
+EARTH_RADIUS = 6371008.8  # mean radius, in meters
+
+# WGS-84 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0
+FLATTENING = 1 / 298.257223563
+SEMI_MINOR_AXIS = (1 - FLATTENING) * SEMI_MAJOR_AXIS
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, iterations=200, tolerance=1e-12):
+    """
+    Vincenty's inverse formula, iterating only the points that have not
+    converged yet. Nearly antipodal points, for which it does not converge,
+    fall back to the haversine distance.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64)
+          for value in (lat1, lon1, lat2, lon2)))
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = (v.ravel() for v in (lat1, lon1, lat2, lon2))
+
+    u1 = np.arctan((1 - FLATTENING) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - FLATTENING) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    difference = np.radians(lon2 - lon1)
+
+    lambda_ = difference.copy()
+    sin_sigma = np.zeros_like(lambda_)
+    cos_sigma = np.ones_like(lambda_)
+    sigma = np.zeros_like(lambda_)
+    cos_sq_alpha = np.ones_like(lambda_)
+    cos_2sigma_m = np.zeros_like(lambda_)
+    pending = ~np.isnan(lambda_) & ~np.isnan(u1) & ~np.isnan(u2)
+
+    for _ in range(iterations):
+        if not pending.any():
+            break
+
+        i = pending.copy()
+        sin_lambda, cos_lambda = np.sin(lambda_[i]), np.cos(lambda_[i])
+        sin_sigma[i] = np.sqrt(
+            (cos_u2[i] * sin_lambda) ** 2 +
+            (cos_u1[i] * sin_u2[i] - sin_u1[i] * cos_u2[i] * cos_lambda) ** 2)
+        cos_sigma[i] = sin_u1[i] * sin_u2[i] + \
+            cos_u1[i] * cos_u2[i] * cos_lambda
+        sigma[i] = np.arctan2(sin_sigma[i], cos_sigma[i])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sin_alpha = cos_u1[i] * cos_u2[i] * sin_lambda / sin_sigma[i]
+            sin_alpha = np.where(sin_sigma[i] == 0, 0, sin_alpha)
+            cos_sq_alpha[i] = 1 - sin_alpha ** 2
+            cos_2sigma_m[i] = np.where(
+                cos_sq_alpha[i] == 0, 0,
+                cos_sigma[i] - 2 * sin_u1[i] * sin_u2[i] / cos_sq_alpha[i])
+
+        c = FLATTENING / 16 * cos_sq_alpha[i] * \
+            (4 + FLATTENING * (4 - 3 * cos_sq_alpha[i]))
+        previous = lambda_[i]
+        lambda_[i] = difference[i] + (1 - c) * FLATTENING * sin_alpha * (
+            sigma[i] + c * sin_sigma[i] * (
+                cos_2sigma_m[i] + c * cos_sigma[i] *
+                (-1 + 2 * cos_2sigma_m[i] ** 2)))
+        pending[i] = np.abs(lambda_[i] - previous) > tolerance
+
+    u_sq = cos_sq_alpha * (SEMI_MAJOR_AXIS ** 2 - SEMI_MINOR_AXIS ** 2) / \
+        SEMI_MINOR_AXIS ** 2
+    a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+    b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+    delta_sigma = b * sin_sigma * (cos_2sigma_m + b / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) -
+        b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) *
+        (-3 + 4 * cos_2sigma_m ** 2)))
+    result = SEMI_MINOR_AXIS * a * (sigma - delta_sigma)
+
+    result[pending] = haversine(lat1[pending], lon1[pending],
+                                lat2[pending], lon2[pending])
+    result[np.isnan(lat1 + lon1 + lat2 + lon2)] = np.nan
+    return result.reshape(shape)
+
+
+METHODS = {'haversine': haversine, 'vincenty': vincenty}
+
+
+def pairwise(lat1, lon1, lat2, lon2, method='haversine'):
+    """Distance between the i-th points of two arrays (NaN if unknown)."""
+    return METHODS[method](np.asarray(lat1, dtype=np.float64),
+                           np.asarray(lon1, dtype=np.float64),
+                           np.asarray(lat2, dtype=np.float64),
+                           np.asarray(lon2, dtype=np.float64))
+
+
+def matrix(lat1, lon1, lat2, lon2, method='haversine'):
+    """(n, m) distances between each of n points and each of m points."""
+    lat1, lon1 = (np.asarray(v, dtype=np.float64)[:, np.newaxis]
+                  for v in (lat1, lon1))
+    lat2, lon2 = (np.asarray(v, dtype=np.float64)[np.newaxis, :]
+                  for v in (lat2, lon2))
+    return METHODS[method](lat1, lon1, lat2, lon2)
+
+
+def segment_offsets(*keys):
+    """
+    :param keys: (numpy.ndarray) one or more arrays of group labels, sorted
+        so rows of the same group are contiguous
+    :return: (numpy.ndarray) the start of each group followed by the length
+        of the arrays
+    """
+    length = len(keys[0])
+    if not length:
+        return np.zeros(1, dtype=np.int64)
+    changes = np.zeros(length, dtype=bool)
+    changes[0] = True
+    for values in keys:
+        values = np.asarray(values)
+        changes[1:] |= values[1:] != values[:-1]
+    return np.append(np.flatnonzero(changes), length)
+
+
+def segment_ids(offsets):
+    """Group number of each row given the `offsets` of the groups."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def consecutive(lat, lon, offsets=None, method='haversine'):
+    """
+    :return: (numpy.ndarray) distance from each point to the previous one in
+        the same group (NaN for the first point of each group)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    result = np.full(len(lat), np.nan)
+    if len(lat) > 1:
+        result[1:] = pairwise(lat[:-1], lon[:-1], lat[1:], lon[1:], method)
+    if offsets is None:
+        offsets = np.array([0, len(lat)])
+    result[np.asarray(offsets[:-1])[np.diff(offsets) > 0]] = np.nan
+    return result
+
+
+def segment_sum(values, offsets):
+    """Sum of the (non NaN) values of each group."""
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    return np.bincount(segment_ids(offsets), weights=values,
+                       minlength=len(offsets) - 1)
+
+
+def path_length(lat, lon, offsets=None, method='haversine'):
+    """Sum of the distances between consecutive points of each group."""
+    if offsets is None:
+        offsets = np.array([0, len(lat)])
+    return segment_sum(consecutive(lat, lon, offsets, method), offsets)
+
+
+def all_pairs(lat, lon, offsets=None, method='haversine'):
+    """
+    :return: (tuple) arrays with the first and the second point of every
+        pair of points (first < second) in each group, their group and their
+        distance
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if offsets is None:
+        offsets = np.array([0, len(lat)])
+    offsets = np.asarray(offsets)
+    starts, sizes = offsets[:-1], np.diff(offsets)
+
+    first, second, groups = [], [], []
+    for size in np.unique(sizes[sizes > 1]):  # pairs of groups of each size
+        selected = np.flatnonzero(sizes == size)
+        i, j = np.triu_indices(size, 1)
+        first.append((starts[selected, np.newaxis] + i).ravel())
+        second.append((starts[selected, np.newaxis] + j).ravel())
+        groups.append(np.repeat(selected, len(i)))
+
+    if not first:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty, np.zeros(0)
+
+    first, second, groups = map(np.concatenate, (first, second, groups))
+    distances = pairwise(lat[first], lon[first], lat[second], lon[second],
+                         method)
+    return first, second, groups, distances
+
+
+def all_pairs_sum(lat, lon, offsets=None, method='haversine'):
+    """Sum of the distances between every pair of points of each group."""
+    if offsets is None:
+        offsets = np.array([0, len(lat)])
+    _, _, groups, distances = all_pairs(lat, lon, offsets, method)
+    return np.bincount(groups, weights=np.nan_to_num(distances),
+                       minlength=len(offsets) - 1)
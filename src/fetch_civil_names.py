@@ -1,11 +1,14 @@
 import datetime
 import os
-import requests
-import re
 import pandas as pd
 import numpy as np
 from bs4 import BeautifulSoup
 
+import http_cache
+from rate_limit import RateLimiter
+from catalog import newest_file
+from dataset_store import read_dataset
+
 
 class CivilNames:
 
@@ -24,40 +27,26 @@ class CivilNames:
         'index': False
     }
 
+    LIMITER = RateLimiter('camara.leg.br', rate=5)
+
     def __init__(self):
         self.total = 0
 
-    def find_newest_file(self, name):
-
-        date_regex = re.compile('\d{4}-\d{2}-\d{2}')
-
-        matches = (date_regex.findall(f) for f in os.listdir(self.DATA_PATH))
-        dates = sorted(set([l[0] for l in matches if l]), reverse=True)
-
-        for date in dates:
-            filename = '{}-{}.xz'.format(date, name)
-            filepath = os.path.join(self.DATA_PATH, filename)
-
-            if os.path.isfile(filepath):
-                return filepath
-
-        return None
-
     def read_csv(self, name):
 
-        newest_file = self.find_newest_file(name)
-        if newest_file is None:
-            msg = 'Could not find the dataset for {}.'.format(newest_file)
+        filepath = newest_file(name, self.DATA_PATH)
+        if filepath is None:
+            msg = 'Could not find the dataset for {}.'.format(name)
             raise TypeError(msg)
 
-        return pd.read_csv(newest_file, dtype={'congressperson_id': np.str})
+        return read_dataset(filepath, columns=('congressperson_id',))
 
     def get_all_congresspeople_ids(self):
         print('Fetching all congresspeople ids...')
 
         datasets = ('current-year', 'last-year', 'previous-years')
         ids = (self.read_csv(name)['congressperson_id'] for name in datasets)
-        distinct_ids = pd.concat(ids).unique()
+        distinct_ids = pd.concat(ids).dropna().unique()
         self.total = len(distinct_ids)
 
         yield from (str(idx).strip() for idx in distinct_ids)
@@ -100,7 +89,7 @@ class CivilNames:
 
     @staticmethod
     def fetch_repository(url, congressperson_id, parser):
-        page = requests.get(url)
+        page = http_cache.get(url, limiter=CivilNames.LIMITER)
 
         if page.status_code != 200:
             msg = 'HTTP request to {} failed with status code {}'
@@ -139,3 +128,4 @@ class CivilNames:
 if __name__ == '__main__':
     civil_names = CivilNames()
     civil_names.write_civil_file(civil_names.get_civil_names())
+    print(CivilNames.LIMITER.report())
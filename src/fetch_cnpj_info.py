@@ -1,18 +1,20 @@
 from concurrent import futures
-import json
 from optparse import OptionParser
 
-import itertools
 import numpy as np
 import os.path
 import pandas as pd
-import pickle
-import shutil
-from urllib.request import urlopen
 import re
 
+import cnpj_cpf
+import http_cache
+from rate_limit import RateLimiter
+from record_log import RecordLog
+from schema import STRING_DTYPE
+
 INFO_DATASET_PATH = os.path.join('data', 'cnpj-info.xz')
-TEMP_PATH = os.path.join('data', 'cnpj-info')
+LOG_PATH = os.path.join('data', 'cnpj-info.jsonl')
+REQUESTS_PER_MINUTE = 3  # receitaws free plan
 
 datasets_cols = {'reimbursements': 'cnpj_cpf',
                  'current-year': 'cnpj_cpf',
@@ -22,7 +24,7 @@ datasets_cols = {'reimbursements': 'cnpj_cpf',
 
 def load_info_dataset():
     if os.path.exists(INFO_DATASET_PATH):
-        return pd.read_csv(INFO_DATASET_PATH)
+        return pd.read_csv(INFO_DATASET_PATH, dtype=STRING_DTYPE)
     else:
         return pd.DataFrame(columns=['atividade_principal',
                                      'data_situacao',
@@ -52,51 +54,61 @@ def load_info_dataset():
 
 
 def read_cnpj_list_to_import(filename, column):
-    cnpj_list = pd.read_csv(filename,
-                    usecols=([column]),
-                    dtype={column: np.str}
-                )[column]
-    cnpj_list = cnpj_list.map(lambda cnpj:
-                              str(cnpj).replace(r'[./-]', '')).where(cnpj_list.str.len() == 14).unique()
-    return list(cnpj_list)
+    """Returns the sorted distinct CNPJ keys (see cnpj_cpf) of a column."""
+    cnpj_list = pd.read_csv(filename, usecols=[column], dtype=STRING_DTYPE)[column]
+    return cnpj_cpf.unique_keys(cnpj_cpf.cnpj_keys(cnpj_list))
 
 
 def remaining_cnpjs(cnpj_list_to_import, info_dataset):
-    cnpj_list = set(cnpj_list_to_import)
-    already_fetched = set(info_dataset['cnpj'].str.replace(r'[./-]', ''))
-    return list(cnpj_list - already_fetched)
+    already_fetched = cnpj_cpf.cnpj_keys(info_dataset['cnpj'])
+    return cnpj_cpf.setdiff(cnpj_list_to_import, already_fetched)
 
 
-def fetch_cnpj_info(cnpj, timeout=5):
+def fetch_cnpj_info(cnpj, limiter, timeout=5):
     url = 'http://receitaws.com.br/v1/cnpj/%s' % cnpj
     print('Fetching %s' % cnpj)
-    json_contents = urlopen(url, timeout=timeout).read().decode('utf-8')
-    return json.loads(json_contents)
+    response = http_cache.get(url, timeout=timeout, limiter=limiter)
+    response.raise_for_status()
+    return response.json()
 
 
-def write_cnpj_info(cnpj, cnpj_info):
+def write_cnpj_info(log, cnpj, cnpj_info):
     print('Writing %s' % cnpj)
-    with open('%s/%s.pkl' % (TEMP_PATH, cnpj), 'wb') as f:
-        pickle.dump(cnpj_info, f, pickle.HIGHEST_PROTOCOL)
-
-
-def read_cnpj_info(cnpj_filename):
-    with open('%s/%s' % (TEMP_PATH, cnpj_filename), 'rb') as f:
-        return pickle.load(f)
-
-
-def import_cnpj_infos(info_dataset):
-    cnpjs_to_import = [filename
-                       for filename in os.listdir(TEMP_PATH)
-                       if filename.endswith('.pkl')]
-    for filename in cnpjs_to_import:
-        print('Importing %s' % filename)
-        attributes = read_cnpj_info(filename)
-        info_dataset = info_dataset.append(attributes, ignore_index=True)
-    info_dataset.to_csv(INFO_DATASET_PATH,
+    log.append(cnpj_info)
+
+
+def merge_cnpj_infos(info_dataset, log):
+    """
+    Adds the CNPJ infos fetched so far (including the ones from previous,
+    interrupted runs) to the info dataset, reading the log in a single pass.
+    A CNPJ both in the info dataset and in the log (e.g. when a run stopped
+    after writing the dataset but before removing the log) is kept once,
+    with its most recent info.
+    """
+    fetched = log.to_dataframe()
+    if fetched.empty:
+        return info_dataset
+    print('Importing %i CNPJ\'s' % len(fetched))
+    merged = pd.concat([info_dataset, fetched], ignore_index=True, sort=False)
+    merged = merged.drop_duplicates('cnpj', keep='last')
+    return merged.reset_index(drop=True)
+
+
+def import_cnpj_infos(info_dataset, log):
+    """
+    Writes the info dataset with the CNPJ infos in the log to a temporary
+    file that then replaces the dataset (so a crash never leaves it half
+    written) and only then removes the log.
+    """
+    info_dataset = merge_cnpj_infos(info_dataset, log)
+    tmp = INFO_DATASET_PATH + '.tmp'
+    info_dataset.to_csv(tmp,
                         compression='xz',
                         encoding='utf-8',
                         index=False)
+    os.replace(tmp, INFO_DATASET_PATH)
+    log.remove()
+    return info_dataset
 
 
 def extract_dataset_name(filepath):
@@ -108,27 +120,32 @@ def extract_dataset_name(filepath):
     return filename_without_date[:filename_without_date.rfind('.')]
 
 parser = OptionParser()
+parser.add_option('-r', '--rate', type='float', default=REQUESTS_PER_MINUTE,
+                  help='max requests per minute (default: %default)')
+parser.add_option('-w', '--workers', type='int', default=10,
+                  help='max simultaneous requests (default: %default)')
 (options, args) = parser.parse_args()
 
 if args:
-    if not os.path.exists(TEMP_PATH):
-        os.makedirs(TEMP_PATH)
-
     filesNotFound = list(filter(lambda file: not os.path.exists(file) or
                                              datasets_cols.get(extract_dataset_name(file.lower())) is None, args))
     filesFound = list(filter(lambda file: os.path.exists(file) and
                                           datasets_cols.get(extract_dataset_name(file.lower())), args))
-    cnpj_list_to_import = list(itertools.chain.from_iterable(
-            map(lambda file: read_cnpj_list_to_import(file,
-                                                      datasets_cols.get(extract_dataset_name(file.lower()))),
-                filesFound)))
+    cnpj_list_to_import = np.concatenate(
+            [read_cnpj_list_to_import(file,
+                                      datasets_cols.get(extract_dataset_name(file.lower())))
+             for file in filesFound] + [np.empty(0, dtype=np.uint64)])
     info_dataset = load_info_dataset()
-    cnpj_list = remaining_cnpjs(cnpj_list_to_import, info_dataset)
+    log = RecordLog(LOG_PATH)
+    cnpj_list = remaining_cnpjs(cnpj_list_to_import,
+                                merge_cnpj_infos(info_dataset, log))
+    cnpj_list = cnpj_cpf.from_keys(cnpj_list)
 
     print('%i CNPJ\'s to be fetched' % len(cnpj_list_to_import))
 
-    with futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_cnpj_info = dict((executor.submit(fetch_cnpj_info, cnpj), cnpj)
+    limiter = RateLimiter('receitaws', options.rate / 60, options.workers)
+    with log, futures.ThreadPoolExecutor(max_workers=options.workers) as executor:
+        future_to_cnpj_info = dict((executor.submit(fetch_cnpj_info, cnpj, limiter), cnpj)
                                    for cnpj in cnpj_list)
 
         for future in futures.as_completed(future_to_cnpj_info):
@@ -136,9 +153,10 @@ if args:
             if future.exception() is not None:
                 print('%r raised an exception: %s' % (cnpj, future.exception()))
             else:
-                write_cnpj_info(cnpj, future.result())
+                write_cnpj_info(log, cnpj, future.result())
+    print(limiter.report())
 
-    import_cnpj_infos(info_dataset)
+    info_dataset = import_cnpj_infos(info_dataset, log)
 
     if len(filesNotFound) > 0:
         print('The following files were not found:')
@@ -148,11 +166,9 @@ if args:
         for file in datasets_cols:
             print('File: %s | Column: %s' % (file, datasets_cols[file]))
 
-    print('%i CNPJ\'s listed in file' % len(set(cnpj_list_to_import)))
+    print('%i CNPJ\'s listed in file' % len(cnpj_cpf.unique_keys(cnpj_list_to_import)))
     cnpj_list = remaining_cnpjs(cnpj_list_to_import, info_dataset)
     print('%i CNPJ\'s remaining' % len(cnpj_list))
-
-    shutil.rmtree(TEMP_PATH)
 else:
     print('no files to fetch CNPJ\'s')
     print('usage: fetch_cnpj_info.py \'filename\'')
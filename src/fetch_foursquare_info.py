@@ -1,48 +1,28 @@
 import configparser
 import datetime
-import numpy as np
 import os.path
 import pandas as pd
-import re
-import requests
 from pandas.io.json import json_normalize
 
+import cnpj_cpf
+import http_cache
+from rate_limit import RateLimiter
+from catalog import newest_file
+from schema import STRING_DTYPE
+
 DATA_DIR = 'data'
 DATE = datetime.date.today().strftime('%Y-%m-%d')
 
 
-def find_newest_file(name):
-    """
-    Assuming that the files will be in the form of :
-    yyyy-mm-dd-type_of_file.xz we can try to find the newest file
-    based on the date, but if the file doesn't exist fallback to another
-    date until all dates are exhausted
-    """
-    date_regex = re.compile('\d{4}-\d{2}-\d{2}')
-
-    matches = (date_regex.findall(f) for f in os.listdir(DATA_DIR))
-    dates = sorted(set([l[0] for l in matches if l]), reverse=True)
-    for date in dates:
-        filename = os.path.join(DATA_DIR, '{}-{}.xz'.format(date, name))
-        if os.path.isfile(filename):
-            return filename
-    return None
-
-
 def load_cnpjs(subquota_description):
-    """Return a list of CNPJs from the given subquota_description"""
+    """Return the sorted CNPJ keys (see cnpj_cpf) of a subquota_description"""
     u_cols = ['cnpj_cpf', 'subquota_description']
     docs = pd.read_csv(REIMBURSEMENTS_DATASET_PATH,
                        low_memory=False,
                        usecols=u_cols,
-                       dtype={'cnpj_cpf': np.str})
+                       dtype=STRING_DTYPE)
     meals = docs[docs.subquota_description == subquota_description]
-    return meals['cnpj_cpf'].unique()
-
-
-def only_numbers(string):
-    """Return a string w only the numbers from the given string"""
-    return re.sub("\D", "", string)
+    return cnpj_cpf.unique_keys(cnpj_cpf.keys(meals['cnpj_cpf']))
 
 
 def load_companies_dataset(cnpjs):
@@ -51,15 +31,18 @@ def load_companies_dataset(cnpjs):
     all_companies = pd.read_csv(COMPANIES_DATASET_PATH,
                                 low_memory=False,
                                 usecols=u_cols,
-                                dtype={'trade_name': np.str})
+                                dtype=STRING_DTYPE)
     all_companies = all_companies.dropna(subset=['cnpj', 'trade_name'])
-    all_companies['clean_cnpj'] = all_companies['cnpj'].map(only_numbers)
-    return all_companies[all_companies['clean_cnpj'].isin(cnpjs)]
+    keys = cnpj_cpf.keys(all_companies['cnpj'])
+    all_companies['clean_cnpj'] = cnpj_cpf.from_keys(keys)
+    return all_companies[cnpj_cpf.isin(keys, cnpjs)]
 
 
 def remaining_companies(companies, fetched_companies):
     """Return the first DF but without matching CNPJs from the second DF"""
-    remaining = companies[~companies['cnpj'].isin(fetched_companies['cnpj'])]
+    fetched = cnpj_cpf.isin(cnpj_cpf.keys(companies['cnpj']),
+                            cnpj_cpf.keys(fetched_companies['cnpj']))
+    remaining = companies[~fetched]
     return remaining.reset_index()
 
 
@@ -88,12 +71,12 @@ def search(company):
                    'intent': 'match'})
 
     url = 'https://api.foursquare.com/v2/venues/search'
-    response = requests.get(url, params=params)
+    response = http_cache.get(url, params=params, limiter=LIMITER)
     result = parse_search_results(response, True)
 
     if not result:
         params.pop('intent')
-        response = requests.get(url, params=params)
+        response = http_cache.get(url, params=params, limiter=LIMITER)
         result = parse_search_results(response, False)
 
     return result
@@ -112,7 +95,7 @@ def parse_search_results(response, confirmed_match):
 def fetch_venue(venue_id):
     """Return specific data from Foursquare for the given venue_id"""
     url = 'https://api.foursquare.com/v2/venues/%s' % venue_id
-    response = requests.get(url, params=DEFAULT_PARAMS)
+    response = http_cache.get(url, params=DEFAULT_PARAMS, limiter=LIMITER)
     return parse_venue_info(response)
 
 
@@ -141,11 +124,13 @@ VERSION = '20161021'
 DEFAULT_PARAMS = {'client_id': CLIENT_ID,
                   'client_secret': CLIENT_SECRET,
                   'v': VERSION}
+# Userless requests are limited to 5,000 per hour
+LIMITER = RateLimiter('Foursquare', rate=5000 / 3600)
 
 # Dataset paths
-REIMBURSEMENTS_DATASET_PATH = find_newest_file('reimbursements')
-COMPANIES_DATASET_PATH = find_newest_file('companies')
-FOURSQUARE_DATASET_PATH = find_newest_file('foursquare-companies')
+REIMBURSEMENTS_DATASET_PATH = newest_file('reimbursements', DATA_DIR)
+COMPANIES_DATASET_PATH = newest_file('companies', DATA_DIR)
+FOURSQUARE_DATASET_PATH = newest_file('foursquare-companies', DATA_DIR)
 OUTPUT_DATASET = '{}-foursquare-companies.xz'.format(DATE)
 OUTPUT_DATASET_PATH = os.path.join(DATA_DIR, OUTPUT_DATASET)
 
@@ -177,5 +162,6 @@ if __name__ == '__main__':
             print('###########################################')
             print("%s companies fetched. Stopping to save." % index)
             write_fetched_companies(fetched_companies)
+            print(LIMITER.report())
             print('###########################################')
     write_fetched_companies(fetched_companies)
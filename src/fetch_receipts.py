@@ -1,16 +1,21 @@
+import asyncio
+import hashlib
 import os
 import re
 import sys
+import time
 from argparse import ArgumentParser, RawTextHelpFormatter
-from itertools import islice
-from multiprocessing import Pool
 from urllib.error import HTTPError
-from urllib.request import urlretrieve
+from urllib.parse import urlparse
 
+import aiofiles
+import aiohttp
 from humanize import naturalsize
 import numpy as np
 import pandas as pd
 
+from dataset_store import read_dataset
+
 
 class Receipts:
     """Abstraction to a list of Receipts read from the datasets"""
@@ -19,62 +24,186 @@ class Receipts:
     DATA_DIR = os.path.join(BASE_DIR, 'data')
     REGEX = r'^[\d-]{11}(current-year|last-year|previous-years).xz$'
 
-    def __init__(self, target):
+    def __init__(self, target, manifest=None, years=None, applicants=None):
         """
         :param target: (str) path to the directory to save the receipt image
+        :param manifest: (Manifest) receipts already saved, to be skipped
+        :param years: (list) fetch only receipts from these years
+        :param applicants: (list) fetch only receipts from these applicant_id
         """
         self.target = target
+        self.manifest = manifest
+        self.years = years
+        self.applicants = applicants
 
     @property
     def datasets(self):
         """List generator with the full path of each CSV/dataset."""
         for file_name in os.listdir(self.DATA_DIR):
-            if re.compile(self.REGEX).match(file_name):
+            match = re.compile(self.REGEX).match(file_name)
+            if match and self.may_contain(file_name[:4], match.group(1)):
                 yield os.path.join(self.DATA_DIR, file_name)
 
+    def may_contain(self, date, name):
+        """
+        Tells whether a dataset from a given year (str) may contain receipts
+        from the years we are looking for (based on its name).
+        """
+        if not self.years:
+            return True
+
+        year = int(date)
+        if name == 'current-year':
+            return year in self.years
+        if name == 'last-year':
+            return year - 1 in self.years
+        return any(y < year - 1 for y in self.years)
+
+    @property
+    def filters(self):
+        filters = []
+        if self.years:
+            filters.append(('year', 'in', list(self.years)))
+        if self.applicants:
+            filters.append(('applicant_id', 'in', list(self.applicants)))
+        return filters
+
+    @staticmethod
+    def valid(df):
+        """Returns a DataFrame without rows missing any of the keys."""
+        df = df.dropna()
+        return df.astype({'applicant_id': np.int64,
+                          'year': np.int64,
+                          'document_id': np.int64})
+
     @property
     def all(self):
         """
-        List generator with Receipt objects containing the path of the
+        Candidates with the receipts (not saved yet) listed in the datasets,
+        which are turned into Receipt objects containing the path of the
         receipt image (to be used when saving it, for example) and the URL of
-        the receipt at the Lower House servers.
-        """
-        dtype = {
-            'document_id': np.str,
-            'congressperson_id': np.str,
-            'congressperson_document': np.str,
-            'term_id': np.str,
-            'cnpj_cpf': np.str,
-            'reimbursement_number': np.str
-        }
-        for dataset in self.datasets:
-            df = pd.read_csv(dataset, parse_dates=[16], dtype=dtype)
-            rows = filter(self.is_valid, df.itertuples())
-            yield from(Receipt(row, self.target) for row in rows)
+        the receipt at the Lower House servers only when iterated over.
+        """
+        columns = ('applicant_id', 'year', 'document_id')
+        datasets = [read_dataset(dataset,
+                                 columns=columns,
+                                 filters=self.filters)
+                    for dataset in self.datasets]
+        if not datasets:
+            return Candidates(pd.DataFrame(columns=columns), self.target)
 
-    @staticmethod
-    def is_valid(row):
-        if str(row.document_id).lower() == 'nan':
-            return False
+        df = self.valid(pd.concat(datasets)).drop_duplicates()
+        if self.manifest is not None:
+            df = df[self.manifest.missing(df)]
+        return Candidates(df, self.target)
 
-        required_fields = (row.applicant_id, row.year, row.document_id)
-        if any(map(pd.isnull, required_fields)):
-            return False
 
-        return True
+class Candidates:
+    """
+    Receipts to be downloaded, kept as arrays of applicant_id, year and
+    document_id: a Receipt object is only created when it is requested.
+    """
+
+    def __init__(self, df, target):
+        """
+        :param df: (pandas.DataFrame) applicant_id, year and document_id
+        :param target: (str) path to the directory to save the receipt image
+        """
+        self.applicant_ids = df['applicant_id'].values
+        self.years = df['year'].values
+        self.document_ids = df['document_id'].values
+        self.target = target
+
+    def __len__(self):
+        return len(self.document_ids)
+
+    def __getitem__(self, index):
+        return Receipt(self.applicant_ids[index],
+                       self.years[index],
+                       self.document_ids[index],
+                       self.target)
+
+    def __iter__(self):
+        return (self[index] for index in range(len(self)))
+
+
+class Manifest:
+    """
+    Persistent index of the receipts saved in a target directory, keyed by
+    applicant_id, year and document_id, with the size and the SHA-256
+    checksum of each file. If the manifest does not exist yet the target
+    directory is scanned once to index the receipts already saved there
+    (their checksums are left blank).
+    """
+
+    FILE_NAME = '.fetch_receipts.manifest'
+    KEYS = ('applicant_id', 'year', 'document_id')
+    COLUMNS = KEYS + ('size', 'checksum')
+
+    def __init__(self, target):
+        """
+        :param target: (str) path to the directory where receipts are saved
+        """
+        self.target = target
+        self.path = os.path.join(target, self.FILE_NAME)
+        if not os.path.exists(self.path):
+            self.scan()
+
+        self.data = pd.read_csv(self.path, dtype=str)
+        self.index = self.keys(self.data)
+
+    @classmethod
+    def keys(cls, df):
+        """Returns a MultiIndex of the receipt keys of a DataFrame."""
+        return pd.MultiIndex.from_arrays([df[key].astype(str).values
+                                          for key in cls.KEYS])
+
+    def missing(self, df):
+        """Returns a boolean mask of the rows of `df` not in the manifest."""
+        return ~self.keys(df).isin(self.index)
+
+    def scan(self):
+        """Writes a new manifest indexing the PDFs found in the target."""
+        print('Indexing receipts already saved in {}…'.format(self.target))
+        rows = []
+        for applicant in os.scandir(self.target):
+            if not applicant.is_dir():
+                continue
+            for year in os.scandir(applicant.path):
+                if not year.is_dir():
+                    continue
+                for receipt in os.scandir(year.path):
+                    name, extension = os.path.splitext(receipt.name)
+                    if extension != '.pdf':
+                        continue
+                    size = receipt.stat().st_size
+                    rows.append((applicant.name, year.name, name, size, ''))
+
+        df = pd.DataFrame(rows, columns=self.COLUMNS)
+        df.to_csv(self.path, index=False)
+
+    def add(self, receipt, size, checksum):
+        """Appends a saved receipt to the manifest."""
+        values = (receipt.applicant_id, receipt.year, receipt.document_id,
+                  size, checksum)
+        with open(self.path, 'a') as fh:
+            fh.write(','.join(map(str, values)) + '\n')
 
 
 class Receipt:
 
-    def __init__(self, receipt, target):
+    BASE_URL = 'http://www.camara.gov.br/cota-parlamentar/documentos/publ/'
+
+    def __init__(self, applicant_id, year, document_id, target):
         """
-        :param receipt: a Pandas DataFrame row as a NamedTuple (see
-        `itertuples` method)
+        :param applicant_id: (int) ID of the applicant
+        :param year: (int) year of the receipt
+        :param document_id: (int) ID of the document
         :param target: (str) path to the directory to save the receipt image
         """
-        self.applicant_id = receipt.applicant_id
-        self.year = receipt.year
-        self.document_id = receipt.document_id
+        self.applicant_id = applicant_id
+        self.year = year
+        self.document_id = document_id
         self.target = target
 
     @property
@@ -95,26 +224,148 @@ class Receipt:
         """
         Returns the URL of this receipt at the Lower House server.
         """
-        base = 'http://www.camara.gov.br/cota-parlamentar/documentos/publ/'
         recipe = '{base}{applicant_id}/{year}/{document_id}.pdf'
         return recipe.format(
-            base=base,
+            base=self.BASE_URL,
             applicant_id=self.applicant_id,
             year=self.year,
             document_id=self.document_id
         )
 
 
-def run(target, limit=None):
+class Downloader:
+    """
+    Downloads receipts concurrently using a pooled HTTP session, retrying
+    failed requests with exponential backoff. Each receipt is written to a
+    temporary file and renamed once complete, and then appended to the
+    manifest of the target directory, so an interrupted run can be resumed.
+    """
+
+    def __init__(self, manifest, concurrency=16, per_host=8, retries=3,
+                 backoff=1, timeout=60):
+        """
+        :param manifest: (Manifest) index of the receipts already saved
+        :param concurrency: (int) max simultaneous downloads
+        :param per_host: (int) max simultaneous downloads from a single host
+        :param retries: (int) how many times to retry a failed download
+        :param backoff: (float) seconds to wait before the first retry (this
+            doubles on each new attempt)
+        :param timeout: (float) seconds to wait for each download
+        """
+        self.manifest = manifest
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.hosts = {}
+        self.directories = set()
+
+    def host_semaphore(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = asyncio.Semaphore(self.per_host)
+        return self.hosts[host]
+
+    async def get(self, session, receipt, tmp):
+        """
+        Saves the receipt to `tmp` and returns its size in bytes and its
+        SHA-256 checksum. Raises `HTTPError` for error responses.
+        """
+        async with session.get(receipt.url) as response:
+            if response.status != 200:
+                raise HTTPError(receipt.url, response.status,
+                                response.reason, response.headers, None)
+
+            size, checksum = 0, hashlib.sha256()
+            async with aiofiles.open(tmp, mode='wb') as fh:
+                while True:
+                    block = await response.content.read(2 ** 16)
+                    if not block:
+                        break
+                    await fh.write(block)
+                    size += len(block)
+                    checksum.update(block)
+            return size, checksum.hexdigest()
+
+    async def download(self, session, receipt):
+        """
+        Downloads a receipt and returns a tuple (see `manage_progress`) with:
+            * a status message (str, 'ok' or 'error')
+            * the Receipt object
+            * meta information (size in bytes in case of success or error in
+              case of error)
+        """
+        directory = os.path.dirname(receipt.path)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+
+        tmp = receipt.path + '.part'
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+
+            try:
+                async with self.host_semaphore(receipt.url):
+                    coro = self.get(session, receipt, tmp)
+                    size, checksum = await asyncio.wait_for(coro,
+                                                            self.timeout)
+            except HTTPError as error:
+                meta = repr(error)
+                if error.code < 500:  # client errors are not worth retrying
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                meta = repr(e)
+            else:
+                os.replace(tmp, receipt.path)
+                self.manifest.add(receipt, size, checksum)
+                return 'ok', receipt, size
+
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return 'error', receipt, meta
+
+    async def worker(self, session, receipts, progress, limit):
+        """
+        Downloads receipts from the shared `receipts` iterator until it is
+        exhausted or `limit` receipts (in flight or saved) are reached.
+        """
+        while not limit or progress['count'] + progress['pending'] < limit:
+            receipt = next(receipts, None)
+            if receipt is None:
+                return
+
+            progress['pending'] += 1
+            status, receipt, meta = await self.download(session, receipt)
+            progress['pending'] -= 1
+            manage_progress(progress, status, receipt, meta)
+
+    async def run(self, receipts, progress, limit=None):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            workers = (self.worker(session, receipts, progress, limit)
+                       for _ in range(self.concurrency))
+            await asyncio.gather(*workers)
+        return progress
+
+
+def run(target, limit=None, years=None, applicants=None, **kwargs):
     """
     :param target: (string) path to the directory to save the receipts images
     :param limit: (int) limit the amount of receipts to fecth (default: None)
+    :param years: (list) fetch only receipts from these years (default: all)
+    :param applicants: (list) fetch only receipts from these applicant_id
+        (default: all)
+    :param kwargs: settings for the Downloader (concurrency, per_host,
+        retries, backoff and timeout)
     """
     progress = {
         'count': 0,
         'size': 0,
-        'errors': list(),
-        'skipped': list()
+        'pending': 0,
+        'start': time.time(),
+        'errors': list()
     }
 
     # check if target directory exists
@@ -128,43 +379,48 @@ def run(target, limit=None):
         sys.exit()
 
     # save receipts
-    with Pool(processes=4) as pool:
-        receipts = Receipts(target=target).all
-        while True:
-            receipts_slice = receipts
-            if limit:
-                receipts_slice = islice(receipts, limit - progress['count'])
+    manifest = Manifest(target)
+    print('==> {:,} receipts already saved'.format(len(manifest.data)))
+    receipts = Receipts(target=target,
+                        manifest=manifest,
+                        years=years,
+                        applicants=applicants).all
+    print('==> {:,} receipts to be saved'.format(len(receipts)))
+    receipts = iter(receipts)
+    downloader = Downloader(manifest, **kwargs)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(downloader.run(receipts, progress, limit))
 
-            for status, receipt, meta in pool.imap(download, receipts_slice):
-                progress = manage_progress(progress, status, receipt, meta)
+    return print_report(progress)
 
-            if not limit or progress['count'] >= limit:
-                break
 
-    return print_report(progress)
+def throughput(progress):
+    """Returns a tuple with files/s and bytes/s downloaded so far."""
+    elapsed = max(time.time() - progress['start'], 1e-6)
+    return progress['count'] / elapsed, progress['size'] / elapsed
 
 
 def manage_progress(progress, status, receipt, meta):
     """
     Given the current progress (dict) and the status, receipt and meta produced
-    by `download` method, it returns a update version of the progress (dict)
-    and print the current status for the user.
+    by `Downloader.download` method, it returns a update version of the
+    progress (dict) and print the current status for the user.
     """
     if status == 'ok':
         progress['count'] += 1
-        progress['size'] += int(meta['Content-Length'])
-
-    elif status == 'skipped':
-        progress['skipped'].append(receipt.url)
+        progress['size'] += meta
 
     elif status == 'error':
         progress['errors'].append(receipt.url)
 
-    raw_msg = '==> Downloaded {:,} files ({}). {}/{} skipped/errors           '
+    files, size = throughput(progress)
+    raw_msg = ('==> Downloaded {:,} files ({}) at {:.1f} files/s, {:.2f} MB/s.'
+               ' {} errors           ')
     msg = raw_msg.format(
         progress['count'],
         naturalsize(progress['size']),
-        len(progress['skipped']),
+        files,
+        size / 2 ** 20,
         len(progress['errors'])
     )
 
@@ -172,34 +428,15 @@ def manage_progress(progress, status, receipt, meta):
     return progress
 
 
-def download(receipt):
-    """
-    Downloads a receipt and returns a tuple.
-    :param receipt: (Receipt) Receipt object
-    :return: (tuple) containing:
-        * a status message (str, 'ok', 'error' or 'skipped')
-        * the Receipt object
-        * meta information (responde header in case of success, error in case
-          of error, or the receipt URL case it was skipped)
-    """
-    os.makedirs(os.path.dirname(receipt.path), exist_ok=True)
-    if not os.path.exists(receipt.path):
-        try:
-            file_name, header = urlretrieve(receipt.url, receipt.path)
-            return ('ok', receipt, header)
-        except HTTPError as e:
-            return ('error', receipt, repr(e))
-    else:
-        return 'skipped', receipt, receipt.url
-
-
 def print_report(progress):
     """
     Display status information of the operation
     :param progress: (dict) progress info as created within `run` method
     """
-    msg = '==> {:,} files downloaded ({})                                     '
-    print(msg.format(progress['count'], naturalsize(progress['size'])))
+    files, size = throughput(progress)
+    msg = '==> {:,} files downloaded ({}) at {:.1f} files/s, {:.2f} MB/s    '
+    print(msg.format(progress['count'], naturalsize(progress['size']),
+                     files, size / 2 ** 20))
 
     # print errors
     if progress['errors']:
@@ -208,13 +445,6 @@ def print_report(progress):
         for index, url in enumerate(progress['errors']):
             print('    {}. {}'.format(index + 1, url))
 
-    # print skipped files (already existing)
-    if progress['skipped']:
-        msg = '\n==> {:,} receipts were skipped (probably they already exist)'
-        print(msg.format(len(progress['skipped'])))
-        for index, url in enumerate(progress['skipped']):
-            print('    {}. {}'.format(index + 1, url))
-
 if __name__ == '__main__':
 
     # set argparse
@@ -241,6 +471,20 @@ if __name__ == '__main__':
     parser.add_argument('target', help='Directory where images will be saved.')
     parser.add_argument('-l', '--limit', default=0, type=int,
                         help='Limit the number of receipts to be saved')
+    parser.add_argument('-c', '--concurrency', default=16, type=int,
+                        help='Max simultaneous downloads (default: 16)')
+    parser.add_argument('-p', '--per-host', default=8, type=int,
+                        help='Max simultaneous downloads per host '
+                             '(default: 8)')
+    parser.add_argument('-r', '--retries', default=3, type=int,
+                        help='Retries for each failed download (default: 3)')
+    parser.add_argument('-y', '--year', type=int, nargs='+', dest='years',
+                        help='Fetch only receipts from these years')
+    parser.add_argument('-a', '--applicant', type=int, nargs='+',
+                        dest='applicants',
+                        help='Fetch only receipts from these applicant_id')
     args = parser.parse_args()
 
-    run(args.target, args.limit)
+    run(args.target, args.limit, years=args.years, applicants=args.applicants,
+        concurrency=args.concurrency, per_host=args.per_host,
+        retries=args.retries)
@@ -11,17 +11,25 @@ from csv import DictWriter
 from datetime import date
 from io import StringIO
 from itertools import chain
-from pathlib import Path
 from urllib.parse import urlencode
 
 import aiofiles
 import aiohttp
-import pandas as pd
 import numpy as np
-from geopy.distance import vincenty
+import pandas as pd
+
+import cnpj_cpf
+import distances
+from catalog import newest_file
+from http_cache import async_get
+from rate_limit import RateLimiter
+from schema import STRING_DTYPE
+from spatial_index import SpatialIndex
 
 
-DTYPE = dict(cnpj=np.str, cnpj_cpf=np.str)
+# companies closer than this (in meters) share the same Google Places search
+SAME_SPOT = 1
+
 LOG_FORMAT = '[%(levelname)s] %(asctime)s: %(message)s'
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=LOG_FORMAT)
@@ -87,16 +95,18 @@ class SexPlacesNearBy:
                 'strip club',
                 'swinger clubs')
 
-    def __init__(self, company, key=None):
+    def __init__(self, company, key=None, limiter=None):
         """
         :param company: (dict) Company with name, cnpj, latitude and longitude
         :param key: (str) Google Places API key
+        :param limiter: (RateLimiter) rate limiter of Google Places requests
         """
         settings = RawConfigParser()
         settings.read('config.ini')
         self.url = GooglePlacesURL(key or settings.get('Google', 'APIKey'))
 
         self.company = company
+        self.limiter = limiter
         self.latitude = self.company['latitude']
         self.longitude = self.company['longitude']
         self.places = []
@@ -161,11 +171,11 @@ class SexPlacesNearBy:
         location = '{},{}'.format(self.latitude, self.longitude)
         url = self.url.nearby(keyword, location)
         try:
-            response = await aiohttp.request('GET', url)
+            response = await async_get(url, limiter=self.limiter)
         except aiohttp.TimeoutError:
             logging.info('Timeout raised for {}'.format(url))
         else:
-            content = await response.text()
+            content = response.text
             place = self.parse(keyword, content)
             if place and isinstance(place.get('distance'), float):
                 self.places.append(place)
@@ -225,16 +235,15 @@ class SexPlacesNearBy:
         latitude = float(location.get('lat'))
         longitude = float(location.get('lng'))
 
-        company_location = (self.latitude, self.longitude)
-        place_location = (latitude, longitude)
-        distance = vincenty(company_location, place_location)
+        distance = distances.pairwise(self.latitude, self.longitude,
+                                      latitude, longitude, method='vincenty')
 
         return {
             'id': place.get('place_id'),
             'keyword': keyword,
             'latitude': latitude,
             'longitude': longitude,
-            'distance': distance.meters,
+            'distance': float(distance),
             'cnpj': self.company.get('cnpj'),
             'company_name': self.company.get('name'),
             'company_trade_name': self.company.get('trade_name')
@@ -250,13 +259,14 @@ class SexPlacesNearBy:
             return place
 
         # request place details
+        url = self.url.details(place_id)
         try:
-            response = await aiohttp.request('GET', self.url.details(place_id))
+            response = await async_get(url, limiter=self.limiter)
         except aiohttp.TimeoutError:
             logging.info('Timeout raised for {}'.format(url))
             return place
         else:
-            content = await response.text()
+            content = response.text
 
         # parse place details
         try:
@@ -302,66 +312,114 @@ async def write_to_csv(path, place=None, **kwargs):
             await fh.write(obj.getvalue())
 
 
-async def fetch_place(company, output, semaphore):
+def share_place(place, company):
+    """
+    Copy of a place found around a company for another company at the same
+    spot, with the distance measured from this other company.
+    :param place: (dict) place as returned by SexPlacesNearBy.get_closest
+    :param company: (dict) company with cnpj, names, latitude and longitude
+    :return: (dict) place for `company`
+    """
+    distance = distances.pairwise(float(company['latitude']),
+                                  float(company['longitude']),
+                                  place['latitude'], place['longitude'],
+                                  method='vincenty')
+    return dict(place,
+                distance=float(distance),
+                cnpj=company.get('cnpj'),
+                company_name=company.get('name'),
+                company_trade_name=company.get('trade_name'))
+
+
+def group_by_spot(companies, radius=SAME_SPOT):
+    """
+    Groups companies geocoded to the same spot (e.g. companies in the same
+    building) so the Google Places searches run once per spot.
+    :param companies: (Pandas DataFrame) with latitude and longitude
+    :param radius: (float) max distance (in meters) between companies of a
+        spot
+    :return: (list) a list per spot with the positions (in `companies`) of
+        its companies, the first one being the company to search around;
+        companies without coordinates are in spots of their own
+    """
+    latitude = pd.to_numeric(companies['latitude'], errors='coerce').values
+    longitude = pd.to_numeric(companies['longitude'], errors='coerce').values
+    located = ~(np.isnan(latitude) | np.isnan(longitude))
+    spots = [[position] for position in np.flatnonzero(~located)]
+    if not located.any():
+        return spots
+
+    index = SpatialIndex(latitude, longitude)
+    _, nearby = index.within(latitude[located], longitude[located], radius)
+    grouped = np.zeros(len(companies), dtype=bool)
+    for position, rows in zip(np.flatnonzero(located), nearby):
+        if grouped[position]:
+            continue
+        rows = rows[~grouped[rows]]
+        grouped[rows] = True
+        spots.append([position] + [row for row in rows if row != position])
+    return spots
+
+
+async def fetch_place(company, output, semaphore, limiter, neighbors=()):
     """
     Gets a company (dict), finds the closest place nearby and write the result
-    to a CSV file.
+    to a CSV file. The result is also written for each company (dict) in
+    `neighbors`, companies at the same spot as `company`.
     """
     with (await semaphore):
-        places = SexPlacesNearBy(company)
+        places = SexPlacesNearBy(company, limiter=limiter)
         await places.get_closest()
         if places.closest:
             await write_to_csv(output, places.closest)
+            for neighbor in neighbors:
+                await write_to_csv(output, share_place(places.closest,
+                                                       neighbor))
 
 
-async def main_coro(companies, output, max_requests):
+async def main_coro(companies, output, max_requests, max_rate):
     """
     :param companies: (Pandas DataFrame)
     :param output: (str) Path to the CSV output
     :param max_requests: (int) max parallel requests
+    :param max_rate: (float) max requests per second
     """
     # write CSV headers
     if is_new_dataset(output) and not companies.empty:
         await write_to_csv(output, headers=True)
 
-    semaphore = asyncio.Semaphore(max_requests // 13)  # 13 reqs per company
+    # the limiter controls the requests, the semaphore only avoids starting
+    # more companies than requests we can send in parallel
+    limiter = RateLimiter('Google Places', max_rate, max_requests)
+    semaphore = asyncio.Semaphore(max_requests)
     tasks = []
     logging.info("Let's get started!")
 
-    # write CSV data
-    for company_row in companies.itertuples(index=True):
-        company = dict(company_row._asdict())  # _asdict() returns OrderedDict
-        tasks.append(fetch_place(company, output, semaphore))
-
-    await asyncio.wait(tasks)
+    # write CSV data, searching once per spot
+    records = [dict(row._asdict())  # _asdict() returns OrderedDict
+               for row in companies.itertuples(index=True)]
+    spots = group_by_spot(companies)
+    msg = '{} companies at {} different spots'
+    logging.info(msg.format(len(records), len(spots)))
+    for company, *neighbors in spots:
+        neighbors = [records[position] for position in neighbors]
+        tasks.append(fetch_place(records[company], output, semaphore, limiter,
+                                 neighbors))
 
-
-def find_newest_file(pattern='*.*', source_dir='.'):
-    """
-    Assuming that the files will be in the form of:
-    yyyy-mm-dd-type-of-file.xz we can try to find the newest file
-    based on the date.
-    """
-    files = sorted(Path(source_dir).glob(pattern))
-    if not files:
-        return None
-
-    file = files.pop()
-    if not file:
-        return None
-
-    return str(file)
+    try:
+        await asyncio.wait(tasks)
+    finally:
+        logging.info(limiter.report())
 
 
-def load_newest_dataset(pattern, usecols, na_value=''):
-    filepath = find_newest_file(pattern)
+def load_dataset(filepath, usecols, na_value=''):
     if not filepath:
         return None
 
     logging.info('Loading {}'.format(filepath))
     dataset = pd.read_csv(
         filepath,
-        dtype=DTYPE,
+        dtype=STRING_DTYPE,
         low_memory=False,
         usecols=usecols
     )
@@ -384,12 +442,12 @@ def get_companies(companies_path, **kwargs):
 
     # load companies
     cols = ('cnpj', 'trade_name', 'name', 'latitude', 'longitude', 'city')
-    companies = load_newest_dataset(companies_path, cols)
-    companies['cnpj'] = companies['cnpj'].str.replace(r'\D', '')
+    companies = load_dataset(companies_path, cols)
+    companies['cnpj'] = cnpj_cpf.normalize(companies['cnpj'], cpf=False)
 
     # load & fiter reimbursements
     cols = ('total_net_value', 'cnpj_cpf', 'term')
-    reimbursements = load_newest_dataset('data/*-reimbursements.xz', cols)
+    reimbursements = load_dataset(newest_file('reimbursements'), cols)
     query = '(term == {}) & (total_net_value >= {})'.format(term, value)
     reimbursements = reimbursements.query(query)
 
@@ -409,26 +467,28 @@ def get_companies(companies_path, **kwargs):
 
     # load sexplaces & filter remaining companies
     cols = ('cnpj', )
-    sex_places = load_newest_dataset('data/*-sex-place-distances.xz', cols)
+    sex_places = load_dataset(newest_file('sex-place-distances'), cols)
     if sex_places is None or sex_places.empty:
         return companies
 
-    return companies[~companies.cnpj.isin(sex_places.cnpj)]
+    fetched = cnpj_cpf.isin(cnpj_cpf.cnpj_keys(companies.cnpj),
+                            cnpj_cpf.cnpj_keys(sex_places.cnpj))
+    return companies[~fetched]
 
 
 def is_new_dataset(output):
-    sex_places = find_newest_file('*sex-place-distances.xz', 'data')
+    sex_places = newest_file('sex-place-distances')
     if not sex_places:
         return True
 
     # convert previous database from xz to csv
-    pd.read_csv(sex_places, dtype=DTYPE).to_csv(output, index=False)
+    pd.read_csv(sex_places, dtype=STRING_DTYPE).to_csv(output, index=False)
     os.remove(sex_places)
     return False
 
 
 def convert_to_lzma(csv_output, xz_output):
-    uncompressed = pd.read_csv(csv_output, dtype=DTYPE)
+    uncompressed = pd.read_csv(csv_output, dtype=STRING_DTYPE)
     uncompressed.to_csv(xz_output, compression='xz', index=False)
     os.remove(csv_output)
 
@@ -444,7 +504,8 @@ def shutdown():
         task.cancel()
 
 
-def main(companies_path, max_requests=500, sample_size=None, filters=None):
+def main(companies_path, max_requests=500, sample_size=None, filters=None,
+         max_rate=50):
     if not filters:
         filters = dict()
 
@@ -473,7 +534,8 @@ def main(companies_path, max_requests=500, sample_size=None, filters=None):
     loop = asyncio.get_event_loop()
 
     try:
-        loop.run_until_complete(main_coro(companies, csv_output, max_requests))
+        coro = main_coro(companies, csv_output, max_requests, max_rate)
+        loop.run_until_complete(coro)
     except CancelledError:
         logging.debug('All async tasks were stopped')
     finally:
@@ -491,6 +553,10 @@ if __name__ == '__main__':
         '--max-parallel-requests', '-r', type=int, default=500,
         help='Max parallel requests (default: 500)'
     )
+    parser.add_argument(
+        '--max-rate', '-q', type=float, default=50,
+        help='Max requests per second (default: 50)'
+    )
     parser.add_argument(
         '--sample-size', '-s', type=int, default=None,
         help='Limit fetching to a given sample size (default: None)'
@@ -509,13 +575,10 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
-    # max parallel requests must be at least 13 (requests needed per company)
-    if args.max_parallel_requests < 13:
-        args.max_parallel_requests = 13
-
     main(
         args.companies_path,
         args.max_parallel_requests,
         args.sample_size,
-        dict(term=args.term, city=args.city, value=args.min_value)
+        dict(term=args.term, city=args.city, value=args.min_value),
+        args.max_rate
     )
@@ -1,14 +1,17 @@
 import json
-import requests
-import re
 import os.path
 import datetime
 import configparser
 from unicodedata import normalize
 import pandas as pd
-import numpy as np
 from pandas.io.json import json_normalize
 
+import cnpj_cpf
+import http_cache
+from rate_limit import RateLimiter
+from catalog import newest_file
+from schema import STRING_DTYPE
+
 
 """
 Get your API access token
@@ -25,40 +28,27 @@ def companies():
     # Loading reimbursements
     docs = pd.read_csv(REIMBURSEMENTS_DATASET_PATH,
                        low_memory=False,
-                       dtype={'cnpj_cpf': np.str})
+                       dtype=STRING_DTYPE)
     # Filtering only congressperson meals
     meal_docs = docs[docs.subquota_description == 'Congressperson meal']
     # Storing only unique CNPJs
-    meal_cnpjs = meal_docs['cnpj_cpf'].unique()
+    meal_cnpjs = cnpj_cpf.unique_keys(cnpj_cpf.keys(meal_docs['cnpj_cpf']))
     # Loading companies
     all_companies = pd.read_csv(COMPANIES_DATASET_PATH,
                                 low_memory=False,
-                                dtype={'trade_name': np.str})
+                                dtype=STRING_DTYPE)
     all_companies = all_companies[all_companies['trade_name'].notnull()]
     # Cleaning up companies CNPJs
-    all_companies['clean_cnpj'] = \
-        all_companies['cnpj'].map(lambda cnpj: cnpj.replace(
-            '.', '').replace('/', '').replace('-', ''))
+    keys = cnpj_cpf.keys(all_companies['cnpj'])
+    all_companies['clean_cnpj'] = cnpj_cpf.from_keys(keys)
     # Filtering only companies that are in meal reimbursements
-    return all_companies[all_companies['clean_cnpj'].isin(meal_cnpjs)]
-
-
-def find_newest_file(name):
-    date_regex = re.compile('\d{4}-\d{2}-\d{2}')
-
-    matches = (date_regex.findall(f) for f in os.listdir(DATA_DIR))
-    dates = sorted(set([l[0] for l in matches if l]), reverse=True)
-
-    for date in dates:
-        filename = '{}-{}.xz'.format(date, name)
-        filepath = os.path.join(DATA_DIR, filename)
-
-        if os.path.isfile(filepath):
-            return filepath
+    return all_companies[cnpj_cpf.isin(keys, meal_cnpjs)]
 
 
 def remaining_companies(fetched_companies, companies):
-    return companies[~companies['cnpj'].isin(fetched_companies['cnpj'])]
+    fetched = cnpj_cpf.isin(cnpj_cpf.keys(companies['cnpj']),
+                            cnpj_cpf.keys(fetched_companies['cnpj']))
+    return companies[~fetched]
 
 
 def load_companies_dataset():
@@ -90,7 +80,8 @@ def write_fetched_companies(companies):
 def fetch_yelp_info(**params):
     url = 'https://api.yelp.com/v3/businesses/search'
     headers = {"Authorization": "Bearer {}".format(ACCESS_TOKEN)}
-    response = requests.get(url, headers=headers, params=params)
+    response = http_cache.get(url, headers=headers, params=params,
+                              limiter=LIMITER)
     return parse_fetch_info(response)
 
 
@@ -101,13 +92,14 @@ def standardize_name(name):
 
 
 DATA_DIR = 'data'
-REIMBURSEMENTS_DATASET_PATH = find_newest_file('reimbursements')
-COMPANIES_DATASET_PATH = find_newest_file('companies')
+REIMBURSEMENTS_DATASET_PATH = newest_file('reimbursements', DATA_DIR)
+COMPANIES_DATASET_PATH = newest_file('companies', DATA_DIR)
 YELP_DATASET_PATH = os.path.join('data', 'yelp-companies.xz')
 
 settings = configparser.RawConfigParser()
 settings.read('config.ini')
 ACCESS_TOKEN = settings.get('Yelp', 'AccessToken')
+LIMITER = RateLimiter('Yelp', rate=5)
 
 
 if __name__ == '__main__':
@@ -148,6 +140,7 @@ if __name__ == '__main__':
             print('###########################################')
             print("%s requests made. Stopping to save." % index)
             write_fetched_companies(fetched_companies)
+            print(LIMITER.report())
             print('###########################################')
 
     write_fetched_companies(fetched_companies)
@@ -1,95 +1,219 @@
-from concurrent import futures
+import asyncio
 import configparser
-from geopy.geocoders import GoogleV3
-from geopy.exc import GeocoderTimedOut
-import pickle
-import os
+import logging
 import os.path
+import sys
+from argparse import ArgumentParser
+
+import aiohttp
+import numpy as np
 import pandas as pd
-import re
-import shutil
+
+from centroids import TIERS, offline_geocode
+from dataset_store import read_dataset, write_dataset
+from http_cache import async_get, is_cacheable
+from rate_limit import RateLimiter
 
 DATASET_PATH = os.path.join('data', 'companies.xz')
-TEMP_PATH = os.path.join('data', 'companies')
-CNPJ_REGEX = r'[./-]'
-
-settings = configparser.RawConfigParser()
-settings.read('config.ini')
-geolocator = GoogleV3(settings.get('Google', 'APIKey'))
-
-def geocode_companies(companies):
-    with futures.ThreadPoolExecutor(max_workers=40) as executor:
-        future_to_geocoding = dict()
-        for index, company in companies.iterrows():
-            future = executor.submit(geocode_company, company)
-            future_to_geocoding[future] = company
-        for future in futures.as_completed(future_to_geocoding):
-            company = future_to_geocoding[future]
-            if future.exception() is not None:
-                print('%r raised an exception: %s' % (company['cnpj'],
-                                                      future.exception()))
-            elif future.result() is not None:
-                write_geocoding_info(future.result(), company['cnpj'])
-        companies.apply(geocode_company, axis=1)
-
-def geocode_company(company):
-    address = ' '.join(company[['address',
-                                'number',
-                                'zip_code',
-                                'neighborhood',
-                                'city',
-                                'state']].dropna())
-    if address == '':
-        print('No address information for', company['name'], company['cnpj'])
-        return None
-    else:
-        try:
-            location = geolocator.geocode(address)
-        except GeocoderTimedOut as e:
-            print('Timeout')
-            return None
-        return location
-
-def write_geocoding_info(company_location, cnpj):
-    cnpj = re.sub(CNPJ_REGEX, '', cnpj)
-    print('Writing %s' % cnpj)
-    with open('%s/%s.pkl' % (TEMP_PATH, cnpj), 'wb') as f:
-        pickle.dump(company_location, f, pickle.HIGHEST_PROTOCOL)
-
-def read_geocoding_info(company):
-    cnpj = re.sub(CNPJ_REGEX, '', company['cnpj'])
-    filename = '%s/%s.pkl' % (TEMP_PATH, cnpj)
-    if os.path.isfile(filename):
-        with open(filename, 'rb') as f:
-            try:
-                location = pickle.load(f)
-            except (ValueError, EOFError) as e:
-                return pd.Series()
-        if location is None:
-            return pd.Series()
-        else:
-            return pd.Series({'latitude': location.latitude,
-                              'longitude': location.longitude})
+GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+ADDRESS_COLUMNS = ('address',
+                   'number',
+                   'zip_code',
+                   'neighborhood',
+                   'city',
+                   'state')
+LOG_FORMAT = '[%(levelname)s] %(asctime)s: %(message)s'
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format=LOG_FORMAT)
+
+
+def normalize_addresses(companies):
+    """
+    Builds a normalized address per company (uppercase, no accents, no
+    punctuation, zip code with digits only and single spaces), so companies
+    sharing an address are geocoded (and cached) only once.
+
+    :param companies: (pandas.DataFrame) with the ADDRESS_COLUMNS
+    :return: (pandas.Series) normalized addresses ('' if there is none)
+    """
+    parts = []
+    for column in ADDRESS_COLUMNS:
+        values = companies[column].astype(object).fillna('').astype(str)
+        if column == 'zip_code':
+            values = values.str.replace(r'\D', '', regex=True)
+        parts.append(values)
+
+    addresses = parts[0].str.cat(parts[1:], sep=' ')
+    addresses = addresses.str.normalize('NFKD') \
+        .str.encode('ascii', 'ignore').str.decode('ascii')
+    return addresses.str.upper() \
+        .str.replace(r'[^\w\s]', ' ', regex=True) \
+        .str.replace(r'\s+', ' ', regex=True) \
+        .str.strip()
+
+
+def parse_location(response):
+    """
+    :param response: (http_cache.CachedResponse) Geocoding API response
+    :return: (tuple) latitude and longitude (NaN if not found)
+    """
+    if is_cacheable(response):
+        results = response.json().get('results')
+        if results:
+            location = results[0]['geometry']['location']
+            return location['lat'], location['lng']
     else:
-        return pd.Series()
-
-
-
-if not os.path.exists(TEMP_PATH):
-    os.makedirs(TEMP_PATH)
-
-data = pd.read_csv(DATASET_PATH, low_memory=False)
-geocoded_cnpjs = [filename[:14]
-                  for filename in os.listdir(TEMP_PATH)
-                  if filename.endswith('.pkl')]
-is_not_geocoded = ~data['cnpj'].str.replace(CNPJ_REGEX, '').isin(geocoded_cnpjs)
-remaining_companies = data[is_not_geocoded]
-print('%i companies, %i to go' % (len(data), len(remaining_companies)))
-geocode_companies(remaining_companies)
-data = pd.concat([data,
-                  data.apply(read_geocoding_info, axis=1)], axis=1)
-data.to_csv(DATASET_PATH,
-            compression='xz',
-            encoding='utf-8',
-            index=False)
-shutil.rmtree(TEMP_PATH)
+        msg = 'Geocoding API answered {}: {}'
+        logging.info(msg.format(response.status_code, response.text[:200]))
+    return np.nan, np.nan
+
+
+async def geocode_address(address, key, limiter):
+    params = {'address': address, 'key': key}
+    try:
+        response = await async_get(GEOCODE_URL, params=params,
+                                   limiter=limiter)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        logging.info('{} raised {!r}'.format(address, error))
+        return np.nan, np.nan
+    return parse_location(response)
+
+
+async def geocode_addresses(addresses, key, limiter, workers=None):
+    """
+    Geocodes addresses with a pool of workers taking them from a queue, so
+    there are never more requests waiting for the limiter than workers.
+
+    :param addresses: (iterable) distinct normalized addresses
+    :param key: (str) Google API key
+    :param limiter: (RateLimiter) limiter of the Geocoding API
+    :param workers: (int) number of workers (default: the max concurrency
+        of the limiter)
+    :return: (numpy.ndarray) a row with latitude and longitude per address
+    """
+    queue = asyncio.Queue()
+    for position, address in enumerate(addresses):
+        queue.put_nowait((position, address))
+    locations = np.full((queue.qsize(), 2), np.nan)
+
+    async def worker():
+        while not queue.empty():
+            position, address = queue.get_nowait()
+            locations[position] = await geocode_address(address, key, limiter)
+
+    workers = min(workers or limiter.max_concurrency, queue.qsize())
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return locations
+
+
+def precision_ranks(precision):
+    """Position of each precision in TIERS (len(TIERS) when missing)."""
+    ranks = pd.Series(precision).map({t: i for i, t in enumerate(TIERS)})
+    return ranks.fillna(len(TIERS)).to_numpy(dtype=np.int64)
+
+
+def geocode_companies(data, key, limiter, precision='address'):
+    """
+    Geocodes companies without a location at least as precise as
+    `precision` (one of TIERS): first offline, with the centroids of the
+    companies already geocoded by address, and only the ones still missing
+    through the Geocoding API, requesting each distinct address once and
+    joining the results back by position. Companies the API cannot find get
+    the best offline location available.
+    """
+    for column in ('latitude', 'longitude', 'geocoding_precision'):
+        if column not in data.columns:
+            data[column] = np.nan
+
+    latitude = data['latitude'].values.astype(np.float64)
+    longitude = data['longitude'].values.astype(np.float64)
+    tiers = data['geocoding_precision'].values.astype(object)
+    located = ~np.isnan(latitude) & ~np.isnan(longitude)
+    tiers[located & pd.isnull(tiers)] = 'address'  # geocoded before tiers
+    tiers[~located] = np.nan
+
+    def update(rows, locations):
+        """Keeps the new locations more precise than the current ones."""
+        better = precision_ranks(locations['geocoding_precision'].values) < \
+            precision_ranks(tiers[rows])
+        rows = rows[better]
+        latitude[rows] = locations['latitude'].values[better]
+        longitude[rows] = locations['longitude'].values[better]
+        tiers[rows] = locations['geocoding_precision'].values[better]
+
+    def offline(rows):
+        reference = data[tiers == 'address'][['zip_code', 'city', 'state']]
+        reference = reference.assign(latitude=latitude[tiers == 'address'],
+                                     longitude=longitude[tiers == 'address'])
+        return offline_geocode(data.iloc[rows], reference)
+
+    required = TIERS.index(precision)
+    rows = np.flatnonzero(precision_ranks(tiers) > required)
+    locations = offline(rows)
+    good = precision_ranks(locations['geocoding_precision'].values) <= required
+    update(rows[good], locations[good])
+
+    addresses = normalize_addresses(data)
+    pending = (precision_ranks(tiers) > required) & (addresses != '').values
+    codes, unique = pd.factorize(addresses[pending])
+    msg = ('{:,} companies, {:,} located offline, {:,} to go '
+           '({:,} distinct addresses)')
+    print(msg.format(len(data), good.sum(), pending.sum(), len(unique)))
+
+    if len(unique):
+        loop = asyncio.get_event_loop()
+        found = loop.run_until_complete(
+            geocode_addresses(unique, key, limiter))
+        print(limiter.report())
+
+        found = pd.DataFrame({'latitude': found[codes, 0],
+                              'longitude': found[codes, 1],
+                              'geocoding_precision': 'address'})
+        found.loc[found['latitude'].isnull(), 'geocoding_precision'] = np.nan
+        update(np.flatnonzero(pending), found)
+
+    rows = np.flatnonzero(precision_ranks(tiers) > required)
+    update(rows, offline(rows))
+
+    data['latitude'] = latitude
+    data['longitude'] = longitude
+    data['geocoding_precision'] = tiers
+    counts = data['geocoding_precision'].value_counts()
+    counts = counts.reindex(TIERS).fillna(0).astype(int)
+    print('Locations per precision: {}'.format(
+        ', '.join('{} {:,}'.format(t, c) for t, c in counts.items())))
+    return data
+
+
+def main(max_rate=50, max_requests=40, precision='address'):
+    settings = configparser.RawConfigParser()
+    settings.read('config.ini')
+    key = settings.get('Google', 'APIKey')
+    limiter = RateLimiter('Google Geocoding', max_rate, max_requests)
+
+    data = read_dataset(DATASET_PATH)
+    data = geocode_companies(data, key, limiter, precision)
+    write_dataset(data, DATASET_PATH)
+
+
+if __name__ == '__main__':
+    description = (
+        'Adds latitude and longitude to the companies dataset. '
+        'Requires a Google API key set at config.ini.'
+    )
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--max-rate', '-q', type=float, default=50,
+        help='Max requests per second (default: 50)'
+    )
+    parser.add_argument(
+        '--max-parallel-requests', '-r', type=int, default=40,
+        help='Max parallel requests (default: 40)'
+    )
+    parser.add_argument(
+        '--precision', '-p', choices=TIERS, default='address',
+        help=('Precision required: companies located offline at least as '
+              'precisely are not sent to the API (default: address)')
+    )
+    args = parser.parse_args()
+    main(args.max_rate, args.max_parallel_requests, args.precision)
@@ -1,18 +1,21 @@
 import os
-import re
 import datetime
 
-import requests
-import numpy as np
 import pandas as pd
 from bs4 import BeautifulSoup
 
+import http_cache
+from rate_limit import RateLimiter
+from catalog import newest_file
+from dataset_store import read_dataset
+
 DATE = datetime.date.today().strftime('%Y-%m-%d')
 DATA_DIR = 'data'
 PROCESSED_DATA_FILE = '{}-congressperson-relatives.xz'
 PROCESSED_DATA_PATH = os.path.join(DATA_DIR, PROCESSED_DATA_FILE).format(DATE)
 RAW_DATA_FILE = '{}-congressperson-relatives-raw.xz'
 RAW_DATA_PATH = os.path.join(DATA_DIR, RAW_DATA_FILE).format(DATE)
+LIMITER = RateLimiter('camara.leg.br', rate=5)
 
 write_csv_params = {
     'compression': 'xz',
@@ -76,41 +79,15 @@ def get_all_congress_people_ids():
     print('Fetching all congresspeople ids', end='\r')
     ids_series = [read_csv(name)['congressperson_id']
                   for name in ['current-year', 'last-year', 'previous-years']]
-    return list(pd.concat(ids_series).unique())
-
-
-def find_newest_file(name):
-    """
-    Assuming that the files will be in the form of :
-    yyyy-mm-dd-type_of_file.xz we can try to find the newest file
-    based on the date, but if the file doesn't exist fallback to another
-    date until all dates are exhausted
-    """
-    date_regex = re.compile('\d{4}-\d{2}-\d{2}')
-
-    matches = (date_regex.findall(f) for f in os.listdir(DATA_DIR))
-    dates = sorted(set([l[0] for l in matches if l]), reverse=True)
-    for date in dates:
-        filename = os.path.join(DATA_DIR, '{}-{}.xz'.format(date, name))
-        if os.path.isfile(filename):
-            return filename
-
-    return None
+    return list(pd.concat(ids_series).dropna().unique())
 
 
 def read_csv(name):
-    filename = find_newest_file(name)
+    filename = newest_file(name, DATA_DIR)
     if filename is None:
         raise TypeError('could not find the dataset for {}.'.format(name))
 
-    return pd.read_csv(filename,
-                       parse_dates=[16],
-                       dtype={'document_id': np.str,
-                              'congressperson_id': np.str,
-                              'congressperson_document': np.str,
-                              'term_id': np.str,
-                              'cnpj_cpf': np.str,
-                              'reimbursement_number': np.str})
+    return read_dataset(filename, columns=('congressperson_id',))
 
 
 def write_formatted_data(df):
@@ -157,7 +134,8 @@ def get_congresspeople_parents_names():
     for i, id in enumerate(ids):
         id = str(id).replace('\n', '').strip()
         try:
-            data = requests.get(url.format(id)).content.decode('utf8')
+            response = http_cache.get(url.format(id), limiter=LIMITER)
+            data = response.content.decode('utf8')
             soup = BeautifulSoup(str(data), 'html.parser')
             bio_details = soup.findAll('div', {'class': 'bioDetalhes'})
             contents_bio_details = extract_contents_from_div(bio_details)
@@ -169,6 +147,7 @@ def get_congresspeople_parents_names():
 
         msg = 'Processed {} out of {} ({:.2f}%)'
         print(msg.format(i, total, i / total * 100), end='\r')
+    print(LIMITER.report())
 
     df = pd.DataFrame(data=dicts)
     df = df[df['Filiação'].notnull()]
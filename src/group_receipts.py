@@ -1,9 +1,21 @@
 import datetime
+import hashlib
+import json
+import lzma
 import os
-import re
+import shutil
+import tempfile
+from argparse import ArgumentParser
 import pandas as pd
 import numpy as np
 
+import cnpj_cpf
+from catalog import file_hash, get_catalog, newest_file, register
+from dataset_store import (DatasetWriter, columnar_path, iter_dataset,
+                           read_dataset, write_dataset)
+from money import CENTAVOS, unreconciled
+from schema import DTYPE, cast, concat, export
+
 
 class Reimbursements:
 
@@ -13,132 +25,426 @@ class Reimbursements:
     DATE = datetime.date.today().strftime('%Y-%m-%d')
     FILE_BASE_NAME = '{}-reimbursements.xz'.format(DATE)
 
-    CSV_PARAMS = {
-        'compression': 'xz',
-        'encoding': 'utf-8',
-        'index': False
-    }
-
-    def find_newest_file(self, name):
-        date_regex = re.compile('\d{4}-\d{2}-\d{2}')
-
-        matches = (date_regex.findall(f) for f in os.listdir(self.DATA_PATH))
-        dates = sorted(set([l[0] for l in matches if l]), reverse=True)
-
-        for date in dates:
-            filename = '{}-{}.xz'.format(date, name)
-            filepath = os.path.join(self.DATA_PATH, filename)
-            if os.path.isfile(filepath):
-                return filepath
-        return None
-
-    def read_csv(self, name):
-        newest_file = self.find_newest_file(name)
-        if newest_file is None:
-            msg = 'Could not find the dataset for {}.'.format(newest_file)
+    DATASETS = ('current-year', 'last-year', 'previous-years')
+    PARTITIONS_PATH = os.path.join(DATA_PATH, 'reimbursements')
+    MANIFEST_PATH = os.path.join(PARTITIONS_PATH, 'manifest.json')
+
+    # rough number of copies of a partition held in memory while grouping it
+    STREAM_COPIES = 4
+
+    def read_csv(self, name, **kwargs):
+        filepath = newest_file(name, self.DATA_PATH)
+        if filepath is None:
+            msg = 'Could not find the dataset for {}.'.format(name)
             raise TypeError(msg)
 
-        print('Loading {}…'.format(newest_file))
-        dtype = {
-            'applicant_id': np.str,
-            'batch_number': np.str,
-            'cnpj_cpf': np.str,
-            'congressperson_document': np.str,
-            'congressperson_id': np.str,
-            'document_id': np.str,
-            'document_number': np.str,
-            'document_type': np.str,
-            'leg_of_the_trip': np.str,
-            'passenger': np.str,
-            'reimbursement_number': np.str,
-            'subquota_group_description': np.str,
-            'subquota_group_id': np.str,
-            'subquota_number': np.str,
-            'term_id': np.str,
-        }
-        return pd.read_csv(newest_file, dtype=dtype)
+        print('Loading {}…'.format(filepath))
+        chunksize = kwargs.pop('chunksize', None)
+        if chunksize:
+            return iter_dataset(filepath, chunksize, **kwargs)
+        return read_dataset(filepath, **kwargs)
 
     @property
     def receipts(self):
         print('Merging all datasets…')
-        datasets = ('current-year', 'last-year', 'previous-years')
-        data = (self.read_csv(name) for name in datasets)
-        return pd.concat(data)
+        data = (self.read_csv(name) for name in self.DATASETS)
+        return concat(data)
+
+    @staticmethod
+    def group_codes(data, keys):
+        """
+        Factorizes each column in `keys` (sorted, as `groupby` would do) and
+        returns a tuple with:
+            * the positions that sort `data` by `keys` (stable, so rows keep
+              their original order inside each group)
+            * an array with the group number of each sorted row
+            * the number of rows in each group
+        """
+        codes = [pd.factorize(data[key], sort=True)[0] for key in keys]
+        order = np.lexsort(codes[::-1])
+        sorted_codes = np.vstack([code[order] for code in codes])
+
+        starts = np.ones(len(order), dtype=bool)
+        starts[1:] = (sorted_codes[:, 1:] != sorted_codes[:, :-1]).any(axis=0)
+        groups = np.cumsum(starts) - 1
+        sizes = np.diff(np.append(np.flatnonzero(starts), len(order)))
+        return order, groups, sizes
 
     @staticmethod
-    def aggregate(grouped, old, new, func):
+    def group_sum(values, sizes):
         """
-        Gets a GroupBy object, aggregates it on `old` using `func`, then rename
-        the series name from `old` to `new`, returning a DataFrame.
+        Sums `values` in centavos (already sorted by group) per group,
+        ignoring missing values as `np.sum` does within a `groupby`, and
+        repeats each total for every row of its group. Sums are exact.
         """
-        output = grouped[old].agg(func)
-        output = output.rename(index=new, inplace=True)
-        return output.reset_index()
+        values = pd.Series(values).fillna(0).to_numpy(dtype=np.int64)
+        starts = np.cumsum(sizes) - sizes
+        totals = np.add.reduceat(values, starts) if len(values) else values
+        return pd.array(np.repeat(totals, sizes), dtype=CENTAVOS)
+
+    @staticmethod
+    def group_join(strings, groups, sizes):
+        """
+        Joins the distinct `strings` (already sorted by group) of each group
+        with commas, in sorted order, and repeats each result for every row of
+        its group.
+        """
+        if not len(strings):
+            return np.array([], dtype=object)
+
+        codes, uniques = pd.factorize(strings, sort=True)
+        order = np.lexsort((codes, groups))
+        pairs = np.vstack((groups[order], codes[order]))
+        distinct = np.ones(len(order), dtype=bool)
+        distinct[1:] = (pairs[:, 1:] != pairs[:, :-1]).any(axis=0)
+
+        names = np.asarray(uniques.astype(str), dtype=object)
+        names = names[pairs[1, distinct]]
+        bounds = np.cumsum(np.bincount(pairs[0, distinct],
+                                       minlength=len(sizes)))[:-1]
+        joined = [', '.join(chunk) for chunk in np.split(names, bounds)]
+        return np.repeat(np.array(joined, dtype=object), sizes)
 
     def group(self, receipts):
         print('Dropping rows without document_value or reimbursement_number…')
         subset = ('document_value', 'reimbursement_number')
         receipts = receipts.dropna(subset=subset)
 
+        flagged = unreconciled(receipts).sum()
+        if flagged:
+            msg = 'Found {:,} receipts whose net value does not reconcile.'
+            print(msg.format(flagged))
+
         print('Grouping dataset by applicant_id, document_id and year…')
+        # rows come out sorted by these keys, as numbers (the IDs used to be
+        # strings, sorted as text)
         keys = ('year', 'applicant_id', 'document_id')
         valid_receipts = receipts[(~receipts['document_id'].isnull()) &
                                   (~receipts['year'].isnull()) &
                                   (~receipts['applicant_id'].isnull())]
-        grouped = valid_receipts.groupby(keys)
+        order, groups, sizes = self.group_codes(valid_receipts, keys)
+        final = valid_receipts.iloc[order].reset_index(drop=True)
 
         print('Gathering all reimbursement numbers together…')
-        numbers = self.aggregate(
-            grouped,
-            'reimbursement_number',
-            'reimbursement_numbers',
-            lambda x: ', '.join(set(x))
-        )
+        numbers = self.group_join(
+            final['reimbursement_number'].values, groups, sizes)
 
         print('Summing all net values together…')
-        net_total = self.aggregate(
-            grouped,
-            'net_value',
-            'total_net_value',
-            np.sum
-        )
+        net_total = self.group_sum(final['net_value'].values, sizes)
 
         print('Summing all reimbursement values together…')
-        total = self.aggregate(
-            grouped,
-            'reimbursement_value',
-            'reimbursement_value_total',
-            np.sum
-        )
+        total = self.group_sum(final['reimbursement_value'].values, sizes)
+
+        print('Validating CNPJ and CPF check digits…')
+        valid_cnpj_cpf, _ = cnpj_cpf.validate(final['cnpj_cpf'])
 
         print('Generating the new dataset…')
-        final = pd.merge(
-            pd.merge(pd.merge(total, net_total, on=keys), numbers, on=keys),
-            valid_receipts,
-            on=keys
-        )
+        final = final.drop('reimbursement_number', axis=1)
         final.rename(columns={'net_value': 'net_values',
                               'reimbursement_value': 'reimbursement_values'},
                      inplace=True)
-        final = final.drop('reimbursement_number', 1)
+        columns = [c for c in final.columns if c not in keys]
+        final = final[list(keys) + columns]
+        final.insert(3, 'reimbursement_numbers', numbers)
+        final.insert(3, 'total_net_value', net_total)
+        final.insert(3, 'reimbursement_value_total', total)
+        final.insert(final.columns.get_loc('cnpj_cpf') + 1,
+                     'valid_cnpj_cpf', valid_cnpj_cpf)
         return final
 
-    @staticmethod
-    def unique_str(strings):
-        return ', '.join(set(strings))
-
     def write_reimbursement_file(self, receipts):
         print('Casting changes to a new DataFrame…')
         df = pd.DataFrame(data=receipts)
 
         print('Writing it to file…')
         filepath = os.path.join(self.DATA_PATH, self.FILE_BASE_NAME)
-        df.to_csv(filepath, **self.CSV_PARAMS)
+        write_dataset(df, filepath)
+
+        print('Done.')
+
+    @staticmethod
+    def rows_hash(data):
+        """Returns a SHA-256 hex digest of the contents of a DataFrame."""
+        hashes = pd.util.hash_pandas_object(data, index=False).values
+        return hashlib.sha256(hashes.tobytes()).hexdigest()
+
+    def load_manifest(self):
+        """
+        Returns the manifest of the partitioned reimbursements, a dict with:
+            * datasets: file name, size, modification time, hash and years
+              of each input dataset last grouped
+            * years: hash of the input rows of each partition
+            * columns: header of the grouped dataset
+        """
+        if not os.path.isfile(self.MANIFEST_PATH):
+            return {'datasets': {}, 'years': {}, 'columns': None}
+        with open(self.MANIFEST_PATH) as fh:
+            return json.load(fh)
+
+    def write_manifest(self, manifest):
+        tmp = self.MANIFEST_PATH + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+        os.replace(tmp, self.MANIFEST_PATH)
+
+    def input_state(self, name, previous):
+        """
+        Returns a dict with the file name, size, modification time and hash
+        of the newest version of an input dataset. Its hash is reused from
+        `previous` (its entry in the manifest) only when the file name, size
+        and modification time match, so an input rewritten in place is not
+        mistaken for an unchanged one; otherwise it comes from the catalog
+        (or from hashing the file, if the catalog entry is outdated).
+        """
+        filepath = newest_file(name, self.DATA_PATH)
+        if filepath is None:
+            msg = 'Could not find the dataset for {}.'.format(name)
+            raise TypeError(msg)
+
+        stat = os.stat(filepath)
+        state = {'file': os.path.basename(filepath),
+                 'size': stat.st_size,
+                 'mtime': stat.st_mtime_ns}
+        unchanged = all(previous.get(key) == value
+                        for key, value in state.items())
+        if unchanged and 'hash' in previous:
+            state['hash'] = previous['hash']
+            return state
+
+        entry = get_catalog(self.DATA_PATH).entry(filepath)
+        if (entry['size'], entry['mtime']) == (state['size'], state['mtime']):
+            state['hash'] = entry['hash']
+        else:
+            state['hash'] = file_hash(filepath)
+        return state
+
+    def partition_path(self, year):
+        return os.path.join(self.PARTITIONS_PATH, '{}.xz'.format(year))
+
+    def write_partition(self, year, grouped):
+        """
+        Writes a grouped year as a headerless xz CSV, so partitions can be
+        concatenated as xz streams to assemble the full dataset (and as
+        Parquet, if available).
+        """
+        write_dataset(grouped, self.partition_path(year), header=False)
+
+    def incremental(self, force=False):
+        """
+        Regroups only the years whose input rows changed since the last run
+        (or every year if `force` is set), keeping the grouped dataset
+        partitioned by year in `PARTITIONS_PATH`, and then assembles the full
+        reimbursements file from the partitions.
+        """
+        os.makedirs(self.PARTITIONS_PATH, exist_ok=True)
+        manifest = self.load_manifest()
+        if force:
+            manifest = {'datasets': {}, 'years': {}, 'columns': None}
+
+        previous = manifest['datasets']
+        inputs = {name: self.input_state(name, previous.get(name, {}))
+                  for name in self.DATASETS}
+        changed = [name for name in self.DATASETS if
+                   previous.get(name, {}).get('hash') != inputs[name]['hash']]
+        for name in set(self.DATASETS) - set(changed):
+            previous[name].update(inputs[name])
+        if not changed:
+            print('No dataset changed since the last run.')
+            self.write_manifest(manifest)
+            return self.assemble(manifest)
+
+        # unchanged datasets sharing a year with a changed one are reloaded so
+        # that year is regrouped with all of its rows
+        touched = set()
+        for name in changed:
+            touched.update(previous.get(name, {}).get('years', ()))
+        to_read = [name for name in self.DATASETS if name in changed or
+                   touched & set(previous.get(name, {}).get('years', ()))]
+
+        datasets = {name: self.read_csv(name) for name in to_read}
+        for name, data in datasets.items():
+            years = data['year'].dropna().unique()
+            previous[name] = dict(inputs[name],
+                                  years=sorted(str(int(y)) for y in years))
+        receipts = concat(datasets.values())
+        del datasets
+
+        years = set()
+        for year, rows in receipts.groupby('year', sort=True):
+            year = str(int(year))
+            years.add(year)
+            digest = self.rows_hash(rows)
+            exists = os.path.isfile(self.partition_path(year))
+            if manifest['years'].get(year) == digest and exists:
+                continue
+
+            print('Regrouping {}…'.format(year))
+            grouped = self.group(rows)
+            columns = list(grouped.columns)
+            if manifest['columns'] not in (None, columns):
+                print('Columns changed, rebuilding every partition…')
+                return self.incremental(force=True)
+            manifest['columns'] = columns
+            self.write_partition(year, grouped)
+            manifest['years'][year] = digest
+
+        known = set(y for data in previous.values() for y in data['years'])
+        for year in set(manifest['years']) - known:
+            print('Removing {}…'.format(year))
+            manifest['years'].pop(year, None)
+            if os.path.isfile(self.partition_path(year)):
+                os.remove(self.partition_path(year))
+
+        self.write_manifest(manifest)
+        return self.assemble(manifest)
+
+    def assemble(self, manifest):
+        """
+        Writes the full reimbursements file by concatenating a header stream
+        and every year partition (xz allows concatenated streams), without
+        decompressing or regrouping anything. It is written to a temporary
+        file renamed once complete (and only then registered in the catalog),
+        so an interrupted run never leaves a truncated dataset behind.
+        """
+        print('Assembling partitions…')
+        header = pd.DataFrame(columns=manifest['columns']).to_csv(index=False)
+        filepath = os.path.join(self.DATA_PATH, self.FILE_BASE_NAME)
+        tmp = filepath + '.tmp'
+        try:
+            with open(tmp, 'wb') as output:
+                output.write(lzma.compress(header.encode('utf-8')))
+                for year in sorted(manifest['years'], key=int):
+                    with open(self.partition_path(year), 'rb') as fh:
+                        for block in iter(lambda: fh.read(2 ** 20), b''):
+                            output.write(block)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        os.replace(tmp, filepath)
+
+        parquets = [columnar_path(self.partition_path(year))
+                    for year in sorted(manifest['years'], key=int)]
+        if parquets and all(os.path.isfile(path) for path in parquets):
+            with DatasetWriter(filepath, csv=False) as writer:  # registers it
+                for path in parquets:
+                    writer.write(pd.read_parquet(path))
+        else:
+            register(filepath)
+
+        print('Done.')
+
+    def row_size(self):
+        """
+        Estimates how many bytes a receipt takes in memory using a sample of
+        the first dataset.
+        """
+        sample = self.read_csv(self.DATASETS[0], nrows=1000)
+        return max(1, int(sample.memory_usage(deep=True).sum() / len(sample)))
+
+    @staticmethod
+    def append_csv(filepath, data):
+        """Appends a DataFrame to an uncompressed CSV (writing its header if
+        the file is new)."""
+        header = not os.path.isfile(filepath)
+        export(data).to_csv(filepath, mode='a', header=header, index=False)
+
+    def route(self, spill, rows):
+        """
+        Reads every dataset in chunks of `rows` and appends the valid receipts
+        of each year to its own CSV in `spill`. Returns a dict with the
+        number of receipts per applicant_id for each year.
+        """
+        headers = (self.read_csv(name, nrows=0) for name in self.DATASETS)
+        columns = list(dict.fromkeys(c for h in headers for c in h.columns))
+
+        counts = {}
+        for name in self.DATASETS:
+            for chunk in self.read_csv(name, chunksize=rows):
+                chunk = chunk.dropna(subset=('document_value',
+                                             'reimbursement_number',
+                                             'document_id',
+                                             'year',
+                                             'applicant_id'))
+                chunk = chunk.reindex(columns=columns)
+                for year, receipts in chunk.groupby('year', sort=False):
+                    year = int(year)
+                    path = os.path.join(spill, '{}.csv'.format(year))
+                    self.append_csv(path, receipts)
+                    count = receipts['applicant_id'].value_counts()
+                    counts[year] = count.add(counts.get(year, 0), fill_value=0)
+        return counts
+
+    def split(self, spill, year, counts, rows):
+        """
+        Generator with the receipts of a year routed to `spill` in slices of
+        at most about `rows` receipts. Slices are contiguous ranges of sorted
+        applicant_id, so groups never span two slices and the grouped slices
+        come out in the same order as grouping the whole year.
+        """
+        path = os.path.join(spill, '{}.csv'.format(year))
+        counts = counts.sort_index()
+        slices = (counts.cumsum() - counts) // rows
+        if slices.iloc[-1] == 0:
+            yield cast(pd.read_csv(path, dtype=DTYPE))
+            return
+
+        for chunk in pd.read_csv(path, dtype=DTYPE, chunksize=rows):
+            for index, receipts in chunk.groupby(
+                    chunk['applicant_id'].map(slices), sort=False):
+                filepath = os.path.join(spill, '{}-{}.csv'.format(year, index))
+                self.append_csv(filepath, receipts)
+        os.remove(path)
+
+        for index in sorted(slices.unique()):
+            filepath = os.path.join(spill, '{}-{}.csv'.format(year, index))
+            yield cast(pd.read_csv(filepath, dtype=DTYPE))
+            os.remove(filepath)
+
+    def stream(self, memory_budget):
+        """
+        Groups the receipts keeping at most about `memory_budget` bytes of
+        them in memory: datasets are read in chunks and routed to on-disk
+        partitions by year, which are then grouped one at a time (split in
+        ranges of applicant_id when a year does not fit in the budget).
+        """
+        rows = max(1, memory_budget // (self.row_size() * self.STREAM_COPIES))
+        spill = tempfile.mkdtemp(prefix='.reimbursements-', dir=self.DATA_PATH)
+        filepath = os.path.join(self.DATA_PATH, self.FILE_BASE_NAME)
+        try:
+            print('Routing receipts by year ({:,} rows per chunk)…'.format(rows))
+            counts = self.route(spill, rows)
+
+            with DatasetWriter(filepath) as writer:
+                for year in sorted(counts):
+                    for receipts in self.split(spill, year, counts[year], rows):
+                        writer.write(self.group(receipts))
+        finally:
+            shutil.rmtree(spill)
 
         print('Done.')
 
 
 if __name__ == '__main__':
+    parser = ArgumentParser(description='Groups CEAP receipts by document.')
+    parser.add_argument(
+        '--incremental', '-i', action='store_true',
+        help='Regroup only the years that changed since the last run'
+    )
+    parser.add_argument(
+        '--stream', '-s', action='store_true',
+        help='Read datasets in chunks and group one partition at a time'
+    )
+    parser.add_argument(
+        '--memory-budget', '-m', type=int, default=1024,
+        help='Memory budget in MB when streaming (default: 1024)'
+    )
+    args = parser.parse_args()
+
     reimbursements = Reimbursements()
-    df = reimbursements.group(reimbursements.receipts)
-    reimbursements.write_reimbursement_file(df)
+    if args.incremental:
+        reimbursements.incremental()
+    elif args.stream:
+        reimbursements.stream(args.memory_budget * 2 ** 20)
+    else:
+        df = reimbursements.group(reimbursements.receipts)
+        reimbursements.write_reimbursement_file(df)
@@ -0,0 +1,282 @@
+"""
+Persistent cache of HTTP responses shared by the scripts that fetch data
+from external (and rate-limited) APIs.
+
+Responses are stored in a single SQLite database (`data/.cache/http.db`)
+keyed by their normalized URL (lowercase scheme and host, sorted query
+string merged with `params`, no fragment and no credentials). Entries expire
+after a TTL and, once the database grows over its size limit, the least
+recently used entries are evicted. Re-runs (or runs resumed after a crash)
+then reuse the responses we already have instead of spending API quota on
+them again. Error answers are not cached (see `is_cacheable`), even when an
+API sends them with HTTP 200.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+import requests
+
+from rate_limit import is_throttled
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_PATH = os.path.join(BASE_DIR, 'data', '.cache', 'http.db')
+
+TTL = 30 * 24 * 60 * 60  # 30 days
+MAX_SIZE = 2 ** 30  # 1 GB
+CREDENTIALS = ('client_id', 'client_secret', 'key')
+THROTTLED_RETRIES = 5
+CACHEABLE_STATUSES = ('OK', 'ZERO_RESULTS')  # `status` of JSON answers
+
+
+def normalize(url, params=None):
+    """
+    Returns a canonical version of `url` with `params` merged into its query
+    string, so equivalent requests share a single cache entry.
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        items = params.items() if isinstance(params, dict) else params
+        query.extend((str(k), str(v)) for k, v in items if v is not None)
+    query = sorted((k, v) for k, v in query if k not in CREDENTIALS)
+    return urlunsplit((parts.scheme.lower(),
+                       parts.netloc.lower(),
+                       parts.path or '/',
+                       urlencode(query),
+                       ''))
+
+
+class CachedResponse:
+    """Minimal HTTP response (similar to `requests.Response`)."""
+
+    def __init__(self, url, status_code, content, cached=False,
+                 content_type=None):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+        self.cached = cached
+        self.content_type = content_type  # not kept in the cache
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            msg = 'HTTP {} for {}'.format(self.status_code, self.url)
+            raise requests.HTTPError(msg)
+
+
+def is_json(response):
+    if response.content_type and 'json' in response.content_type:
+        return True
+    return response.content.lstrip()[:1] in (b'{', b'[')
+
+
+def is_cacheable(response):
+    """
+    Default rule to decide whether a response is worth caching. Some APIs
+    (Google, ReceitaWS) answer errors, including reaching their quota, with
+    HTTP 200 as well, so only HTTP 200 responses that are not throttled
+    (see `rate_limit.is_throttled`) are cached and, among JSON ones, only
+    those that can be parsed and whose `status`, if any, is in
+    CACHEABLE_STATUSES.
+    """
+    if response.status_code != 200 or is_throttled(response):
+        return False
+    if not is_json(response):
+        return True
+
+    try:
+        data = response.json()
+    except ValueError:
+        return False
+    if isinstance(data, dict) and 'status' in data:
+        return data['status'] in CACHEABLE_STATUSES
+    return True
+
+
+class ResponseCache:
+
+    EVICT_EVERY = 256
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL, max_size=MAX_SIZE):
+        """
+        :param path: (str) path to the SQLite database
+        :param ttl: (int) seconds a response is kept (None for forever)
+        :param max_size: (int) max size of the cached responses in bytes
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        self.local = threading.local()
+        self.writes = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                status INTEGER,
+                content BLOB,
+                size INTEGER,
+                expires REAL,
+                accessed REAL
+            );
+            CREATE INDEX IF NOT EXISTS accessed ON responses (accessed);
+        """)
+
+    @property
+    def connection(self):
+        """SQLite connection of the current thread."""
+        if not hasattr(self.local, 'connection'):
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self.local.connection = connection
+        return self.local.connection
+
+    def get(self, url, params=None):
+        """Returns a CachedResponse or None (if missing or expired)."""
+        key = normalize(url, params)
+        with self.connection as db:
+            row = db.execute(
+                'SELECT status, content, expires FROM responses WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            status, content, expires = row
+            if expires is not None and expires < time.time():
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+
+            db.execute('UPDATE responses SET accessed = ? WHERE key = ?',
+                       (time.time(), key))
+        return CachedResponse(url, status, content, cached=True)
+
+    def set(self, url, params, response, ttl=None):
+        """Stores a response (anything with `status_code` and `content`)."""
+        ttl = ttl or self.ttl
+        now = time.time()
+        expires = now + ttl if ttl else None
+        content = response.content
+        with self.connection as db:
+            db.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (normalize(url, params), response.status_code, content,
+                 len(content), expires, now)
+            )
+
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries and then the least recently used ones."""
+        with self.connection as db:
+            db.execute('DELETE FROM responses WHERE expires < ?',
+                       (time.time(),))
+            size, = db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()
+            rows = db.execute(
+                'SELECT key, size FROM responses ORDER BY accessed')
+            keys = []
+            for key, entry_size in rows:
+                if size <= self.max_size:
+                    break
+                keys.append((key,))
+                size -= entry_size
+            db.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+
+class NoLimit:
+    """Stands for a RateLimiter when requests are not rate limited."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+NO_LIMIT = NoLimit()
+CACHES = {}
+
+
+def default_cache():
+    """Returns the ResponseCache shared by the scripts of this process."""
+    if CACHE_PATH not in CACHES:
+        CACHES[CACHE_PATH] = ResponseCache()
+    return CACHES[CACHE_PATH]
+
+
+def get(url, params=None, cache=None, cache_if=is_cacheable, limiter=None,
+        **kwargs):
+    """
+    GET request (through `requests`) served from the cache when possible.
+    Only requests actually sent count against the `limiter`.
+
+    :param url: (str) URL to request
+    :param params: (dict) query string parameters
+    :param cache: (ResponseCache) defaults to `default_cache()`
+    :param cache_if: (callable) receives the response and tells whether it
+        should be cached (default: `is_cacheable`)
+    :param limiter: (rate_limit.RateLimiter) limiter of the API; throttled
+        requests are retried up to THROTTLED_RETRIES times
+    :param kwargs: extra arguments to `requests.get` (e.g. headers, timeout)
+    :return: (CachedResponse)
+    """
+    cache = cache or default_cache()
+    cached = cache.get(url, params)
+    if cached is not None:
+        return cached
+
+    for attempt in range(THROTTLED_RETRIES + 1):
+        with limiter or NO_LIMIT:
+            raw = requests.get(url, params=params, **kwargs)
+        response = CachedResponse(url, raw.status_code, raw.content,
+                                  content_type=raw.headers.get('Content-Type'))
+        if limiter is None or limiter.done(response):
+            break
+
+    if cache_if(response):
+        cache.set(url, params, response)
+    return response
+
+
+async def async_get(url, params=None, cache=None, cache_if=is_cacheable,
+                    limiter=None, **kwargs):
+    """Same as `get`, but asynchronous (through `aiohttp`)."""
+    cache = cache or default_cache()
+    cached = cache.get(url, params)
+    if cached is not None:
+        return cached
+
+    for attempt in range(THROTTLED_RETRIES + 1):
+        async with limiter or NO_LIMIT:
+            async with aiohttp.request('GET', url, params=params,
+                                       **kwargs) as raw:
+                content = await raw.read()
+                response = CachedResponse(
+                    url, raw.status, content,
+                    content_type=raw.headers.get('Content-Type'))
+        if limiter is None or limiter.done(response):
+            break
+
+    if cache_if(response):
+        cache.set(url, params, response)
+    return response
@@ -0,0 +1,86 @@
+"""
+Money in the CEAP datasets is kept in memory as integer centavos (nullable
+int64), so sums and comparisons are exact, and written to `data/` in R$ as
+it has always been (see `schema.cast` and `dataset_store.DatasetWriter`).
+
+Each receipt should reconcile: its `document_value` minus its
+`remark_value` (the amount the Lower House refused to pay) is its
+`net_value`. Run this script with the path of datasets to count the
+receipts that do not.
+"""
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+
+CENTAVOS = 'Int64'
+NET_VALUES = ('net_value', 'net_values')  # the latter in reimbursements
+
+
+def to_centavos(values):
+    """
+    :param values: (pandas.Series) values in R$ (numbers or strings)
+    :return: (pandas.Series) values in centavos (NA when missing)
+    """
+    values = pd.to_numeric(values, errors='coerce')
+    return (values * 100).round().astype(CENTAVOS)
+
+
+def to_reais(values):
+    """
+    :param values: (pandas.Series) values in centavos
+    :return: (pandas.Series) `float64` values in R$ (NaN when missing)
+    """
+    return values.astype(np.float64) / 100
+
+
+def net_value_column(data):
+    for column in NET_VALUES:
+        if column in data.columns:
+            return column
+    raise KeyError('There is no net value column in the dataset.')
+
+
+def differences(data):
+    """
+    :param data: (pandas.DataFrame) receipts with money in centavos
+    :return: (pandas.Series) `document_value - remark_value - net_value` of
+        each receipt, in centavos (a missing `remark_value` counts as zero;
+        NA when another value is missing)
+    """
+    remark = data['remark_value'].fillna(0)
+    return data['document_value'] - remark - data[net_value_column(data)]
+
+
+def unreconciled(data, tolerance=0):
+    """
+    :param data: (pandas.DataFrame) receipts with money in centavos
+    :param tolerance: (int) accepted difference in centavos
+    :return: (numpy.ndarray) mask of the receipts whose values do not
+        reconcile (receipts with missing values are not flagged)
+    """
+    values = differences(data).abs()
+    return (values > tolerance).fillna(False).to_numpy(dtype=bool)
+
+
+if __name__ == '__main__':
+    from dataset_store import read_dataset  # it imports this module
+
+    description = 'Counts receipts whose net value does not reconcile.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('datasets', nargs='+', help='Path to .xz datasets')
+    parser.add_argument(
+        '--tolerance', '-t', type=int, default=0,
+        help='Accepted difference in centavos (default: 0)'
+    )
+    args = parser.parse_args()
+
+    for dataset in args.datasets:
+        data = read_dataset(dataset)
+        flagged = data[unreconciled(data, args.tolerance)]
+        msg = '{}: {:,} of {:,} receipts do not reconcile'
+        print(msg.format(dataset, len(flagged), len(data)))
+        if len(flagged):
+            counts = flagged['subquota_description'].value_counts()
+            print(counts[counts > 0].to_string())
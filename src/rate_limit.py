@@ -0,0 +1,201 @@
+"""
+Rate limiting shared by the scripts that fetch data from external APIs.
+
+Each API gets a RateLimiter combining:
+
+    * a token bucket, so requests never go over the API rate (requests per
+      second), and
+    * an AIMD (additive increase, multiplicative decrease) concurrency and
+      rate: each successful request nudges both up towards their maximum,
+      each throttled request (HTTP 429, `OVER_QUERY_LIMIT` etc.) halves them.
+
+It works both with threads (`with limiter:`) and with asyncio
+(`async with limiter:`), and keeps track of the achieved request rate.
+Coroutines waiting for the limiter are queued and served in order.
+"""
+import asyncio
+import threading
+from collections import deque
+import time
+
+
+THROTTLED_STATUS = (b'OVER_QUERY_LIMIT',)
+
+
+def is_throttled(response):
+    """
+    Tells whether a response (anything with `status_code` and `content`)
+    means we went over the API quota.
+    """
+    if response.status_code == 429:
+        return True
+    return any(status in response.content for status in THROTTLED_STATUS)
+
+
+class RateLimiter:
+
+    def __init__(self, name, rate, concurrency=None, burst=None,
+                 increase=1, decrease=0.5, throttled_if=is_throttled):
+        """
+        :param name: (str) name of the API (used in reports)
+        :param rate: (float) max requests per second
+        :param concurrency: (int) max simultaneous requests (default: the
+            rate, rounded up)
+        :param burst: (float) size of the token bucket (default: the rate, or
+            a single request for rates under 1 request per second)
+        :param increase: (float) how much the concurrency grows after as
+            many successful requests as the current concurrency
+        :param decrease: (float) factor applied to the concurrency and to the
+            rate when a request is throttled
+        :param throttled_if: (callable) tells if a response was throttled
+        """
+        self.name = name
+        self.max_rate = rate
+        self.max_concurrency = concurrency or max(1, int(rate + 0.999))
+        self.burst = burst or max(1, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.throttled_if = throttled_if
+
+        self.rate = self.max_rate
+        self.concurrency = self.max_concurrency
+        self.tokens = self.burst
+        self.in_flight = 0
+        self.last_refill = time.monotonic()
+        self.last_decrease = 0
+        self.start = time.monotonic()
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.waiters = deque()  # futures of the coroutines waiting in line
+        self.wakeup = None  # future the first coroutine in line sleeps on
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self):
+        """
+        Takes a token and a concurrency slot if both are available. Returns
+        0 on success or else how many seconds to wait before trying again.
+        """
+        with self.lock:
+            self.refill()
+            if self.in_flight >= int(self.concurrency):
+                return 0.01
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0
+
+    def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            with self.condition:
+                self.condition.wait(wait)
+
+    async def acquire_async(self):
+        """
+        Waits in line for a token and a concurrency slot: only the first
+        coroutine in line checks the limiter (waking up when a token is due or
+        when a request finishes), the others sleep until it is their turn.
+        """
+        loop = asyncio.get_event_loop()
+        turn = loop.create_future()
+        self.waiters.append(turn)
+        if self.waiters[0] is turn:
+            turn.set_result(None)
+
+        try:
+            await turn
+            while True:
+                wait = self.try_acquire()
+                if not wait:
+                    return
+                self.wakeup = loop.create_future()
+                try:
+                    await asyncio.wait_for(self.wakeup, wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            first = self.waiters[0] is turn
+            self.waiters.remove(turn)
+            if first:
+                self.wakeup = None
+                if self.waiters and not self.waiters[0].done():
+                    self.waiters[0].set_result(None)
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    def success(self):
+        """Additive increase after a successful request."""
+        with self.lock:
+            self.requests += 1
+            self.concurrency = min(
+                self.max_concurrency,
+                self.concurrency + self.increase / self.concurrency
+            )
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 100)
+
+    def throttle(self):
+        """
+        Multiplicative decrease after a throttled request (once per the time
+        a request takes at the current rate, so a burst of rejected requests
+        sent together counts as a single event).
+        """
+        with self.lock:
+            self.requests += 1
+            self.throttled += 1
+            now = time.monotonic()
+            if now - self.last_decrease < 1 / self.rate:
+                return
+
+            self.last_decrease = now
+            self.concurrency = max(1, self.concurrency * self.decrease)
+            self.rate = max(self.max_rate / 100, self.rate * self.decrease)
+            self.tokens = 0
+
+    def done(self, response):
+        """Calls `success` or `throttle` according to the response."""
+        if self.throttled_if(response):
+            self.throttle()
+            return False
+        self.success()
+        return True
+
+    @property
+    def achieved_rate(self):
+        """Requests per second achieved so far."""
+        return self.requests / max(time.monotonic() - self.start, 1e-6)
+
+    def report(self):
+        msg = ('{}: {:,} requests at {:.2f} req/s ({:,} throttled, current '
+               'limits: {:.2f} req/s, {:.1f} simultaneous requests)')
+        return msg.format(self.name, self.requests, self.achieved_rate,
+                          self.throttled, self.rate, self.concurrency)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, *args):
+        self.release()
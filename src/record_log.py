@@ -0,0 +1,121 @@
+"""
+Append-only log of JSON records (one per line) used by scripts that fetch
+data record by record (e.g. `fetch_cnpj_info.py`).
+
+Each fetched record is appended and flushed right away, and the file is
+fsync'ed every few records (or seconds), so a crash loses at most the last
+batch. A partially written last line (from a crash in the middle of a
+write) is discarded when the log is opened again. Once fetching is done the
+whole log is loaded into a DataFrame in a single pass.
+"""
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+
+class RecordLog:
+
+    def __init__(self, path, sync_every=64, sync_interval=1):
+        """
+        :param path: (str) path to the `.jsonl` log
+        :param sync_every: (int) fsync after this many appended records
+        :param sync_interval: (float) fsync if the last one is older than
+            this (in seconds)
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+        self.output = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def repair(self):
+        """Drops a partially written last line left by a crash."""
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, 'rb+') as fh:
+            fh.seek(0, os.SEEK_END)
+            size = fh.tell()
+            if size == 0:
+                return
+
+            fh.seek(size - 1)
+            if fh.read(1) == b'\n':
+                return
+
+            position = size
+            while position > 0:
+                step = min(position, 2 ** 16)
+                position -= step
+                fh.seek(position)
+                block = fh.read(step)
+                newline = block.rfind(b'\n')
+                if newline != -1:
+                    fh.truncate(position + newline + 1)
+                    return
+            fh.truncate(0)
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.repair()
+        self.output = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        """Appends a record (a JSON serializable dict) to the log."""
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.output.write(line)
+            self.output.flush()
+            self.pending += 1
+            elapsed = time.monotonic() - self.last_sync
+            if self.pending >= self.sync_every or \
+                    elapsed >= self.sync_interval:
+                self.sync()
+
+    def sync(self):
+        os.fsync(self.output.fileno())
+        self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.output is None:
+            return
+        with self.lock:
+            self.sync()
+            self.output.close()
+            self.output = None
+
+    def records(self):
+        """Generator with the records in the log (skipping corrupt lines)."""
+        if not os.path.isfile(self.path):
+            return
+
+        with open(self.path, encoding='utf-8') as fh:
+            for line in fh:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def to_dataframe(self, columns=None):
+        """Loads every record in the log into a DataFrame."""
+        return pd.DataFrame(list(self.records()), columns=columns)
+
+    def remove(self):
+        self.close()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
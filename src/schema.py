@@ -0,0 +1,152 @@
+"""
+Schema of the CEAP datasets (the receipts of each period and the grouped
+reimbursements): the compact type of each column, shared by every script
+loading them (through `dataset_store.read_dataset` and `iter_dataset`):
+
+    * INTEGERS: IDs and numbers as nullable integers of the smallest size
+      that holds them (instead of Python strings)
+    * CATEGORIES: labels repeated over many rows as categoricals
+    * STRINGS: free text and identifiers with leading zeros (e.g. CNPJ/CPF)
+    * MONEY: integer centavos in memory and R$ in `data/` (see `money.py`)
+    * DATES: parsed once, when loading
+
+`DTYPE` is the mapping to use with `pd.read_csv` (`STRING_DTYPE` when only
+text should be kept as text; STRINGS also lists the text columns of datasets
+read along with the CEAP ones); `cast` applies the schema to data loaded by
+other means (e.g. Parquet copies written before a column changed its type)
+and `export` turns it back into what is written.
+"""
+import pandas as pd
+
+from money import to_centavos, to_reais
+
+
+INTEGERS = {
+    'applicant_id': 'Int32',
+    'batch_number': 'Int64',
+    'congressperson_document': 'Int32',
+    'congressperson_id': 'Int32',
+    'document_id': 'Int64',
+    'document_type': 'Int8',
+    'installment': 'Int16',
+    'month': 'Int8',
+    'reimbursement_number': 'Int32',
+    'subquota_group_id': 'Int16',
+    'subquota_number': 'Int16',
+    'term': 'Int16',
+    'term_id': 'Int16',
+    'year': 'Int16',
+}
+
+CATEGORIES = (
+    'congressperson_name',
+    'party',
+    'state',
+    'subquota_description',
+    'subquota_group_description',
+)
+
+STRINGS = (
+    'cnpj',
+    'cnpj_cpf',
+    'document_number',
+    'leg_of_the_trip',
+    'passenger',
+    'reimbursement_numbers',
+    'supplier',
+    # other datasets read along with the CEAP ones
+    'amendment_beneficiary',  # amendments
+    'name',  # companies
+    'trade_name',  # companies
+    'atividade_principal',  # CNPJ info, as fetched from ReceitaWS
+    'atividades_secundarias',
+    'complemento',
+    'efr',
+    'email',
+    'message',
+    'motivo_situacao',
+    'situacao_especial',
+)
+
+MONEY = (
+    'document_value',
+    'net_value',
+    'net_values',
+    'reimbursement_value',
+    'reimbursement_value_total',
+    'reimbursement_values',
+    'remark_value',
+    'total_net_value',
+)
+
+DATES = (
+    'issue_date',
+)
+
+DTYPE = dict(INTEGERS)
+DTYPE.update({column: 'float64' for column in MONEY})  # R$
+DTYPE.update({column: 'category' for column in CATEGORIES})
+DTYPE.update({column: str for column in STRINGS})
+
+# only the string columns, for scripts handling the other columns themselves
+STRING_DTYPE = {column: str for column in STRINGS}
+
+
+def cast(data):
+    """
+    Casts the columns of `data` in the schema (if present) to their types,
+    leaving the ones already cast untouched.
+    """
+    for column, kind in INTEGERS.items():
+        if column in data.columns and data[column].dtype != kind:
+            values = pd.to_numeric(data[column], errors='coerce')
+            data[column] = values.astype(kind)
+
+    for column in MONEY:
+        if column in data.columns and \
+                not pd.api.types.is_integer_dtype(data[column]):
+            data[column] = to_centavos(data[column])
+
+    for column in CATEGORIES:
+        if column in data.columns and \
+                not isinstance(data[column].dtype, pd.CategoricalDtype):
+            data[column] = data[column].astype('category')
+
+    for column in DATES:
+        if column in data.columns and \
+                not pd.api.types.is_datetime64_any_dtype(data[column]):
+            data[column] = pd.to_datetime(data[column], errors='coerce')
+
+    return data
+
+
+def export(data):
+    """
+    Returns `data` as it is written to `data/`, with money (in centavos) back
+    in R$.
+    """
+    money = [column for column in MONEY if column in data.columns and
+             pd.api.types.is_integer_dtype(data[column])]
+    if not money:
+        return data
+    return data.assign(**{column: to_reais(data[column]) for column in money})
+
+
+def concat(frames):
+    """
+    Concatenates DataFrames keeping categoricals as categoricals (chunks
+    read separately have different categories, and `pd.concat` would turn
+    such columns into strings).
+    """
+    frames = [frame.copy(deep=False) for frame in frames]
+    for column in CATEGORIES:
+        parts = [frame[column] for frame in frames if column in frame.columns]
+        if not parts or not all(isinstance(part.dtype, pd.CategoricalDtype)
+                                for part in parts):
+            continue
+        categories = pd.api.types.union_categoricals(
+            [part.values for part in parts], sort_categories=True).categories
+        for frame in frames:
+            if column in frame.columns:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames)
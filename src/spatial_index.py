@@ -0,0 +1,148 @@
+"""
+Spatial index of the geocoded companies (`data/companies.xz`) answering
+"which companies are near this point" questions in bulk: the k nearest
+companies to each point and the companies within a radius of each point.
+
+It is a BallTree (scikit-learn) over latitude and longitude with the
+haversine metric, persisted in `data/companies-spatial-index.pkl` and
+rebuilt whenever the companies dataset is newer than it. Distances are in
+meters and companies are identified by their row in `data/companies.xz`.
+"""
+import os
+import pickle
+from argparse import ArgumentParser
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from dataset_store import read_dataset
+from distances import EARTH_RADIUS
+
+
+DATASET_PATH = os.path.join('data', 'companies.xz')
+INDEX_PATH = os.path.join('data', 'companies-spatial-index.pkl')
+
+
+def to_radians(latitude, longitude):
+    """(n, 2) array of latitudes and longitudes in radians."""
+    points = np.column_stack((np.atleast_1d(latitude),
+                              np.atleast_1d(longitude)))
+    return np.radians(points.astype(np.float64))
+
+
+class SpatialIndex:
+
+    def __init__(self, latitude, longitude, rows=None, leaf_size=40):
+        """
+        :param latitude: (iterable) latitude of each company
+        :param longitude: (iterable) longitude of each company
+        :param rows: (iterable) row of each company in the dataset, in
+            ascending order (default: 0 to n - 1); companies without
+            coordinates are left out
+        :param leaf_size: (int) BallTree leaf size
+        """
+        points = to_radians(latitude, longitude)
+        rows = np.arange(len(points)) if rows is None else np.asarray(rows)
+        located = ~np.isnan(points).any(axis=1)
+        self.rows = rows[located]
+        self.tree = BallTree(points[located], leaf_size=leaf_size,
+                             metric='haversine')
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_companies(cls, companies):
+        return cls(companies['latitude'].values, companies['longitude'].values)
+
+    def nearest(self, latitude, longitude, k=1):
+        """
+        :param latitude: (iterable) latitude of each point
+        :param longitude: (iterable) longitude of each point
+        :param k: (int) number of companies per point
+        :return: (tuple) two (n, k) arrays with the distances (in meters) and
+            the rows of the k nearest companies to each point, closest first
+        """
+        distances, positions = self.tree.query(
+            to_radians(latitude, longitude), k=min(k, len(self)))
+        return distances * EARTH_RADIUS, self.rows[positions]
+
+    def within(self, latitude, longitude, radius):
+        """
+        :param latitude: (iterable) latitude of each point
+        :param longitude: (iterable) longitude of each point
+        :param radius: (float or iterable) radius in meters (one for all
+            points or one per point)
+        :return: (tuple) two lists with an array per point: the distances (in
+            meters) and the rows of the companies within the radius, closest
+            first
+        """
+        positions, distances = self.tree.query_radius(
+            to_radians(latitude, longitude),
+            np.asarray(radius, dtype=np.float64) / EARTH_RADIUS,
+            return_distance=True,
+            sort_results=True)
+        return ([d * EARTH_RADIUS for d in distances],
+                [self.rows[p] for p in positions])
+
+    def neighbors(self, rows, k=1):
+        """
+        Same as `nearest` but for companies of the index itself (given by
+        their rows), leaving each company out of its own neighbors. Raises
+        KeyError for rows that are not in the index.
+        """
+        rows = np.atleast_1d(rows)
+        positions = np.searchsorted(self.rows, rows)
+        positions = np.minimum(positions, len(self.rows) - 1)
+        missing = self.rows[positions] != rows
+        if missing.any():
+            msg = 'Rows not in the index: {}'
+            raise KeyError(msg.format(', '.join(map(str, rows[missing]))))
+        points = np.asarray(self.tree.data)[positions]
+        distances, found = self.tree.query(points, k=min(k + 1, len(self)))
+        found = self.rows[found]
+
+        # companies at the very same spot may come before the company itself
+        is_self = found == rows[:, np.newaxis]
+        is_self[~is_self.any(axis=1), -1] = True
+        shape = len(rows), found.shape[1] - 1
+        return (distances[~is_self].reshape(shape) * EARTH_RADIUS,
+                found[~is_self].reshape(shape))
+
+    def save(self, path=INDEX_PATH):
+        with open(path, 'wb') as fh:
+            pickle.dump(self, fh, pickle.HIGHEST_PROTOCOL)
+
+
+def build_index(dataset_path=DATASET_PATH, path=INDEX_PATH):
+    companies = read_dataset(dataset_path, columns=('latitude', 'longitude'))
+    index = SpatialIndex.from_companies(companies)
+    index.save(path)
+    return index
+
+
+def load_index(dataset_path=DATASET_PATH, path=INDEX_PATH):
+    """Loads the index, rebuilding it if it is missing or outdated."""
+    if os.path.isfile(path) and \
+            os.path.getmtime(path) >= os.path.getmtime(dataset_path):
+        with open(path, 'rb') as fh:
+            return pickle.load(fh)
+    return build_index(dataset_path, path)
+
+
+if __name__ == '__main__':
+    description = 'Lists the companies closest to a point.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument('latitude', type=float)
+    parser.add_argument('longitude', type=float)
+    parser.add_argument('--neighbors', '-k', type=int, default=10,
+                        help='Number of companies to list (default: 10)')
+    args = parser.parse_args()
+
+    index = load_index()
+    distances, rows = index.nearest(args.latitude, args.longitude,
+                                    args.neighbors)
+    columns = ('cnpj', 'name', 'trade_name', 'address', 'city', 'state')
+    companies = read_dataset(DATASET_PATH, columns=columns).iloc[rows[0]]
+    companies.insert(0, 'distance', distances[0].round(1))
+    print(companies.to_string(index=False))
@@ -0,0 +1,197 @@
+"""
+Daily travel features of congresspeople, built from their meal
+reimbursements and the location of the companies where they had them.
+
+For each congressperson and day with meals it writes
+`data/YYYY-MM-DD-travel-features.xz` with:
+
+    * `expenses`: number of meals
+    * `sum` and `mean`: total and mean net value of the meals
+    * `cities`: number of distinct cities of the companies
+    * `city_list`: these cities, comma separated
+    * `distance_traveled`: sum of the distances (in km) between every pair
+      of companies of the day
+    * `fingerprint`: hash of the rows used to calculate the features
+
+Days are split among processes by congressperson. When the newest travel
+features dataset exists, only days whose input rows changed (according to
+their fingerprint) are calculated again.
+"""
+import datetime
+import os
+from argparse import ArgumentParser
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+import pandas as pd
+
+import cnpj_cpf
+import distances
+from catalog import newest_file
+from dataset_store import read_dataset, write_dataset
+from money import to_reais
+from schema import cast
+
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(BASE_DIR, 'data')
+DATE = datetime.date.today().strftime('%Y-%m-%d')
+FILE_BASE_NAME = '{}-travel-features.xz'.format(DATE)
+COMPANIES_PATH = os.path.join(DATA_PATH, 'companies.xz')
+
+MEAL = 'Congressperson meal'
+KEYS = ['congressperson_id', 'issue_date']
+HASHED = ['document_id', 'total_net_value', 'city', 'latitude', 'longitude']
+BRAZIL = {'latitude': (-33.742222, 5.2722222),
+          'longitude': (-73.992222, -34.7916667)}
+
+
+def load_meals(reimbursements_path, companies_path=COMPANIES_PATH):
+    """
+    Meal reimbursements of congresspeople (i.e. no party leaderships) with
+    the city and the location of the company, when it is in Brazil.
+    """
+    columns = ('congressperson_id', 'congressperson_name', 'issue_date',
+               'document_id', 'cnpj_cpf', 'total_net_value')
+    meals = read_dataset(reimbursements_path, columns=columns,
+                         filters=[('subquota_description', '==', MEAL)])
+    meals = meals[meals['congressperson_id'].notnull()].copy()
+    meals['issue_date'] = pd.to_datetime(meals['issue_date'],
+                                         errors='coerce').dt.normalize()
+    meals = meals[meals['issue_date'].notnull()]
+    meals['key'] = cnpj_cpf.keys(meals['cnpj_cpf'])
+
+    companies = read_dataset(companies_path,
+                             columns=('cnpj', 'city', 'latitude', 'longitude'))
+    companies['key'] = cnpj_cpf.keys(companies['cnpj'])
+    companies = companies.drop_duplicates('key').drop('cnpj', axis=1)
+
+    meals = meals.merge(companies, on='key').drop('key', axis=1)
+    in_brazil = np.ones(len(meals), dtype=bool)
+    for column, (lower, upper) in BRAZIL.items():
+        values = meals[column].astype(np.float64)
+        in_brazil &= ((lower < values) & (values < upper)).values
+    return meals[in_brazil]
+
+
+def fingerprints(meals):
+    """
+    :return: (pandas.DataFrame) KEYS and a `fingerprint` per day, which
+        changes whenever any of its rows is added, removed or changed
+    """
+    hashes = pd.util.hash_pandas_object(meals[HASHED], index=False)
+    hashed = meals[KEYS].assign(fingerprint=hashes.values.view(np.int64))
+    return hashed.groupby(KEYS, sort=False)['fingerprint'].sum().reset_index()
+
+
+def daily_features(meals):
+    """
+    :param meals: (pandas.DataFrame) see `load_meals`
+    :return: (pandas.DataFrame) travel features per congressperson and day
+    """
+    meals = meals.sort_values(KEYS, kind='mergesort')
+    offsets = distances.segment_offsets(meals['congressperson_id'].values,
+                                        meals['issue_date'].values)
+    first = offsets[:-1]
+    expenses = np.diff(offsets)
+    groups = distances.segment_ids(offsets)
+
+    values = to_reais(meals['total_net_value']).to_numpy(dtype=np.float64)
+    total = np.add.reduceat(values, first) if len(meals) else values
+
+    city_codes, city_names = pd.factorize(meals['city'], sort=True)
+    pairs = np.unique(np.column_stack((groups, city_codes)), axis=0)
+    pairs = pairs[pairs[:, 1] >= 0]
+    cities = pd.Series(city_names.values[pairs[:, 1]]).astype(str)
+    city_list = cities.groupby(pairs[:, 0]).agg(','.join)
+
+    traveled = distances.all_pairs_sum(meals['latitude'].values,
+                                       meals['longitude'].values,
+                                       offsets) / 1000
+
+    features = meals.iloc[first][KEYS + ['congressperson_name']]
+    return features.assign(
+        expenses=expenses,
+        sum=total,
+        mean=total / expenses,
+        cities=np.bincount(pairs[:, 0], minlength=len(first)),
+        city_list=city_list.reindex(np.arange(len(first))).values,
+        distance_traveled=traveled
+    ).reset_index(drop=True)
+
+
+def calculate(meals, processes):
+    """Calculates `daily_features` in parallel, by congressperson."""
+    if meals.empty or processes < 2:
+        return daily_features(meals)
+
+    codes, _ = pd.factorize(meals['congressperson_id'])
+    parts = [part for _, part in meals.groupby(codes % (processes * 4))]
+    with Pool(processes) as pool:
+        results = pool.map(daily_features, parts)
+    return pd.concat(results, ignore_index=True)
+
+
+def update(meals, previous=None, processes=1):
+    """
+    :param meals: (pandas.DataFrame) see `load_meals`
+    :param previous: (pandas.DataFrame) travel features calculated before
+    :param processes: (int) number of processes
+    :return: (pandas.DataFrame) travel features of every day in `meals`,
+        reusing the ones from `previous` whose fingerprint has not changed
+    """
+    meals = cast(meals.copy())
+    current = fingerprints(meals)
+    kept = previous.iloc[:0] if previous is not None else None
+    pending = current
+
+    if previous is not None:
+        previous = cast(previous.copy())
+        kept = previous.merge(current, on=KEYS + ['fingerprint'])
+        seen = kept[KEYS].assign(seen=True)
+        pending = current.merge(seen, on=KEYS, how='left')
+        pending = pending[pending['seen'].isnull()].drop('seen', axis=1)
+
+    msg = '{:,} days with meals, {:,} to calculate'
+    print(msg.format(len(current), len(pending)))
+    selected = meals.merge(pending[KEYS], on=KEYS)
+    calculated = calculate(selected, processes).merge(current, on=KEYS)
+
+    features = pd.concat([kept, calculated], ignore_index=True) \
+        if kept is not None else calculated
+    return features.sort_values(KEYS).reset_index(drop=True)
+
+
+def main(processes=None, force=False):
+    reimbursements_path = newest_file('reimbursements', DATA_PATH)
+    if reimbursements_path is None:
+        raise TypeError('Could not find the dataset for reimbursements.')
+
+    print('Loading {}…'.format(reimbursements_path))
+    meals = load_meals(reimbursements_path)
+
+    previous = None
+    previous_path = newest_file('travel-features', DATA_PATH)
+    if previous_path and not force:
+        print('Loading {}…'.format(previous_path))
+        previous = read_dataset(previous_path)
+
+    features = update(meals, previous, processes or cpu_count())
+    path = os.path.join(DATA_PATH, FILE_BASE_NAME)
+    print('Writing {}…'.format(path))
+    write_dataset(features, path)
+
+
+if __name__ == '__main__':
+    description = 'Calculates daily travel features of congresspeople.'
+    parser = ArgumentParser(description=description)
+    parser.add_argument(
+        '--processes', '-p', type=int, default=None,
+        help='Number of processes (default: number of CPUs)'
+    )
+    parser.add_argument(
+        '--force', '-f', action='store_true',
+        help='Calculate every day again, ignoring previous features'
+    )
+    args = parser.parse_args()
+    main(args.processes, args.force)
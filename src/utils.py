@@ -1,111 +1,206 @@
-import numpy as np
 import pandas as pd
 from os import listdir
 from os.path import join
 
+from dataset_store import iter_dataset
+from schema import concat
 
-def concatenate_data_dataframes(path):
+
+CHUNK_SIZE = 2 ** 17
+
+
+def data_files(path):
+    '''
+    Return the names of the ".xz" data available on path, disregarding
+    "companies" files.
+
+    :params path: (str) path were .xz files are located
+    '''
+    return sorted(f for f in listdir(path)
+                  if f[-2::] == 'xz' and f[11:-3] != 'companies')
+
+
+def iter_data_dataframes(path, columns=None, filters=None,
+                         chunksize=CHUNK_SIZE):
+    '''
+    Yield typed dataframes (see "schema.py") with up to "chunksize" rows of
+    each ".xz" data available on path, disregarding "companies" files, so
+    callers can aggregate across all of them in constant memory (e.g. with
+    "find_sum_of_values").
+
+    :params path: (str) path were .xz files are located
+    :params columns: (list) load only these columns (default: all)
+    :params filters: (list) "(column, operator, value)" tuples combined
+                     with AND (see "dataset_store.read_dataset")
+    :params chunksize: (int) max number of rows per dataframe
+    '''
+    for file in data_files(path):
+        yield from iter_dataset(join(path, file), chunksize, columns, filters)
+
+
+def concatenate_data_dataframes(path, columns=None, filters=None):
     '''
     Return a concatenated dataframe with all ".xz" data available on
     path, disgegarding "companies" files.
 
     :params path: (str) path were .xz files are located
+    :params columns: (list) load only these columns (default: all)
+    :params filters: (list) "(column, operator, value)" tuples combined
+                     with AND (see "dataset_store.read_dataset")
     '''
-    files = [f for f in listdir(path) if f[-2::]=='xz']
-    frames = []
-    for file in files:
-        if file[11:-3] != 'companies':
-            frames.append(pd.read_csv(join(path, file) ,
-                          parse_dates=[16],
-                          dtype={'document_id': np.str,
-                                 'congressperson_id': np.str,
-                                 'congressperson_document': np.str,
-                                 'term_id': np.str,
-                                 'cnpj_cpf': np.str,
-                                 'reimbursement_number': np.str}))
-    return pd.concat(frames)
+    return concat(iter_data_dataframes(path, columns, filters))
 
 
+STATISTICS = ('occurences', 'max', 'mean', 'min', 'total')
+AGGREGATIONS = {'occurences': 'count', 'total': 'sum', 'max': 'max',
+                'min': 'min'}
+COMBINATIONS = {'occurences': 'sum', 'total': 'sum', 'max': 'max',
+                'min': 'min'}
 
-def find_sum_of_values(df, aggregator, value):
+
+def as_list(columns):
+    return [columns] if isinstance(columns, str) else list(columns)
+
+
+def chunks_of(df):
+    '''
+    Return an iterable of dataframes: "df" itself if it is a dataframe or
+    its chunks otherwise (e.g. from "dataset_store.iter_dataset").
+    '''
+    return (df,) if isinstance(df, pd.DataFrame) else df
+
+
+def aggregate(df, keys, values):
+    '''
+    Return the number of non null values, their sum, max and min for each
+    unique combination of "keys", in order of appearance. Rows with any
+    null key are counted as groups without values (as a scan comparing
+    the key to each unique value would not find them).
+
+    :params df: pandas dataframe or iterable of dataframes (chunks)
+    :params keys: list of dataframe columns to group by
+    :params values: list of dataframe columns to aggregate
+    :return: dataframe indexed by "keys" with a column per value and
+             statistic (occurences, total, max and min)
+    '''
+    partials = []
+    for chunk in chunks_of(df):
+        data = chunk[values].where(chunk[keys].notnull().all(axis=1))
+        for key in keys:
+            data[key] = chunk[key]
+        grouped = data.groupby(keys, sort=False, dropna=False, observed=True)
+        partial = grouped[values].agg(list(AGGREGATIONS.values()))
+        partial = partial.rename(
+            columns={v: k for k, v in AGGREGATIONS.items()}, level=1)
+        partials.append(partial)
+
+    if len(partials) == 1:
+        return partials[0]
+
+    combined = pd.concat(partials)
+    grouped = combined.groupby(level=keys, sort=False, dropna=False)
+    return grouped.agg({column: COMBINATIONS[column[1]]
+                        for column in combined.columns})
+
+
+def statistic(aggregated, value, name):
+    '''
+    Return the statistic "name" (one of STATISTICS) of the "value" column
+    from an "aggregate" result; the mean of groups without values is 0.
+    '''
+    if name != 'mean':
+        series = aggregated[(value, name)]
+        return series.astype(float) if name in ('occurences', 'total') \
+            else series
+
+    total = aggregated[(value, 'total')].astype(float)
+    occurences = aggregated[(value, 'occurences')]
+    return (total / occurences.where(occurences > 0)).fillna(0)
+
+
+def find_sum_of_values(df, aggregator, value, statistics=STATISTICS):
     '''
     Return a dataframe with the statistics of values from "value" property
     aggregated by unique values from the column "aggregator"
 
-    :params df: pandas dataframe to be sliced
+    :params df: pandas dataframe to be sliced (or an iterable of pandas
+                dataframes, e.g. chunks of a dataset larger than memory)
     :params aggregator: dataframe column that will be
                         filtered by unique values
-    :params value: dataframe column containing values to be summed
+    :params value: dataframe column (or list of columns) containing values
+                   to be summed
+    :params statistics: which statistics to calculate (default: all of
+                        STATISTICS)
     :return: dataframe containing (for each aggregator unit):
         * property sum
         * property mean value
         * property max value
         * property mean value
         * number of occurences in total
+        (with more than one value column, the occurences of each one are
+        labeled as the other statistics, e.g. "total_net_value_occurences")
     '''
-
-    total_label = '{}_total'.format(value)
-    max_label = '{}_max'.format(value)
-    mean_label = '{}_mean'.format(value)
-    min_label = '{}_min'.format(value)
-
-    result = {
-        'occurences': [],
-        aggregator: df[aggregator].unique(),
-        max_label: [],
-        mean_label: [],
-        min_label: [],
-        total_label: [],
-    }
-
-    for item in result[aggregator]:
-        if isinstance(df[aggregator].iloc[0], str):
-            item = str(item)
-        data = df[df[aggregator] == item]
-        property_total = float(data[value].sum())
-        occurences = float(data[value].count())
-
-        result[total_label].append(property_total)
-        result['occurences'].append(occurences)
-        if occurences > 0:
-            result[mean_label].append(property_total/occurences)
-        else:
-            result[mean_label].append(0)
-        result[max_label].append(np.max(data[value]))
-        result[min_label].append(np.min(data[value]))
-
-    return pd.DataFrame(result).sort_values(by=aggregator)
-
-
-def find_sum_of_values_per_period(df, aggregator, period_aggregator, value):
+    values = as_list(value)
+    aggregated = aggregate(df, [aggregator], values)
+
+    result = pd.DataFrame(index=aggregated.index)
+    for column in values:
+        for name in STATISTICS:
+            if name not in statistics:
+                continue
+            label = '{}_{}'.format(column, name)
+            if name == 'occurences' and len(values) == 1:
+                label = name
+            result[label] = statistic(aggregated, column, name)
+
+    result = result.reset_index()
+    columns = list(result.columns)
+    if 'occurences' in columns:  # same order as before it was a groupby
+        columns.remove('occurences')
+        columns.insert(0, 'occurences')
+        result = result[columns]
+    return result.sort_values(by=aggregator)
+
+
+def find_sum_of_values_per_period(df, aggregator, period_aggregator, value,
+                                  statistic_name='total'):
     '''
     Return a dataframe with a matrix containing unique values of
     dataframe column "aggregator" and dataframe column "period_aggregator".
     The values added are the sum of the "value" column.
 
-    :params df: pandas dataframe to be sliced
+    :params df: pandas dataframe to be sliced (or an iterable of pandas
+                dataframes, e.g. chunks of a dataset larger than memory)
     :params aggregator: dataframe column that will be
                         filtered by unique values
     :params period_ggregator: dataframe column that will be
                               filtered by unique values and compared with
                               aggregator column
-    :params value: dataframe column containing values to be summed
+    :params value: dataframe column (or list of columns) containing values
+                   to be summed
+    :params statistic_name: statistic of "value" to use instead of the sum
+                            (one of STATISTICS)
     :return: dataframe containing aggregator vs period_aggregator with
-             the sum of "value".
+             the sum of "value" (with more than one value column, the
+             columns are pairs of value column and period).
     '''
-
-    periods = df[period_aggregator].unique() #1,2,3,4...
-
-    result = {
-        aggregator: df[aggregator].unique(), #fulano, ciclano...
-    }
-
-    for period in periods:
-        result[period] = []
-
-    for item in result[aggregator]:
-        data = df[df[aggregator]==item]
-        for period in periods:
-            data_per_period = data[data[period_aggregator]==period]
-            result[period].append(data_per_period[value].sum())
-    return pd.DataFrame(result).sort_values(by=aggregator)
\ No newline at end of file
+    values = as_list(value)
+    aggregated = aggregate(df, [aggregator, period_aggregator], values)
+    items = aggregated.index.get_level_values(0).unique()
+    periods = aggregated.index.get_level_values(1).unique()
+
+    matrices = []
+    for column in values:
+        if statistic_name == 'total':  # keep the dtype of the sums
+            values_per_period = aggregated[(column, 'total')]
+        else:
+            values_per_period = statistic(aggregated, column, statistic_name)
+        matrix = values_per_period.unstack(level=1, fill_value=0)
+        matrix = matrix.reindex(index=items, columns=periods, fill_value=0)
+        matrices.append(matrix)
+
+    result = pd.concat(matrices, axis=1, keys=values) if len(values) > 1 \
+        else matrices[0]
+    result.columns.name = None
+    result = result.rename_axis(aggregator).reset_index()
+    return result.sort_values(by=aggregator)
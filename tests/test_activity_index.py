@@ -0,0 +1,47 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from activity_index import SortedIndex, reimbursements_with  # noqa: E402
+
+
+class TestActivityIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.companies = pd.DataFrame({
+            'cnpj': ['11.222.333/0001-81', None, '00.123.456/0001-90'],
+        })
+        activities = pd.DataFrame({
+            'company_id': [0, 1, 2],
+            'cnae': [5611201, 5611201, 4930202],
+        })
+        self.index = SortedIndex.build(activities['cnae'].values,
+                                       activities['company_id'].values)
+        self.reimbursements = pd.DataFrame({
+            'cnpj_cpf': ['11222333000181', None, 'invalid', '00123456000190',
+                         '11222333000181'],
+            'document_id': [1, 2, 3, 4, 5],
+        })
+
+    def test_reimbursements_with(self):
+        found = reimbursements_with('56.11-2-01', self.reimbursements,
+                                    self.companies, self.index)
+        self.assertEqual([1, 5], found['document_id'].tolist())
+
+        found = reimbursements_with(4930202, self.reimbursements,
+                                    self.companies, self.index)
+        self.assertEqual([4], found['document_id'].tolist())
+
+    def test_lookup(self):
+        self.assertEqual([4930202, 5611201], self.index.keys.tolist())
+        self.assertEqual([0, 1], np.sort(self.index.lookup(5611201)).tolist())
+        self.assertEqual(0, len(self.index.lookup(1234567)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from catalog import Catalog  # noqa: E402
+from dataset_store import write_dataset  # noqa: E402
+
+
+class TestCatalog(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name,
+                                 '2017-01-01-reimbursements.xz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, rows):
+        data = pd.DataFrame({'document_id': range(rows)})
+        write_dataset(data, self.path, csv=True)
+
+    def test_newest(self):
+        self.write(1)
+        catalog = Catalog(self.directory.name)
+        self.assertEqual(self.path, catalog.newest('reimbursements'))
+        self.assertIsNone(catalog.newest('companies'))
+
+    def test_file_modified_in_place(self):
+        self.write(1)
+        catalog = Catalog(self.directory.name)
+        before = catalog.entry(self.path)
+
+        mtime = os.stat(self.directory.name).st_mtime_ns
+        self.write(3)
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        os.utime(self.directory.name, ns=(mtime, mtime))
+
+        after = catalog.entry(self.path)
+        self.assertEqual(3, after['rows'])
+        self.assertNotEqual(before['hash'], after['hash'])
+        self.assertEqual(3, Catalog(self.directory.name)
+                         .entry(self.path)['rows'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from pycpfcnpj import cpfcnpj, gen
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+import cnpj_cpf  # noqa: E402
+
+
+VALID = ('11.222.333/0001-81', '00.000.000/0001-91', '33000167000101',
+         '123.456.789-09', '52998224725')
+
+
+class TestValidate(unittest.TestCase):
+
+    def test_valid(self):
+        valid, reasons = cnpj_cpf.validate(VALID)
+        self.assertTrue(valid.all())
+        self.assertEqual([cnpj_cpf.VALID] * len(VALID), reasons.tolist())
+
+    def test_invalid(self):
+        values = ('11222333000182', '11.222.333/0001-18', '12345678900',
+                  '123.456.789-90', '11111111111', '00000000000000',
+                  '1234567890123', '123', '1122233300018a')
+        expected = [cnpj_cpf.WRONG_CHECK_DIGITS] * 4 + \
+            [cnpj_cpf.REPEATED_DIGITS] * 2 + [cnpj_cpf.WRONG_LENGTH] * 3
+        valid, reasons = cnpj_cpf.validate(values)
+        self.assertFalse(valid.any())
+        self.assertEqual(expected, reasons.tolist())
+
+    def test_missing(self):
+        valid, reasons = cnpj_cpf.validate([None, np.nan, '', ' '])
+        self.assertTrue(valid.all())
+        self.assertEqual([cnpj_cpf.MISSING] * 4, reasons.tolist())
+
+    def test_same_as_pycpfcnpj(self):
+        random = np.random.default_rng(3)
+        values = [''.join(map(str, random.integers(0, 10, width)))
+                  for width in random.choice([11, 14], 1000)]
+        values.extend(gen.cpf() for _ in range(500))
+        values.extend(gen.cnpj() for _ in range(500))
+        valid, _ = cnpj_cpf.validate(values)
+        mismatches = [value for value, is_valid in zip(values, valid)
+                      if cpfcnpj.validate(value) != is_valid]
+        self.assertEqual([], mismatches)
+        self.assertTrue(valid[-1000:].all())
+
+
+class TestKeys(unittest.TestCase):
+
+    def test_keys(self):
+        keys = cnpj_cpf.keys(['11.222.333/0001-81', '123.456.789-09', '123',
+                              None])
+        self.assertEqual([11222333000181, cnpj_cpf.CPF_OFFSET + 12345678909,
+                          0, 0], keys.tolist())
+        self.assertEqual(['11222333000181', '12345678909', '', ''],
+                         cnpj_cpf.from_keys(keys).tolist())
+        self.assertEqual(0, cnpj_cpf.cnpj_keys(['123.456.789-09'])[0])
+
+    def test_isin(self):
+        keys = cnpj_cpf.keys(['11222333000181', '12345678909', ''])
+        other = cnpj_cpf.keys(['12345678909', ''])
+        self.assertEqual([False, True, False],
+                         cnpj_cpf.isin(keys, other).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
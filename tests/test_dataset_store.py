@@ -0,0 +1,157 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from catalog import get_catalog  # noqa: E402
+from dataset_store import (DatasetWriter, columnar_path,  # noqa: E402
+                           iter_dataset, read_dataset, write_dataset)
+
+
+class TestDatasetWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name,
+                                 '2017-01-01-reimbursements.xz')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def chunk(self, *values):
+        return pd.DataFrame({
+            'document_id': list(range(len(values))),
+            'state': ['SP'] * len(values),
+            'net_value': values,
+        })
+
+    def test_abort_on_exception(self):
+        with self.assertRaises(RuntimeError):
+            with DatasetWriter(self.path) as writer:
+                writer.write(self.chunk(1.5, 2.25))
+                raise RuntimeError('Interrupted')
+
+        self.assertEqual([], os.listdir(self.directory.name))
+        self.assertIsNone(get_catalog(self.directory.name).entry(self.path))
+
+    def test_abort_keeps_previous_version(self):
+        with DatasetWriter(self.path) as writer:
+            writer.write(self.chunk(1.5))
+
+        with self.assertRaises(RuntimeError):
+            with DatasetWriter(self.path) as writer:
+                writer.write(self.chunk(3.0, 4.0))
+                raise RuntimeError('Interrupted')
+
+        tmp = [name for name in os.listdir(self.directory.name)
+               if name.endswith('.tmp')]
+        self.assertEqual([], tmp)
+        self.assertEqual(1, len(read_dataset(self.path)))
+        self.assertEqual(1, get_catalog(self.directory.name)
+                         .entry(self.path)['rows'])
+
+    def test_missing_values_in_first_chunk(self):
+        first = self.chunk(1.5, 2.25).assign(
+            issue_date=pd.NaT,
+            month=np.nan,
+            note=None,
+            subquota_group_description=np.nan,
+            supplier=None,
+        )
+        second = self.chunk(3.0).assign(
+            issue_date=pd.Timestamp('2017-01-01'),
+            month=1,
+            note='Reviewed',
+            subquota_group_description='Veículos automotores',
+            supplier='Posto Brasília',
+        )
+        with DatasetWriter(self.path) as writer:
+            writer.write(first)
+            writer.write(second)
+
+        data = read_dataset(self.path)
+        self.assertEqual(3, len(data))
+        last = data.iloc[-1]
+        self.assertEqual(pd.Timestamp('2017-01-01'), last['issue_date'])
+        self.assertEqual(1, last['month'])
+        self.assertEqual('Reviewed', last['note'])
+        self.assertEqual('Veículos automotores',
+                         last['subquota_group_description'])
+        self.assertEqual('Posto Brasília', last['supplier'])
+        self.assertTrue(data['supplier'].iloc[:2].isnull().all())
+
+
+class TestReadDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name,
+                                 '2017-01-01-reimbursements.xz')
+        self.data = pd.DataFrame({
+            'document_id': range(100),
+            'state': ['SP', 'RJ', None, 'MG'] * 25,
+            'year': [2016] * 50 + [2017] * 50,
+        })
+        write_dataset(self.data, self.path, row_group_size=10)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self, filters=None, columnar=True, **kwargs):
+        """Reads the dataset (from the xz CSV alone if not `columnar`)."""
+        if not columnar and os.path.isfile(columnar_path(self.path)):
+            os.remove(columnar_path(self.path))
+        return read_dataset(self.path, filters=filters, **kwargs)
+
+    def test_filters(self):
+        cases = (
+            ([('year', '=', 2017), ('document_id', '<', 60)],
+             list(range(50, 60))),
+            ([('state', 'in', ['SP', 'MG'])],
+             [n for n in range(100) if n % 4 in (0, 3)]),
+            ([('state', '!=', 'SP')], [n for n in range(100) if n % 4]),
+            ([('state', 'not in', ['SP', 'RJ'])],
+             [n for n in range(100) if n % 4 > 1]),
+        )
+        for columnar in (True, False):
+            for filters, expected in cases:
+                data = self.read(filters, columnar)
+                self.assertEqual(expected, data['document_id'].tolist())
+
+    def test_nrows_with_filters(self):
+        for columnar in (True, False):
+            filters = [('state', '=', 'MG')]
+            data = self.read(filters, columnar, nrows=15)
+            self.assertEqual(list(range(3, 60, 4)),
+                             data['document_id'].tolist())
+
+            data = self.read([('year', '=', 2015)], columnar, nrows=5)
+            self.assertTrue(data.empty)
+            self.assertIn('document_id', data.columns)
+
+    def test_iter_dataset(self):
+        chunks = list(iter_dataset(self.path, 10, columns=['document_id'],
+                                   filters=[('year', '=', 2015)]))
+        self.assertEqual(1, len(chunks))
+        self.assertEqual(['document_id'], list(chunks[0].columns))
+        self.assertTrue(chunks[0].empty)
+
+        chunks = iter_dataset(self.path, 10, filters=[('year', '>', 2016)])
+        self.assertEqual(list(range(50, 100)),
+                         pd.concat(chunks)['document_id'].tolist())
+
+    def test_csv_arguments_with_parquet(self):
+        with self.assertRaises(TypeError):
+            read_dataset(self.path, skiprows=1)
+        with self.assertRaises(TypeError):
+            next(iter_dataset(self.path, 10, sep=';'))
+        self.assertEqual(1, len(self.read(nrows=1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+import distances  # noqa: E402
+
+
+def degrees(value, minutes, seconds):
+    sign = -1 if value < 0 else 1
+    return sign * (abs(value) + minutes / 60 + seconds / 3600)
+
+
+# Vincenty's own example: Flinders Peak to Buninyong, 54,972.271 m
+FLINDERS_PEAK = degrees(-37, 57, 3.72030), degrees(144, 25, 29.52440)
+BUNINYONG = degrees(-37, 39, 10.15610), degrees(143, 55, 35.38390)
+
+
+class TestHaversine(unittest.TestCase):
+
+    def test_known_distances(self):
+        one_degree = np.pi * distances.EARTH_RADIUS / 180
+        quarter = np.pi * distances.EARTH_RADIUS / 2
+        result = distances.pairwise([0, 0, 10, 0], [0, 0, 20, 0],
+                                    [0, 1, 10, 90], [1, 0, 20, 0])
+        np.testing.assert_allclose([one_degree, one_degree, 0, quarter],
+                                   result)
+
+    def test_brasilia_to_sao_paulo(self):
+        result = distances.haversine(-15.7939, -47.8828, -23.5505, -46.6333)
+        self.assertAlmostEqual(872.3, result / 1000, places=0)
+
+
+class TestVincenty(unittest.TestCase):
+
+    def test_known_distances(self):
+        result = distances.pairwise(*FLINDERS_PEAK, *BUNINYONG,
+                                    method='vincenty')
+        self.assertAlmostEqual(54972.271, float(result), places=3)
+
+        # a degree of longitude on the equator and a quarter meridian
+        result = distances.vincenty([0, 0], [0, 0], [0, 90], [1, 0])
+        np.testing.assert_allclose([111319.491, 10001965.729], result,
+                                   atol=1e-3)
+
+    def test_same_point_nan_and_antipodes(self):
+        result = distances.vincenty([10, np.nan, 0], [20, 0, 0],
+                                    [10, 0, 0.5], [20, 0, 179.7])
+        self.assertEqual(0, result[0])
+        self.assertTrue(np.isnan(result[1]))
+        self.assertTrue(np.isfinite(result[2]))
+
+    def test_close_to_haversine(self):
+        random = np.random.default_rng(7)
+        lat1, lat2 = random.uniform(-33, 5, (2, 100))
+        lon1, lon2 = random.uniform(-73, -35, (2, 100))
+        haversine = distances.haversine(lat1, lon1, lat2, lon2)
+        vincenty = distances.vincenty(lat1, lon1, lat2, lon2)
+        # the sphere is off from the ellipsoid by up to about 0.5%
+        np.testing.assert_allclose(haversine, vincenty, rtol=0.01)
+
+
+class TestGroups(unittest.TestCase):
+
+    def test_path_length_and_all_pairs(self):
+        lat = [0, 0, 0, 10, 10]
+        lon = [0, 1, 2, 20, 20]
+        offsets = distances.segment_offsets(np.array([1, 1, 1, 2, 2]))
+        self.assertEqual([0, 3, 5], offsets.tolist())
+        one_degree = np.pi * distances.EARTH_RADIUS / 180
+        np.testing.assert_allclose([2 * one_degree, 0],
+                                   distances.path_length(lat, lon, offsets))
+        np.testing.assert_allclose([4 * one_degree, 0],
+                                   distances.all_pairs_sum(lat, lon, offsets))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+import pandas as pd
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from fetch_receipts import (Candidates, Downloader, Manifest,  # noqa: E402
+                            Receipt)
+
+
+class StandInServer:
+    """Serves receipts as the Lower House does, failing on demand."""
+
+    def __init__(self, failures=None):
+        self.failures = dict(failures or {})  # document_id: HTTP statuses
+        self.requests = []
+        self.connections = set()
+        app = web.Application()
+        app.router.add_get('/{applicant}/{year}/{document}.pdf', self.receipt)
+        self.server = TestServer(app)
+
+    async def receipt(self, request):
+        document = request.match_info['document']
+        self.requests.append(document)
+        self.connections.add(request.transport.get_extra_info('peername'))
+        failures = self.failures.get(document)
+        if failures:
+            return web.Response(status=failures.pop(0))
+        await asyncio.sleep(0.001)
+        return web.Response(body=document.encode() * 1000)
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.target = self.directory.name
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        self.directory.cleanup()
+
+    def download(self, server, documents, **kwargs):
+        progress = {'count': 0, 'size': 0, 'pending': 0,
+                    'start': time.time(), 'errors': []}
+        manifest = Manifest(self.target)
+        data = pd.DataFrame({'applicant_id': 1, 'year': 2017,
+                             'document_id': documents})
+        receipts = iter(Candidates(data[manifest.missing(data)], self.target))
+        downloader = Downloader(manifest, backoff=0.001, **kwargs)
+
+        async def run():
+            await server.server.start_server()
+            url = str(server.server.make_url('/'))
+            try:
+                with mock.patch.object(Receipt, 'BASE_URL', url):
+                    return await downloader.run(receipts, progress)
+            finally:
+                await server.server.close()
+
+        with mock.patch('sys.stdout'):
+            return self.loop.run_until_complete(run())
+
+    def test_download(self):
+        server = StandInServer()
+        progress = self.download(server, list(range(1, 41)), concurrency=4)
+
+        self.assertEqual(40, progress['count'])
+        self.assertEqual(sum(len(str(n)) * 1000 for n in range(1, 41)),
+                         progress['size'])
+        self.assertEqual([], progress['errors'])
+        path = Receipt(1, 2017, 7, self.target).path
+        with open(path, 'rb') as fh:
+            self.assertEqual(b'7' * 1000, fh.read())
+        self.assertEqual(40, len(Manifest(self.target).data))
+        # connections are pooled (kept alive and reused)
+        self.assertLessEqual(len(server.connections), 4)
+
+    def test_retries(self):
+        server = StandInServer({'1': [500, 503], '2': [404]})
+        progress = self.download(server, [1, 2], retries=3)
+
+        self.assertEqual(1, progress['count'])
+        self.assertEqual(['1', '1', '1', '2'], sorted(server.requests))
+        self.assertEqual(1, len(progress['errors']))
+        self.assertTrue(progress['errors'][0].endswith('/1/2017/2.pdf'))
+        files = os.listdir(os.path.dirname(Receipt(1, 2017, 1,
+                                                   self.target).path))
+        self.assertEqual(['1.pdf'], files)  # no temporary files left
+
+    def test_resume(self):
+        server = StandInServer({'3': [404]})
+        self.download(server, [1, 2, 3])
+
+        server = StandInServer()
+        progress = self.download(server, [1, 2, 3, 4])
+        self.assertEqual(['3', '4'], sorted(server.requests))
+        self.assertEqual(2, progress['count'])
+        self.assertEqual(4, len(Manifest(self.target).data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from fetch_sex_places import group_by_spot, share_place  # noqa: E402
+
+
+class TestGroupBySpot(unittest.TestCase):
+
+    def test_group_by_spot(self):
+        companies = pd.DataFrame({
+            'latitude': ['-15.8', '', '-15.8', '-15.81', '-15.8'],
+            'longitude': ['-47.9', '', '-47.9', '-47.91', '-47.9']
+        })
+        spots = sorted(sorted(spot) for spot in group_by_spot(companies))
+        self.assertEqual([[0, 2, 4], [1], [3]], spots)
+        for spot in group_by_spot(companies):
+            self.assertEqual(min(spot), spot[0])
+
+    def test_group_by_spot_without_coordinates(self):
+        companies = pd.DataFrame({'latitude': [''], 'longitude': ['']})
+        self.assertEqual([[0]], group_by_spot(companies))
+
+
+class TestSharePlace(unittest.TestCase):
+
+    def test_share_place(self):
+        place = {'id': 'abc', 'name': 'Motel', 'latitude': -15.8,
+                 'longitude': -47.9, 'distance': 0.0, 'cnpj': '1'}
+        company = {'cnpj': '2', 'name': 'Company', 'trade_name': 'Trade',
+                   'latitude': '-15.801', 'longitude': '-47.9'}
+        shared = share_place(place, company)
+        self.assertEqual('abc', shared['id'])
+        self.assertEqual('2', shared['cnpj'])
+        self.assertEqual('Company', shared['company_name'])
+        self.assertEqual('Trade', shared['company_trade_name'])
+        self.assertAlmostEqual(110.7, shared['distance'], places=0)
+        self.assertEqual('1', place['cnpj'])
+
+
+if __name__ == '__main__':
+    unittest.main()
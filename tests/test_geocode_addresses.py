@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+import geocode_addresses  # noqa: E402
+from rate_limit import RateLimiter  # noqa: E402
+
+
+class TestGeocodeAddresses(unittest.TestCase):
+
+    def test_bounded_workers(self):
+        running = []
+        peak = []
+
+        async def geocode_address(address, key, limiter):
+            running.append(address)
+            peak.append(len(running))
+            await asyncio.sleep(0.001)
+            running.remove(address)
+            return float(address), -float(address)
+
+        limiter = RateLimiter('Test', rate=1000, concurrency=4)
+        addresses = [str(number) for number in range(50)]
+        with mock.patch.object(geocode_addresses, 'geocode_address',
+                               geocode_address):
+            loop = asyncio.new_event_loop()
+            locations = loop.run_until_complete(
+                geocode_addresses.geocode_addresses(addresses, 'key', limiter))
+
+        self.assertEqual(4, max(peak))
+        self.assertEqual((50, 2), locations.shape)
+        self.assertEqual([49.0, -49.0], locations[49].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from dataset_store import read_dataset  # noqa: E402
+from group_receipts import Reimbursements  # noqa: E402
+from schema import cast  # noqa: E402
+
+
+def receipts(year, values):
+    return pd.DataFrame({
+        'applicant_id': 1,
+        'batch_number': range(1, len(values) + 1),
+        'cnpj_cpf': '11222333000181',
+        'congressperson_document': 1,
+        'congressperson_id': 1,
+        'congressperson_name': 'Fulana',
+        'document_id': year,
+        'document_number': '1',
+        'document_type': 0,
+        'document_value': values,
+        'installment': 0,
+        'issue_date': '{}-01-01'.format(year),
+        'leg_of_the_trip': None,
+        'month': 1,
+        'net_value': values,
+        'party': 'PT',
+        'passenger': None,
+        'reimbursement_number': 1,
+        'reimbursement_value': 0.0,
+        'remark_value': 0.0,
+        'state': 'SP',
+        'subquota_description': 'Congressperson meal',
+        'subquota_group_description': None,
+        'subquota_group_id': 0,
+        'subquota_number': 13,
+        'supplier': 'Restaurante',
+        'term': 2015,
+        'term_id': 55,
+        'year': year,
+    })
+
+
+class TestGroup(unittest.TestCase):
+
+    def test_group(self):
+        data = cast(pd.concat([receipts(2017, [10.0, 20.0]),
+                               receipts(2016, [30.0])]))
+        grouped = Reimbursements().group(data)
+        self.assertEqual([2016, 2017, 2017], grouped['year'].tolist())
+        self.assertEqual([3000] * 3, grouped['total_net_value'].tolist())
+        self.assertEqual(['1'] * 3, grouped['reimbursement_numbers'].tolist())
+
+    def test_group_without_receipts(self):
+        data = cast(receipts(2017, [10.0]).iloc[:0])
+        grouped = Reimbursements().group(data)
+        self.assertTrue(grouped.empty)
+        self.assertIn('reimbursement_numbers', grouped.columns)
+        self.assertIn('total_net_value', grouped.columns)
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        path = self.directory.name
+
+        class Fixture(Reimbursements):
+            DATA_PATH = path
+            PARTITIONS_PATH = os.path.join(path, 'reimbursements')
+            MANIFEST_PATH = os.path.join(PARTITIONS_PATH, 'manifest.json')
+
+        self.reimbursements = Fixture()
+        self.output = os.path.join(path, Fixture.FILE_BASE_NAME)
+        self.write_input('current-year', receipts(2017, [10.0, 20.0]))
+        self.write_input('last-year', receipts(2016, [30.0]))
+        self.write_input('previous-years', receipts(2015, [40.0]))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write_input(self, name, data):
+        filename = '2017-01-01-{}.xz'.format(name)
+        data.to_csv(os.path.join(self.directory.name, filename), index=False)
+
+    def totals(self):
+        data = read_dataset(self.output)
+        return dict(zip(data['year'], data['total_net_value']))
+
+    def test_input_rewritten_in_place(self):
+        self.reimbursements.incremental()
+        self.assertEqual({2015: 4000, 2016: 3000, 2017: 3000}, self.totals())
+
+        directory = os.stat(self.directory.name).st_mtime_ns
+        self.write_input('last-year', receipts(2016, [30.0, 50.0]))
+        os.utime(self.directory.name, ns=(directory, directory))
+
+        self.reimbursements.incremental()
+        self.assertEqual({2015: 4000, 2016: 8000, 2017: 3000}, self.totals())
+
+    def test_interrupted_assemble(self):
+        self.reimbursements.incremental()
+        manifest = self.reimbursements.load_manifest()
+        with open(self.output, 'rb') as fh:
+            assembled = fh.read()
+
+        partition = self.reimbursements.partition_path('2016')
+        os.remove(partition)
+        with self.assertRaises(OSError):
+            self.reimbursements.assemble(manifest)
+
+        with open(self.output, 'rb') as fh:
+            self.assertEqual(assembled, fh.read())
+        self.assertFalse(os.path.exists(self.output + '.tmp'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from http_cache import (CachedResponse, ResponseCache,  # noqa: E402
+                        async_get, get, is_cacheable, normalize)
+
+
+def response(content, status_code=200, content_type=None):
+    return CachedResponse('https://api.test/', status_code, content,
+                          content_type=content_type)
+
+
+class TestIsCacheable(unittest.TestCase):
+
+    def test_cacheable(self):
+        self.assertTrue(is_cacheable(response(b'{"status": "OK"}')))
+        self.assertTrue(is_cacheable(response(b'{"status": "ZERO_RESULTS"}')))
+        self.assertTrue(is_cacheable(response(b'{"results": []}')))
+        self.assertTrue(is_cacheable(response(b'[1, 2]')))
+        self.assertTrue(is_cacheable(response(b'<html>Deputado</html>',
+                                              content_type='text/html')))
+
+    def test_not_cacheable(self):
+        self.assertFalse(is_cacheable(response(b'{"status": "OK"}', 500)))
+        self.assertFalse(is_cacheable(response(b'', 429)))
+        self.assertFalse(is_cacheable(response(b'{"status": "ERROR"}')))
+        self.assertFalse(is_cacheable(
+            response(b'{"status": "OVER_QUERY_LIMIT"}')))
+        self.assertFalse(is_cacheable(response(b'<p>OVER_QUERY_LIMIT</p>',
+                                               content_type='text/html')))
+        self.assertFalse(is_cacheable(response(b'{"status": ')))
+        self.assertFalse(is_cacheable(
+            response(b'<html>Error</html>',
+                     content_type='application/json')))
+
+
+class TestResponseCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'http.db')
+        self.cache = ResponseCache(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_miss_and_hit(self):
+        url = 'https://api.test/search'
+        self.assertIsNone(self.cache.get(url, {'q': 'a'}))
+        self.cache.set(url, {'q': 'a'}, response(b'{"status": "OK"}'))
+        cached = self.cache.get(url, {'q': 'a'})
+        self.assertTrue(cached.cached)
+        self.assertEqual(200, cached.status_code)
+        self.assertEqual({'status': 'OK'}, cached.json())
+        self.assertIsNone(self.cache.get(url, {'q': 'b'}))
+
+    def test_equivalent_urls_share_an_entry(self):
+        self.cache.set('HTTPS://API.test/search?b=2&key=secret', {'a': 1},
+                       response(b'{}'))
+        self.assertIsNotNone(
+            self.cache.get('https://api.test/search?a=1&b=2&key=other'))
+        self.assertEqual('https://api.test/search?a=1&b=2',
+                         normalize('https://API.test/search?b=2&a=1#top'))
+
+    def test_expired_entries(self):
+        self.cache.set('https://api.test/', None, response(b'{}'), ttl=1)
+        with mock.patch('http_cache.time.time', return_value=time.time() + 2):
+            self.assertIsNone(self.cache.get('https://api.test/'))
+        self.assertIsNone(self.cache.get('https://api.test/'))
+
+    def test_evict_least_recently_used(self):
+        cache = ResponseCache(self.path, max_size=20)
+        for name in ('first', 'second', 'third'):
+            cache.set('https://api.test/' + name, None, response(b'x' * 10))
+        cache.get('https://api.test/first')
+        cache.evict()
+        self.assertIsNotNone(cache.get('https://api.test/first'))
+        self.assertIsNone(cache.get('https://api.test/second'))
+        self.assertIsNotNone(cache.get('https://api.test/third'))
+
+
+class TestGet(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.directory.name, 'db'))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def raw(self, content, status_code=200):
+        return mock.Mock(status_code=status_code, content=content,
+                         headers={'Content-Type': 'application/json'})
+
+    def test_get_sends_requests_on_misses_only(self):
+        with mock.patch('http_cache.requests.get') as request:
+            request.return_value = self.raw(b'{"status": "OK"}')
+            first = get('https://api.test/', {'q': 'a'}, cache=self.cache)
+            second = get('https://api.test/', {'q': 'a'}, cache=self.cache)
+        self.assertEqual(1, request.call_count)
+        self.assertFalse(first.cached)
+        self.assertTrue(second.cached)
+        self.assertEqual(first.content, second.content)
+
+    def test_get_does_not_cache_errors(self):
+        with mock.patch('http_cache.requests.get') as request:
+            request.return_value = self.raw(b'{"status": "REQUEST_DENIED"}')
+            get('https://api.test/', cache=self.cache)
+            get('https://api.test/', cache=self.cache)
+        self.assertEqual(2, request.call_count)
+
+    def test_async_get(self):
+        requests = []
+
+        async def handler(request):
+            requests.append(request.query['q'])
+            return web.json_response({'status': 'OK'})
+
+        async def fetch():
+            app = web.Application()
+            app.router.add_get('/search', handler)
+            async with TestServer(app) as server:
+                url = str(server.make_url('/search'))
+                for query in ('a', 'a', 'b'):
+                    await async_get(url, {'q': query}, cache=self.cache)
+            cached = await async_get(url, {'q': 'a'}, cache=self.cache)
+            return cached
+
+        loop = asyncio.new_event_loop()
+        try:
+            cached = loop.run_until_complete(fetch())
+        finally:
+            loop.close()
+        self.assertEqual(['a', 'b'], requests)
+        self.assertTrue(cached.cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import asyncio
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from http_cache import CachedResponse  # noqa: E402
+from rate_limit import RateLimiter, is_throttled  # noqa: E402
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+class Clock:
+    """Stands for time.monotonic, moving only when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch('rate_limit.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket(self):
+        limiter = RateLimiter('Test', rate=2, concurrency=10, burst=3)
+        for _ in range(3):
+            self.assertEqual(0, limiter.try_acquire())
+        self.assertAlmostEqual(0.5, limiter.try_acquire())
+
+        self.clock.now += 0.25
+        self.assertAlmostEqual(0.25, limiter.try_acquire())
+        self.clock.now += 0.25
+        self.assertEqual(0, limiter.try_acquire())
+        self.assertEqual(4, limiter.in_flight)
+
+    def test_token_bucket_does_not_overflow(self):
+        limiter = RateLimiter('Test', rate=2, concurrency=10, burst=3)
+        self.clock.now += 60
+        for _ in range(3):
+            self.assertEqual(0, limiter.try_acquire())
+        self.assertGreater(limiter.try_acquire(), 0)
+
+    def test_concurrency(self):
+        limiter = RateLimiter('Test', rate=100, concurrency=2)
+        self.assertEqual(0, limiter.try_acquire())
+        self.assertEqual(0, limiter.try_acquire())
+        self.assertGreater(limiter.try_acquire(), 0)
+        limiter.release()
+        self.assertEqual(0, limiter.try_acquire())
+
+    def test_throttle_halves_concurrency_and_rate(self):
+        limiter = RateLimiter('Test', rate=10, concurrency=8)
+        limiter.throttle()
+        self.assertEqual(4, limiter.concurrency)
+        self.assertEqual(5, limiter.rate)
+        self.assertEqual(0, limiter.tokens)
+
+        limiter.throttle()  # same burst of rejected requests
+        self.assertEqual(4, limiter.concurrency)
+        self.clock.now += 1
+        limiter.throttle()
+        self.assertEqual(2, limiter.concurrency)
+        self.assertEqual(2.5, limiter.rate)
+        self.assertEqual(3, limiter.throttled)
+
+    def test_throttle_floor(self):
+        limiter = RateLimiter('Test', rate=10, concurrency=2)
+        for _ in range(20):
+            self.clock.now += 100
+            limiter.throttle()
+        self.assertEqual(1, limiter.concurrency)
+        self.assertAlmostEqual(0.1, limiter.rate)
+
+    def test_success_increases_concurrency_and_rate(self):
+        limiter = RateLimiter('Test', rate=10, concurrency=8)
+        limiter.throttle()
+        limiter.success()
+        self.assertAlmostEqual(4.25, limiter.concurrency)
+        self.assertAlmostEqual(5.1, limiter.rate)
+        for _ in range(1000):
+            limiter.success()
+        self.assertEqual(8, limiter.concurrency)
+        self.assertEqual(10, limiter.rate)
+
+    def test_done(self):
+        limiter = RateLimiter('Test', rate=10)
+        ok = CachedResponse('https://api.test/', 200, b'{"status": "OK"}')
+        quota = CachedResponse('https://api.test/', 200,
+                               b'{"status": "OVER_QUERY_LIMIT"}')
+        self.assertTrue(limiter.done(ok))
+        self.assertFalse(limiter.done(quota))
+        self.assertEqual(2, limiter.requests)
+        self.assertEqual(1, limiter.throttled)
+
+    def test_is_throttled(self):
+        self.assertTrue(is_throttled(CachedResponse('', 429, b'')))
+        self.assertFalse(is_throttled(CachedResponse('', 200, b'{}')))
+
+
+class TestAsyncRateLimiter(unittest.TestCase):
+
+    def test_waiters_served_in_order(self):
+        limiter = RateLimiter('Test', rate=1000, concurrency=1, burst=1000)
+        served = []
+
+        async def request(number):
+            async with limiter:
+                served.append(number)
+                await asyncio.sleep(0.001)
+
+        async def requests():
+            await asyncio.gather(*(request(number) for number in range(20)))
+
+        run(requests())
+        self.assertEqual(list(range(20)), served)
+        self.assertEqual(0, limiter.in_flight)
+        self.assertFalse(limiter.waiters)
+
+    def test_cancelled_waiter_leaves_the_line(self):
+        limiter = RateLimiter('Test', rate=1000, concurrency=1, burst=1000)
+        served = []
+
+        async def request(number):
+            async with limiter:
+                served.append(number)
+                await asyncio.sleep(0.01)
+
+        async def requests():
+            tasks = [asyncio.ensure_future(request(n)) for n in range(3)]
+            await asyncio.sleep(0.001)
+            tasks[1].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        run(requests())
+        self.assertEqual([0, 2], served)
+        self.assertFalse(limiter.waiters)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from spatial_index import SpatialIndex  # noqa: E402
+
+
+class TestSpatialIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = SpatialIndex(latitude=[-15.8, -15.81, -23.5, np.nan],
+                                  longitude=[-47.9, -47.91, -46.6, 1.0])
+
+    def test_neighbors(self):
+        distances, rows = self.index.neighbors([0, 2])
+        self.assertEqual([[1], [1]], rows.tolist())
+        self.assertTrue((distances > 0).all())
+
+    def test_neighbors_of_rows_not_in_the_index(self):
+        for rows in ([3], [100], [0, 3]):
+            with self.assertRaises(KeyError):
+                self.index.neighbors(rows)
+
+
+if __name__ == '__main__':
+    unittest.main()
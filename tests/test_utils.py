@@ -0,0 +1,140 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from utils import (  # noqa: E402
+    find_sum_of_values,
+    find_sum_of_values_per_period,
+    iter_data_dataframes
+)
+
+
+def loop_sum_of_values(df, aggregator, value):
+    """The scan over each unique value that find_sum_of_values replaced."""
+    result = {
+        'occurences': [],
+        aggregator: df[aggregator].unique(),
+        value + '_max': [],
+        value + '_mean': [],
+        value + '_min': [],
+        value + '_total': [],
+    }
+    for item in result[aggregator]:
+        data = df[df[aggregator] == item]
+        total = float(data[value].sum())
+        occurences = float(data[value].count())
+        result['occurences'].append(occurences)
+        result[value + '_max'].append(np.max(data[value]))
+        result[value + '_mean'].append(total / occurences if occurences
+                                       else 0)
+        result[value + '_min'].append(np.min(data[value]))
+        result[value + '_total'].append(total)
+    return pd.DataFrame(result).sort_values(by=aggregator)
+
+
+def loop_sum_of_values_per_period(df, aggregator, period_aggregator, value):
+    """The scan that find_sum_of_values_per_period replaced."""
+    periods = df[period_aggregator].unique()
+    result = {aggregator: df[aggregator].unique()}
+    for period in periods:
+        result[period] = []
+    for item in result[aggregator]:
+        data = df[df[aggregator] == item]
+        for period in periods:
+            data_per_period = data[data[period_aggregator] == period]
+            result[period].append(data_per_period[value].sum())
+    return pd.DataFrame(result).sort_values(by=aggregator)
+
+
+def chunks(df, size):
+    return (df.iloc[start:start + size] for start in range(0, len(df), size))
+
+
+class TestFindSumOfValues(unittest.TestCase):
+
+    def setUp(self):
+        random = np.random.default_rng(42)
+        size = 500
+        self.df = pd.DataFrame({
+            'name': random.choice(['A', 'B', 'C', 'D', None], size),
+            'month': random.choice([1, 2, 3], size),
+            'value': np.where(random.random(size) < .1, np.nan,
+                              random.random(size) * 100),
+            'other': random.random(size)
+        })
+        self.df.loc[self.df.name == 'D', 'value'] = np.nan
+
+    def assertSameFrame(self, expected, result):
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True),
+                                      result.reset_index(drop=True),
+                                      check_dtype=False,
+                                      check_column_type=False)
+
+    def test_find_sum_of_values(self):
+        expected = loop_sum_of_values(self.df, 'name', 'value')
+        self.assertSameFrame(expected,
+                             find_sum_of_values(self.df, 'name', 'value'))
+
+    def test_find_sum_of_values_with_null_keys(self):
+        result = find_sum_of_values(self.df, 'name', 'value')
+        nulls = result[result.name.isnull()].iloc[0]
+        self.assertEqual(0, nulls.occurences)
+        self.assertEqual(0, nulls.value_total)
+        self.assertEqual(0, nulls.value_mean)
+        self.assertTrue(np.isnan(nulls.value_max))
+
+    def test_find_sum_of_values_without_values(self):
+        result = find_sum_of_values(self.df, 'name', 'value')
+        empty = result[result.name == 'D'].iloc[0]
+        self.assertEqual(0, empty.occurences)
+        self.assertEqual(0, empty.value_mean)
+
+    def test_find_sum_of_values_of_many_columns(self):
+        result = find_sum_of_values(self.df, 'name', ['value', 'other'])
+        self.assertIn('value_occurences', result.columns)
+        self.assertIn('other_occurences', result.columns)
+        self.assertNotIn('occurences', result.columns)
+        for column in ('value', 'other'):
+            expected = loop_sum_of_values(self.df, 'name', column)
+            for name in ('occurences', 'max', 'mean', 'min', 'total'):
+                label = '{}_{}'.format(column, name)
+                expected_label = 'occurences' if name == 'occurences' \
+                    else label
+                np.testing.assert_allclose(expected[expected_label].values,
+                                           result[label].values)
+
+    def test_find_sum_of_values_of_chunks(self):
+        expected = loop_sum_of_values(self.df, 'name', 'value')
+        result = find_sum_of_values(chunks(self.df, 70), 'name', 'value')
+        self.assertSameFrame(expected, result)
+
+    def test_find_sum_of_values_per_period(self):
+        df = self.df[self.df.name.notnull()]
+        expected = loop_sum_of_values_per_period(df, 'name', 'month', 'value')
+        result = find_sum_of_values_per_period(df, 'name', 'month', 'value')
+        self.assertSameFrame(expected, result)
+        result = find_sum_of_values_per_period(chunks(df, 70), 'name',
+                                               'month', 'value')
+        self.assertSameFrame(expected, result)
+
+    def test_find_sum_of_values_of_data_files(self):
+        with TemporaryDirectory() as directory:
+            for year, df in ((2015, self.df[:250]), (2016, self.df[250:])):
+                name = '2017-01-01-{}.xz'.format(year)
+                df.to_csv(os.path.join(directory, name), index=False,
+                          compression='xz')
+            dataframes = iter_data_dataframes(
+                directory, columns=('name', 'value'), chunksize=60)
+            result = find_sum_of_values(dataframes, 'name', 'value')
+        expected = loop_sum_of_values(self.df, 'name', 'value')
+        self.assertSameFrame(expected, result)
+
+
+if __name__ == '__main__':
+    unittest.main()